@@ -0,0 +1,195 @@
+"""
+Processus « chaud » d'exécution de playbooks, utilisé par le backend 'warm_pool'.
+
+Au démarrage, le worker charge une seule fois l'API Ansible, les plugins,
+l'inventaire, les secrets du coffre et le playbook (mis en cache par le
+DataLoader). Il exécute ensuite les runs demandés un par un, en process :
+
+    stdin  : une requête JSON par ligne : {"service", "user_action", "payload"[, "target"][, "_forks"]}
+    stdout : une réponse JSON par ligne : {"return_code", "output", "stderr"}
+
+'output' a la même forme que la sortie du callback 'json' d'Ansible, afin
+d'être analysé par app.services.summarize comme le backend 'subprocess'.
+
+Lancement : python -m app.ansible_worker --inventory ... --playbook ... [--vault-password-file ...]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Tuple
+
+
+def _now() -> str:
+    # Même format d'horodatage que le callback 'json' (UTC).
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _build_collector(CallbackBase):
+    """Construit le callback qui reproduit la sortie du callback 'json' d'Ansible."""
+
+    class ResultCollector(CallbackBase):
+        CALLBACK_VERSION = 2.0
+        CALLBACK_TYPE = 'stdout'
+        CALLBACK_NAME = 'api_result_collector'
+
+        def __init__(self):
+            super().__init__()
+            self.results: Dict[str, Any] = {'plays': [], 'stats': {}}
+            self._tasks: Dict[str, Dict[str, Any]] = {}
+
+        def v2_playbook_on_play_start(self, play):
+            self.results['plays'].append({'play': {'name': play.get_name()}, 'tasks': []})
+
+        def v2_playbook_on_task_start(self, task, is_conditional):
+            entry = {'task': {'name': task.get_name(), 'duration': {'start': _now()}}, 'hosts': {}}
+            self._tasks[task._uuid] = entry
+            self.results['plays'][-1]['tasks'].append(entry)
+
+        def v2_playbook_on_handler_task_start(self, task):
+            self.v2_playbook_on_task_start(task, False)
+
+        def _record(self, result, **flags):
+            entry = self._tasks.get(result._task._uuid)
+            if entry is None:
+                return
+            res = dict(result._result)
+            res.update(flags, action=result._task.action)
+            entry['hosts'][result._host.get_name()] = res
+            entry['task']['duration']['end'] = _now()
+
+        def v2_runner_on_ok(self, result):
+            self._record(result)
+
+        def v2_runner_on_failed(self, result, ignore_errors=False):
+            self._record(result, failed=True)
+
+        def v2_runner_on_unreachable(self, result):
+            self._record(result, unreachable=True)
+
+        def v2_runner_on_skipped(self, result):
+            self._record(result, skipped=True)
+
+        def v2_playbook_on_stats(self, stats):
+            for host in sorted(stats.processed.keys()):
+                self.results['stats'][host] = stats.summarize(host)
+
+    return ResultCollector
+
+
+class WarmAnsible:
+    """Contexte Ansible chargé une seule fois et réutilisé pour chaque run."""
+
+    def __init__(self, inventory: str, playbook: str, vault_password_file: str = None):
+        from ansible import context
+        from ansible.cli import CLI
+        from ansible.executor.playbook_executor import PlaybookExecutor
+        from ansible.inventory.manager import InventoryManager
+        from ansible.module_utils.common.collections import ImmutableDict
+        from ansible.parsing.dataloader import DataLoader
+        from ansible.plugins.callback import CallbackBase
+        from ansible.vars.manager import VariableManager
+        try:
+            # ansible-core >= 2.15 demande une initialisation explicite des plugins.
+            from ansible.plugins.loader import init_plugin_loader
+            init_plugin_loader()
+        except ImportError:
+            pass
+
+        self._PlaybookExecutor = PlaybookExecutor
+        self._Collector = _build_collector(CallbackBase)
+        self._context = context
+        self._ImmutableDict = ImmutableDict
+        self.playbook = playbook
+
+        context.CLIARGS = ImmutableDict(
+            connection='smart', module_path=None, forks=5, become=None, become_method=None,
+            become_user=None, check=False, diff=False, verbosity=0, syntax=False,
+            listhosts=False, listtasks=False, listtags=False, start_at_task=None,
+            tags=['all'], skip_tags=[], extra_vars=[], vault_ids=[],
+            vault_password_files=[vault_password_file] if vault_password_file else [],
+        )
+        self.loader = DataLoader()
+        if vault_password_file:
+            secrets = CLI.setup_vault_secrets(
+                self.loader, vault_ids=[], vault_password_files=[vault_password_file]
+            )
+            self.loader.set_vault_secrets(secrets)
+        self.inventory = InventoryManager(loader=self.loader, sources=[inventory])
+        self.variable_manager = VariableManager(loader=self.loader, inventory=self.inventory)
+
+        # Préchargement : le DataLoader garde en cache le YAML du playbook et des
+        # fichiers de variables (déchiffrés), les runs suivants ne les relisent plus.
+        playbook_data = self.loader.load_from_file(playbook)
+        for play in playbook_data or []:
+            for vars_file in play.get('vars_files', []):
+                path = os.path.join(os.path.dirname(os.path.abspath(playbook)), vars_file)
+                if os.path.exists(path):
+                    self.loader.load_from_file(path)
+
+    def run(self, extra_vars: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        # '_forks' n'est pas une variable du playbook : c'est le parallélisme du run.
+        forks = extra_vars.pop('_forks', None)
+        if forks and forks != self._context.CLIARGS['forks']:
+            self._context.CLIARGS = self._ImmutableDict({**self._context.CLIARGS, 'forks': forks})
+        # Les variables 'register' d'un run précédent ne doivent pas fuiter dans le suivant.
+        self.variable_manager._nonpersistent_fact_cache.clear()
+        self.variable_manager._extra_vars = extra_vars
+        self.inventory.clear_pattern_cache()
+
+        collector = self._Collector()
+        executor = self._PlaybookExecutor(
+            playbooks=[self.playbook], inventory=self.inventory,
+            variable_manager=self.variable_manager, loader=self.loader, passwords={},
+        )
+        executor._tqm._stdout_callback = collector
+        return_code = executor.run()
+        return return_code, collector.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker Ansible persistant.")
+    parser.add_argument('--inventory', required=True)
+    parser.add_argument('--playbook', required=True)
+    parser.add_argument('--vault-password-file', default=None)
+    args = parser.parse_args()
+
+    # stdout est réservé au protocole : on en garde une copie, puis tout ce
+    # qu'Ansible affiche (stdout et stderr) est redirigé vers un fichier par run.
+    protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+    capture = tempfile.TemporaryFile(mode='w+')
+    os.dup2(capture.fileno(), 1)
+    os.dup2(capture.fileno(), 2)
+
+    start = time.perf_counter()
+    try:
+        ansible = WarmAnsible(args.inventory, args.playbook, args.vault_password_file)
+    except Exception as e:
+        protocol.write(json.dumps({'ready': False, 'error': str(e)}) + '\n')
+        return 1
+    protocol.write(json.dumps({'ready': True, 'startup': time.perf_counter() - start}) + '\n')
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        capture.seek(0)
+        capture.truncate()
+        try:
+            return_code, output = ansible.run(json.loads(line))
+        except Exception as e:
+            return_code, output = 250, {'plays': [], 'stats': {}}
+            print(f"ERREUR worker: {e}", file=sys.stderr)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        capture.seek(0)
+        protocol.write(json.dumps(
+            {'return_code': return_code, 'output': output, 'stderr': capture.read()}, default=str
+        ) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,58 @@
 import sqlite3
 import os
+import csv
+import io
+import json
+import bisect
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-METRICS_DB_FILE = "metrics.db"
+from app.metrics import SQLITE_WRITE
+
+METRICS_DB_FILE = os.environ.get("METRICS_DB_FILE", "metrics.db")
+# Le writer de métriques écrit par lots : dès METRICS_FLUSH_SIZE lignes en
+# attente, ou au plus tard METRICS_FLUSH_INTERVAL secondes après la première.
+METRICS_FLUSH_SIZE = int(os.environ.get("METRICS_FLUSH_SIZE", "200"))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1.0"))
+
+# --- Agrégats (rollups) des exécutions ---
+# Bornes supérieures (secondes) des intervalles de l'histogramme des durées :
+# progression géométrique de raison 1.25, de 10 ms à ~25 min. Les percentiles
+# calculés depuis les agrégats ont donc une erreur relative d'au plus 25 %.
+DURATION_BUCKETS = tuple(round(0.01 * 1.25 ** i, 4) for i in range(54))
+# Table, longueur du préfixe d'horodatage conservé et suffixe, par granularité.
+ROLLUP_TABLES = {
+    'minute': ('playbook_runs_minute', 16, ':00'),
+    'hour':   ('playbook_runs_hour', 13, ':00:00'),
+}
+# Fenêtres proposées par l'API de statistiques (secondes).
+STATS_WINDOWS = {
+    '5m': 300, '15m': 900, '1h': 3600, '6h': 21600,
+    '24h': 86400, '7d': 604800, '30d': 2592000,
+}
+# Jusqu'à cette fenêtre (secondes), les statistiques sont lues dans les agrégats par minute.
+MINUTE_ROLLUP_MAX_WINDOW = 86400
+
+# --- Rétention de l'historique ---
+# Durée (jours) de conservation des runs bruts ('playbook_runs', 'run_task_timings') ;
+# 0 pour tout garder. Au-delà, un run n'est plus compté que dans les agrégats par heure.
+RUNS_RETENTION_DAYS = float(os.environ.get("API_RUNS_RETENTION_DAYS", "30"))
+# Durée (jours) de conservation des agrégats par minute, lus jusqu'aux fenêtres de 24 h.
+MINUTE_ROLLUP_RETENTION_DAYS = float(os.environ.get("API_MINUTE_ROLLUP_RETENTION_DAYS", "2"))
+# Durée (jours) de conservation de la sortie brute des runs terminés (fichier et entrée 'run_logs').
+RUN_LOGS_RETENTION_DAYS = float(os.environ.get("API_RUN_LOGS_RETENTION_DAYS", "7"))
+# Durée (jours) de conservation des jobs terminés.
+JOBS_RETENTION_DAYS = float(os.environ.get("API_JOBS_RETENTION_DAYS", "30"))
+# Lignes supprimées par transaction, et pages libérées rendues par étape de vacuum :
+# chaque transaction est courte et le writer de métriques n'attend presque pas.
+RETENTION_BATCH_ROWS = int(os.environ.get("API_RETENTION_BATCH_ROWS", "2000"))
+VACUUM_BATCH_PAGES = int(os.environ.get("API_VACUUM_BATCH_PAGES", "500"))
+# Taille maximale (Mo) d'une base existante passée en vacuum incrémental par la
+# passe de rétention (VACUUM complet, qui bloque les autres écritures le temps
+# de réécrire le fichier) ; au-delà, ou à 0, la conversion est à faire hors service.
+VACUUM_CONVERT_MAX_MB = float(os.environ.get("API_VACUUM_CONVERT_MAX_MB", "64"))
 
 def init_db():
     """
@@ -10,6 +61,20 @@ def init_db():
     print("INFO: Initialisation de la base de données de métriques...")
     conn = sqlite3.connect(METRICS_DB_FILE)
     cursor = conn.cursor()
+    # Vacuum incrémental (voir prune_history) : sur une base neuve, le mode est
+    # fixé avant la création des tables. Une base existante n'y passe qu'après
+    # un VACUUM complet, laissé à la passe de rétention pour ne pas retarder le
+    # démarrage (voir _convert_to_incremental_vacuum).
+    if not cursor.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    elif cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        size_mb = _db_size_mb(conn)
+        if 0 < size_mb <= VACUUM_CONVERT_MAX_MB:
+            print("INFO: La base passera en vacuum incrémental à la prochaine passe de rétention.")
+        else:
+            print(f"ATTENTION: Base des métriques hors vacuum incrémental ({size_mb:.1f} Mo, "
+                  f"au-delà de API_VACUUM_CONVERT_MAX_MB) : à convertir hors service "
+                  f"(PRAGMA auto_vacuum=INCREMENTAL; VACUUM;).")
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS playbook_runs (
@@ -18,30 +83,475 @@ def init_db():
             service TEXT NOT NULL,
             action TEXT NOT NULL,
             status TEXT NOT NULL,
-            duration REAL NOT NULL
+            duration REAL NOT NULL,
+            run_id TEXT
+        )
+    ''')
+    # Bases créées avant l'ajout de la sortie des runs : la colonne 'run_id' est ajoutée.
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(playbook_runs)")]
+    if 'run_id' not in columns:
+        cursor.execute("ALTER TABLE playbook_runs ADD COLUMN run_id TEXT")
+    # Sortie brute des runs (voir app/run_logs.py) : un fichier par run, indexé ici.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_logs (
+            run_id TEXT PRIMARY KEY,
+            service TEXT NOT NULL,
+            action TEXT NOT NULL,
+            source TEXT NOT NULL,
+            path TEXT NOT NULL,
+            state TEXT NOT NULL,
+            return_code INTEGER,
+            size INTEGER NOT NULL DEFAULT 0,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    ''')
+    # Jobs asynchrones (voir app/jobs.py) : payload, résultat et état de chaque job.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            service TEXT NOT NULL,
+            action TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL,
+            submitted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            finished_at DATETIME,
+            duration REAL,
+            return_code INTEGER,
+            result TEXT,
+            error TEXT
+        )
+    ''')
+    # Agrégats par minute et par heure, tenus à jour à chaque enregistrement d'un run.
+    for table, _, _ in ROLLUP_TABLES.values():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket DATETIME NOT NULL,
+                service TEXT NOT NULL,
+                action TEXT NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                total_duration REAL NOT NULL,
+                max_duration REAL NOT NULL,
+                histogram TEXT NOT NULL,
+                PRIMARY KEY (bucket, service, action, status)
+            )
+        ''')
+    # Première initialisation des agrégats depuis l'historique existant.
+    if not cursor.execute("SELECT 1 FROM playbook_runs_hour LIMIT 1").fetchone():
+        history = cursor.execute(
+            "SELECT timestamp, service, action, status, duration FROM playbook_runs"
+        ).fetchall()
+        if history:
+            _update_rollups(conn, history)
+    # Logs d'accès des sites (voir app/log_analytics.py) : position atteinte dans
+    # chaque fichier et compteurs par minute, site et statut HTTP.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_log_offsets (
+            path TEXT PRIMARY KEY,
+            server_name TEXT NOT NULL,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            updated_at DATETIME
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_log_minute (
+            server_name TEXT NOT NULL,
+            bucket DATETIME NOT NULL,
+            status INTEGER NOT NULL,
+            requests INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            request_time_total REAL NOT NULL,
+            request_time_max REAL NOT NULL,
+            request_time_histogram TEXT NOT NULL,
+            upstream_count INTEGER NOT NULL,
+            upstream_time_total REAL NOT NULL,
+            upstream_time_max REAL NOT NULL,
+            upstream_time_histogram TEXT NOT NULL,
+            PRIMARY KEY (server_name, bucket, status)
+        )
+    ''')
+    # Durée de chaque tâche sur chaque hôte (voir app/services.py), reliée au run
+    # par run_id ; 'timestamp' est celui du run, pour les agrégats par fenêtre.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS run_task_timings (
+            run_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            service TEXT NOT NULL,
+            action TEXT NOT NULL,
+            task TEXT NOT NULL,
+            module TEXT,
+            host TEXT NOT NULL,
+            status TEXT NOT NULL,
+            start_time REAL,
+            end_time REAL,
+            duration REAL,
+            timestamp DATETIME NOT NULL,
+            PRIMARY KEY (run_id, position)
         )
     ''')
+    # Index utilisés par les requêtes du dashboard.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_timestamp ON playbook_runs (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_service_action ON playbook_runs (service, action, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_status ON playbook_runs (status, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_action_duration ON playbook_runs (action, duration)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, submitted_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_runs_run_id ON playbook_runs (run_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_run_logs_started ON run_logs (started_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_timings_timestamp ON run_task_timings (timestamp)")
+    # Les jobs en cours lors d'un arrêt de l'API ne reprendront pas.
+    cursor.execute(
+        "UPDATE jobs SET state = 'interrupted' WHERE state IN ('queued', 'running')"
+    )
+    cursor.execute("UPDATE run_logs SET state = 'interrupted' WHERE state = 'running'")
     conn.commit()
+    # Mode WAL (persistant dans le fichier) : les lectures du dashboard ne
+    # bloquent plus les écritures, et inversement.
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.close()
     print("INFO: Base de données des métriques prête.")
 
 
-def log_playbook_run(service: str, action: str, status: str, duration: float):
+def _utc_timestamp() -> str:
+    # Même format que CURRENT_TIMESTAMP dans SQLite (UTC).
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+# Colonnes de la table 'run_logs'.
+RUN_LOG_COLUMNS = (
+    'run_id', 'service', 'action', 'source', 'path', 'state',
+    'return_code', 'size', 'started_at', 'finished_at'
+)
+
+# Colonnes de la table 'run_task_timings'.
+TASK_TIMING_COLUMNS = (
+    'run_id', 'position', 'service', 'action', 'task', 'module', 'host',
+    'status', 'start_time', 'end_time', 'duration', 'timestamp'
+)
+
+# Requêtes d'insertion du writer, par type de ligne.
+_WRITE_STATEMENTS = {
+    'playbook_run': "INSERT INTO playbook_runs (timestamp, service, action, status, duration, run_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+    'run_log': f"INSERT OR REPLACE INTO run_logs ({', '.join(RUN_LOG_COLUMNS)}) "
+               f"VALUES ({', '.join('?' * len(RUN_LOG_COLUMNS))})",
+    'task_timing': f"INSERT OR REPLACE INTO run_task_timings ({', '.join(TASK_TIMING_COLUMNS)}) "
+                   f"VALUES ({', '.join('?' * len(TASK_TIMING_COLUMNS))})",
+}
+
+
+def _update_rollups(conn: sqlite3.Connection, runs: List[Tuple]):
     """
-    Enregistre une exécution de playbook dans la base de données des métriques.
+    Ajoute des runs (timestamp, service, action, status, duration) aux agrégats
+    par minute et par heure. Les runs sont d'abord regroupés en mémoire : une
+    seule lecture/écriture par intervalle touché.
+    """
+    for table, prefix_len, suffix in ROLLUP_TABLES.values():
+        groups: Dict[Tuple, List] = {}
+        for timestamp, service, action, status, duration in runs:
+            key = (timestamp[:prefix_len] + suffix, service, action, status)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, 0.0, 0.0, {}]
+            group[0] += 1
+            group[1] += duration
+            group[2] = max(group[2], duration)
+            index = str(bisect.bisect_left(DURATION_BUCKETS, duration))
+            group[3][index] = group[3].get(index, 0) + 1
+
+        for key, (count, total, maximum, histogram) in groups.items():
+            existing = conn.execute(
+                f"SELECT count, total_duration, max_duration, histogram FROM {table} "
+                "WHERE bucket = ? AND service = ? AND action = ? AND status = ?", key
+            ).fetchone()
+            if existing:
+                count += existing[0]
+                total += existing[1]
+                maximum = max(maximum, existing[2])
+                for index, n in json.loads(existing[3]).items():
+                    histogram[index] = histogram.get(index, 0) + n
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} (bucket, service, action, status, count, "
+                "total_duration, max_duration, histogram) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, count, total, maximum, json.dumps(histogram))
+            )
+
+
+def _write_rows(conn: sqlite3.Connection, by_kind: Dict[str, List[Tuple]]):
+    """Insère des lignes de métriques, regroupées par type, et met à jour les agrégats."""
+    for kind, rows in by_kind.items():
+        conn.executemany(_WRITE_STATEMENTS[kind], rows)
+    if 'playbook_run' in by_kind:
+        _update_rollups(conn, [row[:5] for row in by_kind['playbook_run']])
+
+
+class MetricsWriter:
     """
+    Écrit les métriques par lots depuis un thread de fond, avec une connexion
+    SQLite persistante en mode WAL. Les appelants ne font qu'ajouter une ligne
+    à une file en mémoire : aucune E/S disque sur le chemin des requêtes.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_file: str, flush_size: int, flush_interval: float):
+        self.db_file = db_file
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._loop, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Vide la file sur disque puis arrête le thread."""
+        if not self.running:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, kind: str, values: Tuple):
+        self._queue.put((kind, values))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # En WAL, NORMAL reste cohérent après un crash et évite un fsync par commit.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _loop(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(conn, batch)
+        # Arrêt : on écrit ce qui reste dans la file.
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                leftovers.append(item)
+        if leftovers:
+            self._flush(conn, leftovers)
+        conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, batch: List[Tuple[str, Tuple]]):
+        by_kind: Dict[str, List[Tuple]] = {}
+        for kind, values in batch:
+            by_kind.setdefault(kind, []).append(values)
+        try:
+            with SQLITE_WRITE.time('metrics_batch'), conn:
+                _write_rows(conn, by_kind)
+            self.written += len(batch)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"ERREUR: écriture des métriques impossible ({len(batch)} lignes perdues) : {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self.running,
+            'pending': self._queue.qsize(),
+            'written': self.written,
+            'batches': self.batches,
+            'errors': self.errors,
+        }
+
+
+metrics_writer = MetricsWriter(METRICS_DB_FILE, METRICS_FLUSH_SIZE, METRICS_FLUSH_INTERVAL)
+
+
+def start_metrics_writer():
+    metrics_writer.start()
+
+
+def stop_metrics_writer():
+    """Arrête le writer après avoir écrit toutes les métriques en attente (appelé à l'arrêt de l'API)."""
+    metrics_writer.stop()
+
+
+def _submit(kind: str, values: Tuple):
+    """
+    Met une ligne en file pour le writer de fond s'il tourne ; sinon (scripts,
+    outils) elle est écrite immédiatement.
+    """
+    _submit_many(kind, [values])
+
+
+def _submit_many(kind: str, rows: List[Tuple]):
+    """Comme _submit, pour plusieurs lignes (une seule transaction sans writer)."""
+    if not rows:
+        return
+    if metrics_writer.running:
+        for values in rows:
+            metrics_writer.submit(kind, values)
+        return
     conn = sqlite3.connect(METRICS_DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO playbook_runs (service, action, status, duration) VALUES (?, ?, ?, ?)",
-        (service, action, status, duration)
-    )
-    conn.commit()
+    with SQLITE_WRITE.time('metrics'), conn:
+        _write_rows(conn, {kind: list(rows)})
     conn.close()
 
+
+def log_playbook_run(service: str, action: str, status: str, duration: float, run_id: Optional[str] = None):
+    """
+    Enregistre une exécution de playbook dans la base de données des métriques.
+    run_id relie l'exécution à sa sortie brute (table 'run_logs').
+    """
+    _submit('playbook_run', (_utc_timestamp(), service, action, status, duration, run_id))
+
+
+def save_run_log(run_log: Dict[str, Any]):
+    """Crée ou met à jour l'entrée d'un fichier de sortie de run (via le writer de fond)."""
+    _submit('run_log', tuple(run_log.get(c) for c in RUN_LOG_COLUMNS))
+
+
+def log_task_timings(run_id: str, service: str, action: str, timings: List[Tuple]):
+    """
+    Enregistre la durée de chaque tâche d'un run sur chaque hôte, dans l'ordre
+    des résultats : (tâche, module, hôte, statut, début, fin), début et fin en
+    secondes depuis l'epoch (None si inconnus).
+    """
+    timestamp = _utc_timestamp()
+    rows = []
+    for position, (task, module, host, status, start, end) in enumerate(timings):
+        duration = round(end - start, 6) if start is not None and end is not None else None
+        rows.append((run_id, position, service, action, task, module, host, status, start, end, duration, timestamp))
+    _submit_many('task_timing', rows)
+
 def get_dashboard_stats():
     """
     Récupère les statistiques depuis la base de données des métriques pour le dashboard.
+    Lit les agrégats horaires : le coût dépend du nombre d'heures d'historique, pas du nombre de runs.
+    """
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    runs = cursor.execute("SELECT status, SUM(count) as count FROM playbook_runs_hour GROUP BY status").fetchall()
+    avg_duration = cursor.execute(
+        "SELECT action, SUM(total_duration) / SUM(count) as avg_d FROM playbook_runs_hour GROUP BY action"
+    ).fetchall()
+    conn.close()
+    stats = {
+        "success": next((r['count'] for r in runs if r['status'] == 'success'), 0),
+        "failure": next((r['count'] for r in runs if r['status'] == 'failure'), 0),
+        "avg_duration": {r['action']: round(r['avg_d'], 3) for r in avg_duration}
+    }
+    stats["total"] = stats["success"] + stats["failure"]
+    return stats
+
+
+def get_runs_after(last_id: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Runs enregistrés après le run `last_id` (au plus les `limit` derniers), du
+    plus ancien au plus récent. Lu depuis la fin de la clé primaire : le coût ne
+    dépend que du nombre de runs retournés.
+    """
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(
+        "SELECT id, timestamp, service, action, status, duration, run_id FROM playbook_runs "
+        "WHERE id > ? ORDER BY id DESC LIMIT ?", (last_id, limit)
+    ).fetchall()
+    conn.close()
+    return [dict(row) for row in reversed(rows)]
+
+
+# Colonnes et formats (type de contenu) de l'export des runs (GET /api/runs/export).
+EXPORT_COLUMNS = ('id', 'timestamp', 'service', 'action', 'status', 'duration', 'run_id')
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def iter_runs(service: Optional[str] = None, action: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              chunk_size: int = 5000) -> Iterator[List[Tuple]]:
+    """
+    Runs filtrés (EXPORT_COLUMNS), dans l'ordre des identifiants, par morceaux
+    de `chunk_size` lignes. Chaque morceau est une requête courte qui reprend
+    après le dernier identifiant lu : la mémoire ne dépend pas du nombre de
+    runs, et aucune lecture ne reste ouverte pendant tout l'export.
+    """
+    clauses, params = _filters(service, action)
+    for clause, value in ((" AND status = ?", status), (" AND timestamp >= ?", since), (" AND timestamp < ?", until)):
+        if value is not None:
+            clauses += clause
+            params.append(value)
+    last_id = 0
+    # Le générateur peut être repris par un autre thread (réponse en streaming).
+    conn = sqlite3.connect(METRICS_DB_FILE, check_same_thread=False)
+    try:
+        while True:
+            rows = conn.execute(
+                f"SELECT {', '.join(EXPORT_COLUMNS)} FROM playbook_runs WHERE id > ?{clauses} ORDER BY id LIMIT ?",
+                (last_id, *params, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+
+def export_runs(fmt: str, **filters) -> Iterator[str]:
+    """
+    Runs filtrés (voir iter_runs) au format 'csv' (avec en-tête) ou 'ndjson',
+    un morceau de texte par morceau de lignes lu.
+    """
+    chunks = iter_runs(**filters)
+    if fmt == 'ndjson':
+        for rows in chunks:
+            yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # aucun run : l'en-tête seul
+
+
+def get_dashboard_stats_full_scan():
+    """
+    Même résultat que get_dashboard_stats, calculé en parcourant toute la table
+    'playbook_runs'. Conservé pour vérifier les agrégats.
     """
     conn = sqlite3.connect(METRICS_DB_FILE)
     conn.row_factory = sqlite3.Row
@@ -55,4 +565,569 @@ def get_dashboard_stats():
         "avg_duration": {r['action']: round(r['avg_d'], 3) for r in avg_duration}
     }
     stats["total"] = stats["success"] + stats["failure"]
-    return stats
\ No newline at end of file
+    return stats
+
+
+# --- Statistiques par fenêtre de temps ---
+
+def _since(window_seconds: int) -> str:
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - window_seconds))
+
+
+def _histogram_percentile(histogram: Dict[int, int], count: int, maximum: float, q: float) -> float:
+    """Estime un percentile par interpolation linéaire dans l'intervalle de l'histogramme qui le contient."""
+    rank = q * count
+    cumulative = 0
+    for index in sorted(histogram):
+        n = histogram[index]
+        if cumulative + n >= rank:
+            lower = DURATION_BUCKETS[index - 1] if index > 0 else 0.0
+            upper = DURATION_BUCKETS[index] if index < len(DURATION_BUCKETS) else maximum
+            upper = min(upper, maximum)
+            return lower + (max(upper, lower) - lower) * (rank - cumulative) / n
+        cumulative += n
+    return maximum
+
+
+def _exact_percentile(durations: List[float], q: float) -> float:
+    """Percentile exact (interpolation linéaire entre les rangs) d'une liste triée."""
+    position = q * (len(durations) - 1)
+    low = int(position)
+    high = min(low + 1, len(durations) - 1)
+    return durations[low] + (durations[high] - durations[low]) * (position - low)
+
+
+def _format_stats(count: int, failures: int, total: float, maximum: float, percentile) -> Dict[str, Any]:
+    return {
+        "count": count,
+        "success": count - failures,
+        "failure": failures,
+        "failure_rate": round(failures / count, 4) if count else 0.0,
+        "avg_duration": round(total / count, 3) if count else None,
+        "max_duration": round(maximum, 3) if count else None,
+        "p50": round(percentile(0.50), 3) if count else None,
+        "p95": round(percentile(0.95), 3) if count else None,
+        "p99": round(percentile(0.99), 3) if count else None,
+    }
+
+
+def _filters(service: Optional[str], action: Optional[str]) -> Tuple[str, List[str]]:
+    filters = {'service': service, 'action': action}
+    clauses = "".join(f" AND {column} = ?" for column, value in filters.items() if value is not None)
+    return clauses, [value for value in filters.values() if value is not None]
+
+
+def get_window_stats(window_seconds: int, service: Optional[str] = None,
+                     action: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Nombre de runs, taux d'échec et percentiles de durée (p50/p95/p99) sur une fenêtre
+    de temps, globalement et par (service, action). Lu dans les agrégats : le coût
+    dépend de la taille de la fenêtre, pas de la taille de l'historique. La fenêtre
+    est arrondie au début de la minute (ou de l'heure) qui la contient.
+    """
+    granularity = 'minute' if window_seconds <= MINUTE_ROLLUP_MAX_WINDOW else 'hour'
+    table, prefix_len, suffix = ROLLUP_TABLES[granularity]
+    clauses, params = _filters(service, action)
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    rows = conn.execute(
+        f"SELECT service, action, status, count, total_duration, max_duration, histogram "
+        f"FROM {table} WHERE bucket >= ?{clauses}",
+        (_since(window_seconds)[:prefix_len] + suffix, *params)
+    ).fetchall()
+    conn.close()
+
+    groups: Dict[Tuple[str, str], List] = {}
+    overall = [0, 0, 0.0, 0.0, {}]
+    for row_service, row_action, status, count, total, maximum, histogram in rows:
+        group = groups.setdefault((row_service, row_action), [0, 0, 0.0, 0.0, {}])
+        for acc in (group, overall):
+            acc[0] += count
+            acc[1] += count if status != 'success' else 0
+            acc[2] += total
+            acc[3] = max(acc[3], maximum)
+            for index, n in json.loads(histogram).items():
+                acc[4][int(index)] = acc[4].get(int(index), 0) + n
+
+    def summary(acc):
+        count, failures, total, maximum, histogram = acc
+        return _format_stats(count, failures, total, maximum,
+                             lambda q: _histogram_percentile(histogram, count, maximum, q))
+
+    return {
+        "window": window_seconds,
+        "source": "rollup",
+        "granularity": granularity,
+        "totals": summary(overall),
+        "actions": [
+            {"service": key[0], "action": key[1], **summary(acc)} for key, acc in sorted(groups.items())
+        ],
+    }
+
+
+def get_window_stats_raw(window_seconds: int, service: Optional[str] = None,
+                         action: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Même résultat que get_window_stats, calculé exactement depuis les lignes de
+    'playbook_runs'. Conservé pour vérifier les agrégats ; son coût croît avec
+    le nombre de runs de la fenêtre.
+    """
+    clauses, params = _filters(service, action)
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    rows = conn.execute(
+        f"SELECT service, action, status, duration FROM playbook_runs WHERE timestamp >= ?{clauses}",
+        (_since(window_seconds), *params)
+    ).fetchall()
+    conn.close()
+
+    groups: Dict[Tuple[str, str], List] = {}
+    overall = [0, []]
+    for row_service, row_action, status, duration in rows:
+        group = groups.setdefault((row_service, row_action), [0, []])
+        for acc in (group, overall):
+            acc[0] += 1 if status != 'success' else 0
+            acc[1].append(duration)
+
+    def summary(acc):
+        failures, durations = acc
+        durations.sort()
+        return _format_stats(len(durations), failures, sum(durations), durations[-1] if durations else 0.0,
+                             lambda q: _exact_percentile(durations, q))
+
+    return {
+        "window": window_seconds,
+        "source": "raw",
+        "totals": summary(overall),
+        "actions": [
+            {"service": key[0], "action": key[1], **summary(acc)} for key, acc in sorted(groups.items())
+        ],
+    }
+
+
+# --- Jobs asynchrones ---
+
+JOB_COLUMNS = (
+    'id', 'service', 'action', 'payload', 'state', 'submitted_at', 'started_at',
+    'finished_at', 'duration', 'return_code', 'result', 'error'
+)
+# Colonnes stockées en JSON.
+_JOB_JSON_COLUMNS = ('payload', 'result')
+
+
+def _job_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    for column in _JOB_JSON_COLUMNS:
+        if job[column] is not None:
+            job[column] = json.loads(job[column])
+    return job
+
+
+def save_job(job: Dict[str, Any]):
+    """
+    Crée ou met à jour un job dans la base de données des métriques.
+    """
+    values = [json.dumps(job.get(c)) if c in _JOB_JSON_COLUMNS else job.get(c) for c in JOB_COLUMNS]
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    with SQLITE_WRITE.time('job'):
+        conn.execute(
+            f"INSERT OR REPLACE INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+            values
+        )
+        conn.commit()
+    conn.close()
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Récupère un job par son identifiant, ou None s'il n'existe pas.
+    """
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return _job_from_row(row) if row else None
+
+
+def list_jobs(state: Optional[str] = None, service: Optional[str] = None, action: Optional[str] = None,
+              limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Liste les jobs, du plus récent au plus ancien, avec des filtres optionnels.
+    """
+    filters = {'state': state, 'service': service, 'action': action}
+    clauses = [f"{column} = ?" for column, value in filters.items() if value is not None]
+    params = [value for value in filters.values() if value is not None]
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(
+        f"SELECT * FROM jobs {where} ORDER BY submitted_at DESC, rowid DESC LIMIT ? OFFSET ?",
+        (*params, limit, offset)
+    ).fetchall()
+    conn.close()
+    return [_job_from_row(row) for row in rows]
+
+
+# --- Sortie des runs ---
+
+def get_run_log(run_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Récupère l'entrée d'un fichier de sortie de run, ou None s'il n'existe pas.
+    """
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM run_logs WHERE run_id = ?", (run_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def list_run_logs(service: Optional[str] = None, action: Optional[str] = None, state: Optional[str] = None,
+                  limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Liste les runs dont la sortie est conservée, du plus récent au plus ancien.
+    """
+    filters = {'service': service, 'action': action, 'state': state}
+    clauses = [f"{column} = ?" for column, value in filters.items() if value is not None]
+    params = [value for value in filters.values() if value is not None]
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(
+        f"SELECT * FROM run_logs {where} ORDER BY started_at DESC, rowid DESC LIMIT ? OFFSET ?",
+        (*params, limit, offset)
+    ).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+# --- Durée des tâches ---
+
+def _offset(value: Optional[float], origin: Optional[float]) -> Optional[float]:
+    return round(value - origin, 3) if value is not None and origin is not None else None
+
+
+def get_run_timeline(run_id: str) -> Dict[str, Any]:
+    """
+    Chronologie d'un run : ses tâches dans l'ordre d'exécution et, pour chacune,
+    chaque hôte avec son statut, son début et sa fin. Les débuts et fins sont
+    donnés en secondes depuis le début du run ('offset') ; la durée d'une tâche
+    va du premier début à la dernière fin parmi ses hôtes.
+    """
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    rows = conn.execute(
+        "SELECT task, module, host, status, start_time, end_time, duration FROM run_task_timings "
+        "WHERE run_id = ? ORDER BY position", (run_id,)
+    ).fetchall()
+    conn.close()
+
+    starts = [row[4] for row in rows if row[4] is not None]
+    ends = [row[5] for row in rows if row[5] is not None]
+    origin = min(starts) if starts else None
+    tasks: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+    for task, module, host, status, start, end, duration in rows:
+        entry = tasks.get((task, module))
+        if entry is None:
+            entry = tasks[(task, module)] = {"task": task, "module": module, "start": None, "end": None, "hosts": []}
+        if start is not None:
+            entry["start"] = start if entry["start"] is None else min(entry["start"], start)
+        if end is not None:
+            entry["end"] = end if entry["end"] is None else max(entry["end"], end)
+        entry["hosts"].append({
+            "host": host, "status": status, "offset": _offset(start, origin),
+            "duration": round(duration, 3) if duration is not None else None,
+        })
+    timeline = []
+    for entry in tasks.values():
+        start, end = entry.pop("start"), entry.pop("end")
+        entry["offset"] = _offset(start, origin)
+        entry["duration"] = _offset(end, start)
+        timeline.append(entry)
+    return {
+        "run_id": run_id,
+        "duration": _offset(max(ends), origin) if ends else None,
+        "tasks": timeline,
+    }
+
+
+# Tris possibles des tâches les plus lentes : temps total, moyen ou maximal.
+SLOWEST_TASKS_SORTS = {'total': 'total_duration', 'avg': 'avg_duration', 'max': 'max_duration'}
+
+
+def get_slowest_tasks(window_seconds: int, service: Optional[str] = None, action: Optional[str] = None,
+                      sort: str = 'total', limit: int = 10) -> Dict[str, Any]:
+    """
+    Tâches qui ont pris le plus de temps sur une fenêtre, tous runs confondus,
+    par (service, action, tâche, module). Les tâches ignorées (skipped) ne
+    comptent pas. Les durées sont celles d'une tâche sur un hôte ; 'per_run'
+    est le temps cumulé moyen de la tâche dans un run.
+    """
+    clauses, params = _filters(service, action)
+    since = _since(window_seconds)
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    rows = conn.execute(
+        f"SELECT service, action, task, module, COUNT(*), COUNT(DISTINCT run_id), "
+        f"SUM(status IN ('failed', 'unreachable')), SUM(duration) AS total_duration, "
+        f"AVG(duration) AS avg_duration, MAX(duration) AS max_duration "
+        f"FROM run_task_timings WHERE timestamp >= ? AND status != 'skipped' AND duration IS NOT NULL{clauses} "
+        f"GROUP BY service, action, task, module ORDER BY {SLOWEST_TASKS_SORTS[sort]} DESC LIMIT ?",
+        (since, *params, limit)
+    ).fetchall()
+
+    tasks = []
+    for row_service, row_action, task, module, count, runs, failures, total, average, maximum in rows:
+        # Percentile exact, lu pour les seules tâches retenues.
+        durations = sorted(r[0] for r in conn.execute(
+            "SELECT duration FROM run_task_timings WHERE timestamp >= ? AND service = ? AND action = ? "
+            "AND task = ? AND module IS ? AND status != 'skipped' AND duration IS NOT NULL",
+            (since, row_service, row_action, task, module)
+        ))
+        tasks.append({
+            "service": row_service, "action": row_action, "task": task, "module": module,
+            "runs": runs, "count": count, "failures": failures,
+            "total_duration": round(total, 3), "per_run": round(total / runs, 3),
+            "avg_duration": round(average, 3), "p95": round(_exact_percentile(durations, 0.95), 3),
+            "max_duration": round(maximum, 3),
+        })
+    conn.close()
+    return {"window": window_seconds, "sort": sort, "tasks": tasks}
+
+
+# --- Statistiques des logs d'accès des sites ---
+
+# Compteurs d'un (minute, statut) : requêtes, octets, puis total, maximum et
+# histogramme (indices de DURATION_BUCKETS) de $request_time et de $upstream_response_time.
+ACCESS_COUNTER_COLUMNS = (
+    'requests', 'bytes', 'request_time_total', 'request_time_max', 'request_time_histogram',
+    'upstream_count', 'upstream_time_total', 'upstream_time_max', 'upstream_time_histogram',
+)
+
+
+def new_access_counter() -> List:
+    return [0, 0, 0.0, 0.0, {}, 0, 0.0, 0.0, {}]
+
+
+def _merge_access_counter(into: List, other: List):
+    for i in (0, 1, 2, 5, 6):
+        into[i] += other[i]
+    for i in (3, 7):
+        into[i] = max(into[i], other[i])
+    for i in (4, 8):
+        for index, n in other[i].items():
+            into[i][index] = into[i].get(index, 0) + n
+
+
+def get_access_log_offset(path: str) -> Optional[Tuple[int, int]]:
+    """(inode, offset) atteints dans un fichier de log, ou None s'il n'a jamais été lu."""
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    row = conn.execute("SELECT inode, offset FROM access_log_offsets WHERE path = ?", (path,)).fetchone()
+    conn.close()
+    return tuple(row) if row else None
+
+
+def save_access_log_chunk(server_name: str, path: str, inode: int, offset: int,
+                          counters: Dict[Tuple[str, int], List]):
+    """
+    Ajoute les compteurs d'un morceau de log et enregistre la position atteinte
+    dans la même transaction : un morceau n'est jamais compté deux fois.
+    """
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    with SQLITE_WRITE.time('access_log'), conn:
+        for (bucket, status), counter in counters.items():
+            existing = conn.execute(
+                f"SELECT {', '.join(ACCESS_COUNTER_COLUMNS)} FROM access_log_minute "
+                "WHERE server_name = ? AND bucket = ? AND status = ?", (server_name, bucket, status)
+            ).fetchone()
+            if existing:
+                merged = list(existing)
+                merged[4], merged[8] = json.loads(merged[4]), json.loads(merged[8])
+                _merge_access_counter(merged, counter)
+                counter = merged
+            values = list(counter)
+            values[4], values[8] = json.dumps(values[4]), json.dumps(values[8])
+            conn.execute(
+                f"INSERT OR REPLACE INTO access_log_minute (server_name, bucket, status, "
+                f"{', '.join(ACCESS_COUNTER_COLUMNS)}) VALUES ({', '.join('?' * (3 + len(ACCESS_COUNTER_COLUMNS)))})",
+                (server_name, bucket, status, *values)
+            )
+        conn.execute(
+            "INSERT OR REPLACE INTO access_log_offsets (path, server_name, inode, offset, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)", (path, server_name, inode, offset, _utc_timestamp())
+        )
+    conn.close()
+
+
+def _latency_stats(count: int, total: float, maximum: float, histogram: Dict[int, int]) -> Dict[str, Any]:
+    if not count:
+        return {"avg": None, "max": None, "p50": None, "p95": None, "p99": None}
+    return {
+        "avg": round(total / count, 4),
+        "max": round(maximum, 4),
+        **{f"p{int(q * 100)}": round(_histogram_percentile(histogram, count, maximum, q), 4)
+           for q in (0.50, 0.95, 0.99)},
+    }
+
+
+def get_access_log_stats(server_name: str, window_seconds: int, step: str = 'minute') -> Dict[str, Any]:
+    """
+    Requêtes, débit, répartition des statuts, octets servis et latences
+    (temps de requête et de l'upstream) d'un site sur une fenêtre, au total et
+    par intervalle de `step` ('minute' ou 'hour'). Lu dans les compteurs par minute.
+    """
+    prefix_len, suffix = (16, ':00') if step == 'minute' else (13, ':00:00')
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    rows = conn.execute(
+        f"SELECT bucket, status, {', '.join(ACCESS_COUNTER_COLUMNS)} FROM access_log_minute "
+        "WHERE server_name = ? AND bucket >= ? ORDER BY bucket",
+        (server_name, _since(window_seconds)[:16] + ':00')
+    ).fetchall()
+    conn.close()
+
+    total = new_access_counter()
+    statuses: Dict[int, int] = {}
+    series: Dict[str, List] = {}
+    for bucket, status, *values in rows:
+        counter = list(values)
+        counter[4] = {int(k): n for k, n in json.loads(counter[4]).items()}
+        counter[8] = {int(k): n for k, n in json.loads(counter[8]).items()}
+        _merge_access_counter(total, counter)
+        statuses[status] = statuses.get(status, 0) + counter[0]
+        point = series.setdefault(bucket[:prefix_len] + suffix, [0, 0, 0, 0.0])
+        point[0] += counter[0]
+        point[1] += counter[1]
+        point[2] += counter[0] if status >= 500 else 0
+        point[3] += counter[2]
+
+    classes: Dict[str, int] = {}
+    for status, n in statuses.items():
+        classes[f"{status // 100}xx"] = classes.get(f"{status // 100}xx", 0) + n
+    return {
+        "server_name": server_name,
+        "window": window_seconds,
+        "step": step,
+        "totals": {
+            "requests": total[0],
+            "rate": round(total[0] / window_seconds, 4),
+            "bytes": total[1],
+            "status": {str(k): v for k, v in sorted(statuses.items())},
+            "status_classes": dict(sorted(classes.items())),
+            "request_time": _latency_stats(total[0], total[2], total[3], total[4]),
+            "upstream_time": _latency_stats(total[5], total[6], total[7], total[8]),
+        },
+        "series": [
+            {"bucket": bucket, "requests": n, "bytes": size, "errors": errors,
+             "avg_request_time": round(rt / n, 4) if n else None}
+            for bucket, (n, size, errors, rt) in series.items()
+        ],
+    }
+
+
+# --- Rétention de l'historique ---
+
+# Tables élaguées : (table, colonne de date, durée de conservation en jours, condition
+# supplémentaire). Les runs et les jobs encore en cours ne sont jamais supprimés.
+RETENTION_TABLES = (
+    ('playbook_runs', 'timestamp', RUNS_RETENTION_DAYS, None),
+    ('run_task_timings', 'timestamp', RUNS_RETENTION_DAYS, None),
+    ('playbook_runs_minute', 'bucket', MINUTE_ROLLUP_RETENTION_DAYS, None),
+    ('jobs', 'submitted_at', JOBS_RETENTION_DAYS, "state NOT IN ('queued', 'running')"),
+)
+
+
+def _prune_run_logs(conn: sqlite3.Connection, cutoff: str, pause: float) -> int:
+    """Supprime par lots les entrées 'run_logs' des runs terminés avant `cutoff`, avec leur fichier."""
+    deleted = 0
+    while True:
+        with SQLITE_WRITE.time('retention'), conn:
+            rows = conn.execute(
+                "SELECT run_id, path FROM run_logs WHERE started_at < ? AND state != 'running' LIMIT ?",
+                (cutoff, RETENTION_BATCH_ROWS)
+            ).fetchall()
+            conn.executemany("DELETE FROM run_logs WHERE run_id = ?", [(run_id,) for run_id, _ in rows])
+        # Les fichiers sont supprimés une fois l'entrée effacée : au pire, un fichier orphelin.
+        for _, path in rows:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"ERREUR: suppression de la sortie {path} : {e}")
+        deleted += len(rows)
+        if len(rows) < RETENTION_BATCH_ROWS:
+            return deleted
+        time.sleep(pause)
+
+
+def _db_size_mb(conn: sqlite3.Connection) -> float:
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    return pages * conn.execute("PRAGMA page_size").fetchone()[0] / 2 ** 20
+
+
+def _convert_to_incremental_vacuum(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+    """
+    Passe une base existante en vacuum incrémental : le mode ne s'applique
+    qu'après un VACUUM complet, fait une seule fois et seulement jusqu'à
+    VACUUM_CONVERT_MAX_MB. Retourne None si la base y est déjà.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return None
+    size_mb = round(_db_size_mb(conn), 1)
+    if VACUUM_CONVERT_MAX_MB <= 0 or size_mb > VACUUM_CONVERT_MAX_MB:
+        return {'converted': False, 'size_mb': size_mb}
+    start = time.monotonic()
+    with SQLITE_WRITE.time('vacuum'):
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    duration = round(time.monotonic() - start, 3)
+    print(f"INFO: Base des métriques passée en vacuum incrémental ({size_mb} Mo, {duration} s).")
+    return {'converted': True, 'size_mb': size_mb, 'duration': duration}
+
+
+def prune_history(pause: float = 0.05) -> Dict[str, Any]:
+    """
+    Supprime les lignes plus anciennes que leur durée de conservation (ainsi
+    que les fichiers de sortie des runs effacés de 'run_logs'), puis
+    rend au système les pages libérées (PRAGMA incremental_vacuum), après
+    avoir au besoin passé la base en vacuum incrémental ('auto_vacuum'). Les
+    agrégats par heure, tenus à jour à l'enregistrement de chaque run, gardent
+    les compteurs et les durées des runs supprimés. Tout se fait par petites
+    transactions séparées de `pause` secondes : les écritures des métriques
+    passent entre deux lots, et les lectures (WAL) ne sont jamais bloquées.
+    """
+    report: Dict[str, Any] = {'deleted': {}, 'vacuumed_pages': 0}
+    conn = sqlite3.connect(METRICS_DB_FILE)
+    try:
+        for table, column, days, condition in RETENTION_TABLES:
+            if days <= 0:
+                continue
+            cutoff = _since(int(days * 86400))
+            where = f"{column} < ?" + (f" AND {condition}" if condition else "")
+            deleted = 0
+            while True:
+                with SQLITE_WRITE.time('retention'), conn:
+                    count = conn.execute(
+                        f"DELETE FROM {table} WHERE rowid IN "
+                        f"(SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+                        (cutoff, RETENTION_BATCH_ROWS)
+                    ).rowcount
+                deleted += count
+                if count < RETENTION_BATCH_ROWS:
+                    break
+                time.sleep(pause)
+            report['deleted'][table] = deleted
+        if RUN_LOGS_RETENTION_DAYS > 0:
+            report['deleted']['run_logs'] = _prune_run_logs(conn, _since(int(RUN_LOGS_RETENTION_DAYS * 86400)), pause)
+        conversion = _convert_to_incremental_vacuum(conn)
+        if conversion is not None:
+            report['auto_vacuum'] = conversion
+
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            with SQLITE_WRITE.time('vacuum'):
+                freed = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                # executescript exécute le pragma jusqu'au bout (execute ne libère qu'une page).
+                conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_BATCH_PAGES});")
+                freed -= conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if freed <= 0:
+                break  # base pas (encore) en vacuum incrémental
+            report['vacuumed_pages'] += freed
+            time.sleep(pause)
+    finally:
+        conn.close()
+    return report
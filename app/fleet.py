@@ -0,0 +1,79 @@
+import re
+from typing import Any, Dict
+
+from fastapi import HTTPException, Query, Response
+
+from app.services import PLAYBOOK_MAX_FORKS
+
+# Motif d'hôtes Ansible accepté pour 'target' : noms d'hôtes ou de groupes,
+# listes séparées par ',' ou ':', jokers et exclusions/intersections ('!', '&').
+TARGET_PATTERN = re.compile(r'^[A-Za-z0-9_.\-*\[\]:,!&]{1,512}$')
+
+
+class Fleet:
+    """
+    Dépendance des routes qui exécutent un playbook : hôtes ciblés et parallélisme.
+
+    `target` est un hôte, un groupe ou un motif de l'inventaire (groupe
+    'local_managed' par défaut) ; `forks` est le nombre d'hôtes traités en
+    parallèle par le run.
+    """
+
+    def __init__(
+        self,
+        target: str = Query(None, description="Optionnel: hôte, groupe ou motif de l'inventaire (ex: local_fleet)"),
+        forks: int = Query(None, ge=1, le=PLAYBOOK_MAX_FORKS, description="Optionnel: hôtes traités en parallèle"),
+    ):
+        if target is not None and not TARGET_PATTERN.match(target):
+            raise HTTPException(400, detail={"status": "fail", "message": f"Cible '{target}' invalide."})
+        self.target = target
+        self.forks = forks
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        """Arguments à passer à run_playbook."""
+        return {"target": self.target, "forks": self.forks}
+
+
+def fleet_outcome(result: Dict[str, Any]) -> str:
+    """
+    'ok' si le run a réussi sur tous les hôtes, 'partial' si certains hôtes ont
+    échoué ou sont injoignables et d'autres non, 'failed' sinon (aucun hôte en
+    succès, ou run interrompu sans échec attribuable à un hôte).
+    """
+    if result.get('return_code') == 0:
+        return 'ok'
+    hosts = (result.get('result') or {}).get('hosts') or {}
+    ok = sum(1 for h in hosts.values() if h['status'] == 'ok')
+    if ok and ok < len(hosts):
+        return 'partial'
+    return 'failed'
+
+
+def fleet_results(result: Dict[str, Any], default: Any = None) -> Any:
+    """Résultat affiché du run ; en cas d'échec partiel, celui du premier hôte en succès."""
+    summary = result.get('result') or {}
+    if 'results' in summary:
+        return summary['results']
+    for host in summary.get('hosts', {}).values():
+        if host['status'] == 'ok' and 'results' in host:
+            return host['results']
+    return default
+
+
+def fleet_response(result: Dict[str, Any], data: Dict[str, Any], response: Response,
+                   with_results: bool = False) -> Dict[str, Any]:
+    """
+    Réponse d'une route exécutée sur un ou plusieurs hôtes : `data` est complété
+    par l'état de chaque hôte ('hosts'). En cas d'échec partiel, la réponse est
+    un 207 de statut 'partial'. Le résultat affiché par hôte n'est joint
+    qu'avec `with_results` (lectures courtes : statut, configuration, logs).
+    """
+    hosts = {}
+    for name, host in ((result.get('result') or {}).get('hosts') or {}).items():
+        hosts[name] = host if with_results else {k: v for k, v in host.items() if k != 'results'}
+    status = "success"
+    if fleet_outcome(result) == 'partial':
+        response.status_code = 207
+        status = "partial"
+    return {"status": status, "data": {**data, "hosts": hosts}}
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.database import get_job, list_jobs, save_job
+from app.services import run_playbook
+# Les modifications de sites passent par le regroupement des rechargements de Nginx.
+from app.vhost_changes import CHANGESET_REQUIRED_FIELDS, reload_batcher
+
+# Nombre de jobs exécutés en parallèle par le pool de fond.
+JOB_WORKERS = int(os.environ.get('API_JOB_WORKERS', '4'))
+# Nombre maximal de jobs en attente.
+JOB_MAX_QUEUE = int(os.environ.get('API_JOB_MAX_QUEUE', '1000'))
+
+# Actions qu'un job peut lancer, par service.
+JOB_ACTIONS = {
+    'user': {
+        'create', 'delete', 'password', 'add_group', 'del_group',
+        'list_groups', 'list_users', 'create_group', 'batch',
+    },
+    'webserver': {
+        'create', 'delete', 'enable', 'disable', 'update',
+        'list', 'status', 'config', 'logs', 'inventory',
+    },
+}
+
+JOB_STATES = ('queued', 'running', 'succeeded', 'failed', 'cancelled', 'interrupted')
+FINAL_STATES = ('succeeded', 'failed', 'cancelled', 'interrupted')
+
+
+class JobQueueFullError(Exception):
+    """Levée quand la file des jobs a atteint JOB_MAX_QUEUE."""
+
+
+def _now() -> str:
+    # Même format que CURRENT_TIMESTAMP dans SQLite (UTC).
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+def _redact(value: Any) -> Any:
+    """Masque les mots de passe avant de persister un payload."""
+    if isinstance(value, dict):
+        return {k: ('***' if k == 'password' and v else _redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+async def _db(fn, *args, **kwargs):
+    """Exécute un accès SQLite hors de la boucle d'événements."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, lambda: fn(*args, **kwargs))
+
+
+class JobManager:
+    """
+    Exécute des actions de playbook en arrière-plan. Chaque job est persisté dans
+    la table 'jobs' à chaque changement d'état ; les jobs actifs sont aussi gardés
+    en mémoire pour pouvoir être annulés.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        # Jobs en attente ou en cours, et tâche du run pour ceux en cours.
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for job_id in list(self._active):
+            await self.cancel(job_id)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, service: str, action: str, payload: Dict[str, Any],
+                     target: Optional[str] = None, forks: Optional[int] = None) -> Dict[str, Any]:
+        """Enregistre un job et le place dans la file ; retourne immédiatement."""
+        # La file peut encore contenir des jobs annulés : seuls les jobs en attente comptent.
+        if sum(1 for job in self._active.values() if job['state'] == 'queued') >= self.max_queue:
+            raise JobQueueFullError(f"File des jobs pleine ({self.max_queue} jobs en attente).")
+        job = {
+            'id': uuid.uuid4().hex, 'service': service, 'action': action,
+            'payload': _redact(payload), 'state': 'queued', 'submitted_at': _now(),
+        }
+        await _db(save_job, job)
+        # Le payload complet (avec mot de passe) et les options du run ne vivent qu'en mémoire.
+        self._active[job['id']] = {**job, '_payload': payload, '_target': target, '_forks': forks}
+        self._queue.put_nowait(job['id'])
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._active.get(job_id)
+        if job is not None:
+            return _public(job)
+        return await _db(get_job, job_id)
+
+    def active(self) -> List[Dict[str, Any]]:
+        """Jobs en attente ou en cours, lus en mémoire (sans accès à SQLite)."""
+        return [_public(job) for job in self._active.values()]
+
+    async def list_jobs(self, **filters) -> List[Dict[str, Any]]:
+        return await _db(list_jobs, **filters)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Annule un job en attente ou en cours. Retourne None si le job n'est pas actif."""
+        job = self._active.get(job_id)
+        if job is None:
+            return None
+        task = self._running.get(job_id)
+        if task is not None:
+            # Le run est interrompu (le processus Ansible est tué) ; le worker finalise le job.
+            job['_cancelled'] = True
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return {**_public(job), 'state': 'cancelled'}
+        await self._finish(job, 'cancelled')
+        return _public(job)
+
+    async def _finish(self, job: Dict[str, Any], state: str, **fields):
+        job.update(state=state, finished_at=_now(), **fields)
+        self._active.pop(job['id'], None)
+        await _db(save_job, _public(job))
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._active.get(job_id)
+            if job is None:
+                continue  # annulé pendant qu'il attendait
+            await self._run(job)
+
+    async def _run(self, job: Dict[str, Any]):
+        job.update(state='running', started_at=_now())
+        await _db(save_job, _public(job))
+        start = time.time()
+        if job['service'] == 'webserver' and job['action'] in CHANGESET_REQUIRED_FIELDS:
+            # Comme la route synchrone : la modification peut partager le rechargement
+            # d'autres modifications de sites (elle est alors appliquée même si le job est annulé).
+            run = reload_batcher.submit(job['action'], job['_payload'], target=job['_target'], forks=job['_forks'])
+        else:
+            run = run_playbook(job['service'], job['action'], job['_payload'],
+                               target=job['_target'], forks=job['_forks'], priority='bulk')
+        task = asyncio.ensure_future(run)
+        self._running[job['id']] = task
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            await self._finish(job, 'cancelled', duration=round(time.time() - start, 3))
+            # Un worker arrêté pendant le run annule aussi le run : seul le drapeau
+            # posé par cancel() distingue l'annulation du job de l'arrêt du worker.
+            if not job.get('_cancelled'):
+                raise
+            return
+        except Exception as e:
+            await self._finish(job, 'failed', duration=round(time.time() - start, 3), error=str(e))
+            return
+        finally:
+            self._running.pop(job['id'], None)
+
+        return_code = result.get('return_code')
+        await self._finish(
+            job, 'succeeded' if return_code == 0 else 'failed',
+            duration=round(time.time() - start, 3),
+            return_code=return_code,
+            result=result.get('result', {'raw': result.get('raw')}),
+            error=result.get('stderr') if return_code != 0 else None,
+        )
+
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Vue d'un job sans les champs internes (payload en clair)."""
+    return {k: v for k, v in job.items() if not k.startswith('_')}
+
+
+job_manager = JobManager(JOB_WORKERS, JOB_MAX_QUEUE)
@@ -0,0 +1,223 @@
+import base64
+import bisect
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Champs des entrées retournées par les listes d'utilisateurs et de groupes.
+USER_FIELDS = ('name', 'uid', 'gid', 'gecos', 'home', 'shell')
+GROUP_FIELDS = ('name', 'gid', 'members')
+
+
+class CursorError(ValueError):
+    """Levée pour un curseur de pagination illisible ou émis pour un autre tri."""
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def user_entries(raw: Any) -> List[Dict[str, Any]]:
+    """
+    Convertit la sortie de l'action 'list_users' (faits getent_passwd :
+    nom -> [mot de passe, uid, gid, gecos, home, shell]) en entrées.
+    Une simple liste de noms est aussi acceptée.
+    """
+    if isinstance(raw, dict):
+        entries = []
+        for name, fields in raw.items():
+            fields = list(fields or []) + [None] * 6
+            entries.append({
+                'name': name, 'uid': _int(fields[1]), 'gid': _int(fields[2]),
+                'gecos': fields[3], 'home': fields[4], 'shell': fields[5],
+            })
+        return entries
+    return [{'name': name, **{f: None for f in USER_FIELDS[1:]}} for name in raw or []]
+
+
+def group_entries(raw: Any) -> List[Dict[str, Any]]:
+    """
+    Convertit la sortie de l'action 'list_groups' (faits getent_group :
+    nom -> [mot de passe, gid, membres séparés par des virgules]) en entrées.
+    Une simple liste de noms (groupes d'un utilisateur) est aussi acceptée.
+    """
+    if isinstance(raw, dict):
+        entries = []
+        for name, fields in raw.items():
+            fields = list(fields or []) + [None] * 3
+            entries.append({
+                'name': name, 'gid': _int(fields[1]),
+                'members': [m for m in (fields[2] or '').split(',') if m],
+            })
+        return entries
+    return [{'name': name, 'gid': None, 'members': None} for name in raw or []]
+
+
+def _encode_cursor(sort: str, key: Tuple) -> str:
+    data = json.dumps([sort, *key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str, sort: str) -> Tuple:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise CursorError("Curseur de pagination invalide.")
+    if not isinstance(data, list) or len(data) < 2 or data[0] != sort:
+        raise CursorError("Curseur de pagination invalide pour ce tri.")
+    return tuple(data[1:])
+
+
+def _prefix_end(prefix: str) -> str:
+    # Plus petite chaîne supérieure à toutes celles qui commencent par `prefix`.
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ListingIndex:
+    """
+    Index trié d'une liste d'utilisateurs ou de groupes. Le préfixe (tri par
+    nom) et la plage d'identifiants (tri par identifiant) se résolvent par
+    recherche dichotomique ; la sous-chaîne et le shell sont vérifiés au fil du
+    parcours, qui s'arrête dès que la page est pleine. Le tri est stable : à
+    identifiant égal, les entrées sont classées par nom.
+
+    Le nombre d'entrées retenues par un filtre vérifié entrée par entrée est
+    compté une fois par index et par filtre : les pages suivantes ne refont pas
+    ce parcours.
+    """
+
+    # Nombre de totaux de filtres gardés par index ; au-delà, ils sont tous oubliés.
+    MAX_TOTALS = 256
+
+    def __init__(self, entries: List[Dict[str, Any]], id_field: str, search_fields: Tuple[str, ...]):
+        self.id_field = id_field
+        self.search_fields = search_fields
+        self._orders: Dict[str, Tuple[List[Dict[str, Any]], List[Tuple]]] = {}
+        by_name = sorted(entries, key=lambda e: e['name'])
+        self._orders['name'] = (by_name, [(e['name'],) for e in by_name])
+        self._totals: Dict[Tuple, int] = {}
+
+    @property
+    def sorts(self) -> Tuple[str, str]:
+        return ('name', self.id_field)
+
+    def __len__(self) -> int:
+        return len(self._orders['name'][0])
+
+    def _order(self, sort: str) -> Tuple[List[Dict[str, Any]], List[Tuple]]:
+        order = self._orders.get(sort)
+        if order is None:
+            # Construit au premier tri demandé sur l'identifiant ; les entrées sans identifiant viennent en premier.
+            keyed = sorted(((e[sort] if e[sort] is not None else -1, e['name']), e)
+                           for e in self._orders['name'][0])
+            order = self._orders[sort] = ([e for _, e in keyed], [k for k, _ in keyed])
+        return order
+
+    def page(self, *, sort: str = 'name', prefix: Optional[str] = None, search: Optional[str] = None,
+             id_min: Optional[int] = None, id_max: Optional[int] = None,
+             match: Optional[Callable[[Dict[str, Any]], bool]] = None, match_key: Optional[Tuple] = None,
+             cursor: Optional[str] = None, skip: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """
+        Retourne une page d'entrées, le nombre total d'entrées retenues par les
+        filtres ('total', toujours un entier) et le curseur de la page suivante
+        (None en fin de liste). `match_key` identifie le filtre `match` pour
+        garder son total ; sans lui, le total d'un filtre `match` est recompté
+        à chaque page.
+        """
+        if sort not in self.sorts:
+            raise ValueError(f"Tri inconnu (attendu : {', '.join(self.sorts)}).")
+        entries, keys = self._order(sort)
+        lo, hi = 0, len(entries)
+        checks: List[Callable[[Dict[str, Any]], bool]] = []
+
+        if prefix:
+            if sort == 'name':
+                lo = bisect.bisect_left(keys, (prefix,))
+                hi = bisect.bisect_left(keys, (_prefix_end(prefix),))
+            else:
+                checks.append(lambda e: e['name'].startswith(prefix))
+        if id_min is not None or id_max is not None:
+            if sort == self.id_field:
+                if id_min is not None:
+                    lo = max(lo, bisect.bisect_left(keys, (id_min,)))
+                if id_max is not None:
+                    hi = min(hi, bisect.bisect_left(keys, (id_max + 1,)))
+            else:
+                field = self.id_field
+                checks.append(lambda e: e[field] is not None
+                              and (id_min is None or e[field] >= id_min)
+                              and (id_max is None or e[field] <= id_max))
+        if search:
+            needle = search.lower()
+            fields = self.search_fields
+            checks.append(lambda e: any(needle in (e[f] or '').lower() for f in fields))
+        if match is not None:
+            checks.append(match)
+
+        if not checks:
+            total = max(hi - lo, 0)
+        else:
+            key = (sort, lo, hi, prefix, search, id_min, id_max, match_key) if match is None or match_key is not None else None
+            total = self._totals.get(key) if key else None
+            if total is None:
+                total = sum(1 for i in range(lo, hi) if all(check(entries[i]) for check in checks))
+                if key:
+                    if len(self._totals) >= self.MAX_TOTALS:
+                        self._totals.clear()
+                    self._totals[key] = total
+        start = lo
+        if cursor:
+            start = max(start, bisect.bisect_right(keys, _decode_cursor(cursor, sort)))
+
+        page: List[Dict[str, Any]] = []
+        last = None
+        i = start
+        while i < hi and len(page) <= limit:
+            entry = entries[i]
+            if all(check(entry) for check in checks):
+                if skip:
+                    skip -= 1
+                else:
+                    page.append(entry)
+                    if len(page) <= limit:
+                        last = keys[i]
+            i += 1
+
+        has_more = len(page) > limit
+        return {
+            'items': page[:limit],
+            'total': total,
+            'next_cursor': _encode_cursor(sort, last) if has_more else None,
+        }
+
+
+class ListingCache:
+    """
+    Garde l'index construit pour le dernier résultat de chaque action de liste.
+    Le cache de résultats rendant le même objet tant qu'il est valide, l'index
+    n'est reconstruit qu'après un nouveau run du playbook.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[Tuple[str, str], Tuple[Any, ListingIndex]] = {}
+
+    def get(self, key: Tuple[str, str], result: Any, build: Callable[[Any], ListingIndex]) -> ListingIndex:
+        cached = self._indexes.get(key)
+        if cached is not None and cached[0] is result:
+            return cached[1]
+        index = build(result)
+        self._indexes[key] = (result, index)
+        return index
+
+
+def build_user_index(raw: Any) -> ListingIndex:
+    return ListingIndex(user_entries(raw), 'uid', ('name', 'gecos'))
+
+
+def build_group_index(raw: Any) -> ListingIndex:
+    return ListingIndex(group_entries(raw), 'gid', ('name',))
+
+
+listing_cache = ListingCache()
@@ -0,0 +1,275 @@
+"""
+Flux du dashboard en direct (GET /api/dashboard/live, Server-Sent Events).
+
+Un seul calcul pour tous les écrans : à chaque tick, DashboardFeed relit les
+nouveaux runs et, s'il y en a, les compteurs et percentiles dans les agrégats ;
+il compare le résultat à l'état précédent et n'envoie que ce qui a changé. Le
+message est encodé une fois et ajouté à la file de chaque écran connecté : cent
+dashboards ouverts coûtent le même calcul qu'un seul.
+"""
+import asyncio
+import collections
+import json
+import os
+import time
+from typing import Any, Deque, Dict, Optional, Set
+
+from app.database import STATS_WINDOWS, get_dashboard_stats, get_runs_after, get_window_stats
+from app.jobs import job_manager
+from app.metrics import Gauge
+from app.run_broker import run_broker
+from app.services import limiter
+from app.snapshot import inventory_snapshot
+
+# Intervalle (secondes) entre deux calculs de l'état du dashboard.
+DASHBOARD_TICK = float(os.environ.get('API_DASHBOARD_TICK', '1.0'))
+# Sans changement pendant cette durée (secondes), un message de maintien est envoyé.
+DASHBOARD_HEARTBEAT = float(os.environ.get('API_DASHBOARD_HEARTBEAT', '15'))
+# Fenêtre des percentiles affichés (clé de STATS_WINDOWS).
+DASHBOARD_WINDOW = os.environ.get('API_DASHBOARD_WINDOW', '1h')
+# Nombre de derniers runs affichés.
+DASHBOARD_RECENT_RUNS = int(os.environ.get('API_DASHBOARD_RECENT_RUNS', '20'))
+# Messages en attente d'envoi par écran ; au-delà, l'écran est resynchronisé.
+DASHBOARD_VIEWER_QUEUE = int(os.environ.get('API_DASHBOARD_VIEWER_QUEUE', '64'))
+# Les agrégats sont par minute : sans nouveau run, les percentiles ne changent
+# (par sortie de la fenêtre) qu'au plus une fois par minute.
+STATS_MAX_AGE = 60.0
+
+
+def _delta(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Clés de `new` absentes ou différentes dans `old`, récursivement pour les
+    dictionnaires ; une clé supprimée vaut None. Le client fusionne le delta
+    dans son état (None supprime la clé).
+    """
+    changes = {}
+    for key, value in new.items():
+        before = old.get(key)
+        if key in old and before == value:
+            continue
+        if isinstance(value, dict) and isinstance(before, dict):
+            changes[key] = _delta(before, value)
+        else:
+            changes[key] = value
+    for key in old.keys() - new.keys():
+        changes[key] = None
+    return changes
+
+
+def _frame(seq: int, event: str, data: Dict[str, Any]) -> str:
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Viewer:
+    """
+    File d'envoi d'un écran. Les messages sont partagés entre tous les écrans
+    (encodés une fois). Un écran trop lent n'est jamais attendu : sa file est
+    vidée et il reçoit l'état complet au prochain envoi.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.resync = True
+        self._frames: Deque[str] = collections.deque()
+        self._ready = asyncio.Event()
+
+    def offer(self, frame: str):
+        if self.resync:
+            return  # l'état complet couvrira ce message
+        if len(self._frames) >= self.max_size:
+            self._frames.clear()
+            self.resync = True
+        else:
+            self._frames.append(frame)
+        self._ready.set()
+
+    async def get(self, feed: 'DashboardFeed') -> str:
+        while not self._frames and not self.resync:
+            self._ready.clear()
+            await self._ready.wait()
+        if self.resync:
+            self.resync = False
+            self._frames.clear()
+            return feed.snapshot_frame()
+        return self._frames.popleft()
+
+
+class DashboardFeed:
+    """
+    Calcule l'état du dashboard (compteurs, durées moyennes, percentiles de la
+    fenêtre, derniers runs, jobs et runs diffusés en cours, instantané de
+    l'inventaire) et diffuse ses changements à tous les écrans connectés.
+    Sans écran, rien n'est calculé.
+    """
+
+    def __init__(self, interval: float, heartbeat: float, window: str, recent_runs: int, viewer_queue: int):
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.window = window
+        self.recent_runs = recent_runs
+        self.viewer_queue = viewer_queue
+        self.viewers: Set[Viewer] = set()
+        self.seq = 0
+        self.state: Dict[str, Any] = {}
+        self.runs: Deque[Dict[str, Any]] = collections.deque(maxlen=recent_runs)
+        self._last_run_id = 0
+        self._stats: Dict[str, Any] = {}
+        self._stats_at = 0.0
+        self._last_frame_at = 0.0
+        self._snapshot: Optional[tuple] = None
+        self._tick_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.ticks = 0
+        self.stats_queries = 0
+        self.frames = 0
+        self.last_tick_duration: Optional[float] = None
+
+    # --- Écrans ---
+
+    async def subscribe(self, last_seq: Optional[int] = None) -> Viewer:
+        """
+        Ajoute un écran. Son premier message est l'état complet, sauf s'il se
+        reconnecte (Last-Event-ID) avec l'état courant.
+        """
+        viewer = Viewer(self.viewer_queue)
+        if not self.state:
+            await self.tick()
+        viewer.resync = last_seq != self.seq
+        self.viewers.add(viewer)
+        if self._wake is not None:
+            self._wake.set()
+        return viewer
+
+    def unsubscribe(self, viewer: Viewer):
+        self.viewers.discard(viewer)
+
+    def snapshot_frame(self) -> str:
+        """État complet, encodé une fois par version."""
+        if self._snapshot is None or self._snapshot[0] != self.seq:
+            data = {**self.state, 'runs': list(self.runs), 'runs_limit': self.recent_runs}
+            self._snapshot = (self.seq, _frame(self.seq, 'snapshot', data))
+        return self._snapshot[1]
+
+    def _broadcast(self, frame: str):
+        self.frames += 1
+        self._last_frame_at = time.monotonic()
+        for viewer in self.viewers:
+            viewer.offer(frame)
+
+    # --- Calcul ---
+
+    async def tick(self):
+        """Recalcule l'état ; les appels simultanés partagent le même calcul."""
+        if self._tick_task is None or self._tick_task.done():
+            self._tick_task = asyncio.ensure_future(self._tick())
+        await asyncio.shield(self._tick_task)
+
+    def _read_db(self, refresh_stats: bool) -> tuple:
+        # Exécuté hors de la boucle d'événements.
+        runs = get_runs_after(self._last_run_id, self.recent_runs)
+        if runs or refresh_stats:
+            self.stats_queries += 1
+            return runs, get_dashboard_stats(), get_window_stats(STATS_WINDOWS[self.window])
+        return runs, None, None
+
+    async def _tick(self):
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        refresh_stats = not self._stats or start - self._stats_at >= STATS_MAX_AGE
+        runs, totals, window = await loop.run_in_executor(None, self._read_db, refresh_stats)
+        if totals is not None:
+            self._stats = self._format_stats(totals, window)
+            self._stats_at = start
+        if runs:
+            self._last_run_id = runs[-1]['id']
+            self.runs.extend(runs)
+
+        state = {**self._stats, **self._live_state()}
+        changes = _delta(self.state, state)
+        self.ticks += 1
+        if changes or runs:
+            self.state = state
+            self.seq += 1
+            delta = {'changes': changes}
+            if runs:
+                delta['runs'] = runs
+            self._broadcast(_frame(self.seq, 'delta', delta))
+        elif start - self._last_frame_at >= self.heartbeat:
+            self._broadcast(f"id: {self.seq}\n: ping\n\n")
+        self.last_tick_duration = round(time.monotonic() - start, 6)
+
+    def _format_stats(self, totals: Dict[str, Any], window: Dict[str, Any]) -> Dict[str, Any]:
+        keep = ('count', 'failure', 'failure_rate', 'avg_duration', 'p50', 'p95', 'p99')
+        return {
+            'totals': {k: totals[k] for k in ('total', 'success', 'failure')},
+            'avg_duration': totals['avg_duration'],
+            'window': {
+                'name': self.window,
+                'totals': {k: window['totals'][k] for k in keep},
+                'actions': {f"{a['service']} {a['action']}": {k: a[k] for k in keep} for a in window['actions']},
+            },
+        }
+
+    def _live_state(self) -> Dict[str, Any]:
+        """Parties de l'état tenues en mémoire : lues à chaque tick, sans E/S."""
+        executor = limiter.stats()
+        snapshot = inventory_snapshot.data
+        return {
+            'executor': {k: executor[k] for k in ('running', 'queued', 'rejected')},
+            'jobs': {
+                job['id']: {k: job.get(k) for k in ('service', 'action', 'state', 'submitted_at', 'started_at')}
+                for job in job_manager.active()
+            },
+            'streams': {
+                info['run_id']: {k: info[k] for k in ('service', 'action', 'state', 'lines', 'subscribers')}
+                for info in (run.info() for run in run_broker.runs.values() if not run.finished)
+            },
+            'inventory': {
+                'users': len(snapshot['users']),
+                'groups': len(snapshot['groups']),
+                'sites': len(snapshot['sites']),
+                'enabled': sum(1 for site in snapshot['sites'] if site['enabled']),
+                'updated_at': snapshot['updated_at'],
+                'errors': snapshot['errors'],
+            },
+        }
+
+    async def _run(self):
+        while True:
+            if not self.viewers:
+                self._wake.clear()
+                await self._wake.wait()
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"ERREUR: calcul du dashboard impossible : {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._loop_task is None:
+            self._wake = asyncio.Event()
+            self._loop_task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'viewers': len(self.viewers),
+            'seq': self.seq,
+            'ticks': self.ticks,
+            'stats_queries': self.stats_queries,
+            'frames': self.frames,
+            'last_tick_duration': self.last_tick_duration,
+        }
+
+
+dashboard_feed = DashboardFeed(DASHBOARD_TICK, DASHBOARD_HEARTBEAT, DASHBOARD_WINDOW,
+                               DASHBOARD_RECENT_RUNS, DASHBOARD_VIEWER_QUEUE)
+
+Gauge('api_dashboard_viewers', "Écrans connectés au flux du dashboard en direct.",
+      callback=lambda: {(): len(dashboard_feed.viewers)})
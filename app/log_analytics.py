@@ -0,0 +1,221 @@
+import asyncio
+import bisect
+import calendar
+import glob
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.database import (
+    DURATION_BUCKETS, _merge_access_counter, get_access_log_offset, new_access_counter, save_access_log_chunk
+)
+from app.nginx_logs import NGINX_LOG_DIR, vhost_log_path
+
+# Intervalle (secondes) entre deux lectures des logs d'accès en arrière-plan (0 : à la demande seulement).
+ACCESS_LOG_INGEST_INTERVAL = float(os.environ.get('API_ACCESS_LOG_INTERVAL', '60'))
+# Taille d'un morceau de log analysé (et enregistré) d'un coup.
+ACCESS_LOG_CHUNK = 8 * 1024 * 1024
+
+# Format 'api_vhost' (voir le rôle nginx_vhost) : le format 'combined' suivi de
+# $request_time et $upstream_response_time. Une ligne au format 'combined' seul
+# est comptée sans latences. Une seule expression parcourt tout le morceau :
+# seuls les champs agrégés sont extraits, le reste de la ligne n'est pas découpé.
+_LINE_RE = re.compile(
+    rb'^\S+ \S+ \S+ \[(\d\d/\w\w\w/\d{4}:\d\d:\d\d):\d\d ([+-]\d{4})\] "[^"\n]*" (\d{3}) (\d+|-)'
+    rb'(?: "[^"\n]*" "[^"\n]*" ([\d.]+|-) ([^\n]*))?',
+    re.M
+)
+_MONTHS = {m.encode(): i for i, m in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _minute_bucket(minute: bytes, tz: bytes) -> str:
+    # '31/Jan/2024:12:00' et '+0100' -> '2024-01-31 11:00:00' (UTC, comme les agrégats des runs).
+    day, month, rest = minute.split(b'/')
+    year, hour, mins = rest.split(b':')
+    offset = (int(tz[1:3]) * 60 + int(tz[3:5])) * (1 if tz[:1] == b'+' else -1)
+    ts = calendar.timegm((int(year), _MONTHS[month], int(day), int(hour), int(mins), 0)) - offset * 60
+    return time.strftime('%Y-%m-%d %H:%M:00', time.gmtime(ts))
+
+
+def _duration(value: bytes) -> Optional[Tuple[float, int]]:
+    # '0.004', '-' ou plusieurs upstreams ('0.002, 0.004' ou '0.001 : 0.003') : durée totale.
+    total, found = 0.0, False
+    for token in re.split(rb'[,:\s]+', value.strip()):
+        try:
+            total += float(token)
+            found = True
+        except ValueError:
+            pass
+    if not found:
+        return None
+    return total, bisect.bisect_left(DURATION_BUCKETS, total)
+
+
+def parse_chunk(data: bytes) -> Tuple[Dict[Tuple[str, int], List], int]:
+    """
+    Agrège un morceau de log d'accès (lignes complètes) en compteurs par
+    (minute UTC, statut). Retourne (compteurs, nombre de lignes reconnues).
+    Les dates et les durées se répètent d'une ligne à l'autre : les lignes sont
+    regroupées sur leurs champs bruts, et chaque valeur distincte n'est
+    convertie qu'une fois par morceau.
+    """
+    counters: Dict[Tuple[str, int], List] = {}
+    buckets: Dict[Tuple[bytes, bytes], str] = {}
+    durations: Dict[bytes, Optional[Tuple[float, int]]] = {b'': None, b'-': None}
+    matches = _LINE_RE.findall(data)
+    for minute, tz, status, size, request_time, upstream in matches:
+        key = (minute, tz, status)
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = new_access_counter()
+        counter[0] += 1
+        if size != b'-':
+            counter[1] += int(size)
+        parsed = durations.get(request_time, False)
+        if parsed is False:
+            parsed = durations[request_time] = _duration(request_time)
+        if parsed is not None:
+            seconds, index = parsed
+            counter[2] += seconds
+            if seconds > counter[3]:
+                counter[3] = seconds
+            histogram = counter[4]
+            histogram[index] = histogram.get(index, 0) + 1
+        parsed = durations.get(upstream, False)
+        if parsed is False:
+            parsed = durations[upstream] = _duration(upstream)
+        if parsed is not None:
+            seconds, index = parsed
+            counter[5] += 1
+            counter[6] += seconds
+            if seconds > counter[7]:
+                counter[7] = seconds
+            histogram = counter[8]
+            histogram[index] = histogram.get(index, 0) + 1
+
+    # Les clés brutes sont converties une fois par (minute, fuseau, statut).
+    merged: Dict[Tuple[str, int], List] = {}
+    for (minute, tz, status), counter in counters.items():
+        bucket = buckets.get((minute, tz))
+        if bucket is None:
+            bucket = buckets[(minute, tz)] = _minute_bucket(minute, tz)
+        key = (bucket, int(status))
+        if key in merged:
+            _merge_access_counter(merged[key], counter)
+        else:
+            merged[key] = counter
+    return merged, len(matches)
+
+
+def _lock(path: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def _ingest_file(f, server_name: str, path: str, inode: int, offset: int,
+                 report: Dict[str, int], final: bool = False):
+    # Lit le fichier ouvert depuis `offset` jusqu'à sa dernière ligne complète
+    # (ou jusqu'au bout pour un fichier renommé qui ne grandira plus).
+    while True:
+        f.seek(offset)
+        data = f.read(ACCESS_LOG_CHUNK)
+        end = data.rfind(b'\n')
+        if end < 0 and len(data) == ACCESS_LOG_CHUNK:
+            end = len(data) - 1  # ligne plus longue qu'un morceau : ignorée
+        elif end < 0 and not (final and data):
+            return
+        elif end >= 0:
+            data = data[:end + 1]
+        counters, matched = parse_chunk(data)
+        offset += len(data)
+        save_access_log_chunk(server_name, path, inode, offset, counters)
+        report['bytes'] += len(data)
+        report['lines'] += matched
+        report['skipped'] += data.count(b'\n') + (0 if data.endswith(b'\n') else 1) - matched
+
+
+def ingest_vhost(server_name: str) -> Dict[str, int]:
+    """
+    Analyse la partie du log d'accès d'un site qui n'a pas encore été lue, à
+    partir de la position enregistrée. Après une rotation, la fin du fichier
+    renommé (<log>.1) est lue avant le nouveau fichier ; un fichier tronqué est
+    relu depuis le début. Retourne les octets et lignes analysés.
+    """
+    path = vhost_log_path(server_name, 'access')
+    report = {'bytes': 0, 'lines': 0, 'skipped': 0}
+    with _lock(path):
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return report
+        with f:
+            st = os.fstat(f.fileno())
+            stored = get_access_log_offset(path)
+            offset = 0
+            if stored is not None and stored[0] == st.st_ino:
+                offset = stored[1] if stored[1] <= st.st_size else 0
+            elif stored is not None:
+                try:
+                    with open(f'{path}.1', 'rb') as old:
+                        if os.fstat(old.fileno()).st_ino == stored[0]:
+                            _ingest_file(old, server_name, path, stored[0], stored[1], report, final=True)
+                except OSError:
+                    pass
+            _ingest_file(f, server_name, path, st.st_ino, offset, report)
+    return report
+
+
+def logged_vhosts() -> List[str]:
+    """Sites qui ont un log d'accès dans NGINX_LOG_DIR."""
+    suffix = '.access.log'
+    return sorted(os.path.basename(p)[:-len(suffix)] for p in glob.glob(os.path.join(NGINX_LOG_DIR, f'*{suffix}')))
+
+
+class AccessLogIngester:
+    """
+    Lit en arrière-plan les nouvelles lignes des logs d'accès de tous les sites,
+    pour que les statistiques d'un site soient prêtes sans tout relire à la
+    première demande. Les lectures se font hors de la boucle d'événements.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def ingest(self, server_name: str) -> Dict[str, int]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, ingest_vhost, server_name)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = time.time()
+            reports = {}
+            for server_name in await loop.run_in_executor(None, logged_vhosts):
+                try:
+                    reports[server_name] = await self.ingest(server_name)
+                except Exception as e:
+                    print(f"ERREUR: analyse du log d'accès de '{server_name}' : {e}")
+            self.last_run = {'at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                             'duration': round(time.time() - start, 3), 'sites': reports}
+            await asyncio.sleep(self.interval)
+
+
+access_log_ingester = AccessLogIngester(ACCESS_LOG_INGEST_INTERVAL)
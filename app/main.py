@@ -1,17 +1,45 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
-from app.database import init_db
+from app.database import init_db, start_metrics_writer, stop_metrics_writer
+from app.services import ExecutorSaturatedError, start_backend, stop_backend
 from app.routes.user import router as user_router
 from app.routes.webserver import router as webserver_router
 from app.routes.streaming import router as streaming_router
 from app.routes.actions import router as actions_router
 from app.routes.dashboard import router as dashboard_router
+from app.routes.jobs import router as jobs_router
+from app.routes.runs import router as runs_router
+from app.routes.metrics import router as metrics_router
+from app.jobs import job_manager
+from app.run_broker import run_broker
+from app.snapshot import inventory_snapshot
+from app.live_dashboard import dashboard_feed
+from app.log_analytics import access_log_ingester
+from app.retention import history_retention
+from app.metrics import MetricsMiddleware
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    start_metrics_writer()
+    await start_backend()
+    await job_manager.start()
+    inventory_snapshot.start()
+    access_log_ingester.start()
+    history_retention.start()
+    dashboard_feed.start()
     yield
+    await dashboard_feed.stop()
+    await history_retention.stop()
+    await access_log_ingester.stop()
+    await inventory_snapshot.stop()
+    await job_manager.stop()
+    await run_broker.stop()
+    await stop_backend()
+    # En dernier : les runs interrompus ci-dessus sont aussi enregistrés.
+    stop_metrics_writer()
 
 app = FastAPI(
     title="API de Contrôle Ansible",
@@ -27,6 +55,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Latence et code de réponse de chaque requête, par route, exportés sur /metrics.
+app.add_middleware(MetricsMiddleware)
+
+# Toutes les routes qui lancent un playbook répondent 503 quand l'exécuteur est saturé.
+@app.exception_handler(ExecutorSaturatedError)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturatedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": {"status": "error", "message": str(exc)}},
+        headers={"Retry-After": "5"},
+    )
 
 # On n'inclut plus le routeur d'authentification
 app.include_router(user_router)
@@ -34,6 +73,9 @@ app.include_router(webserver_router)
 app.include_router(streaming_router)
 app.include_router(actions_router)
 app.include_router(dashboard_router)
+app.include_router(jobs_router)
+app.include_router(runs_router)
+app.include_router(metrics_router)
 
 @app.get("/", tags=["Root"])
 def read_root():
@@ -0,0 +1,241 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Bornes (secondes) des histogrammes. Les latences des routes, la durée des
+# playbooks, les opérations courtes (lancement d'un processus, analyse de la
+# sortie, écriture SQLite) et les attentes avant un run n'ont pas les mêmes
+# ordres de grandeur.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PLAYBOOK_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Compteur croissant, par valeurs d'étiquettes."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labels, k)} {_number(v)}' for k, v in values]
+
+
+class Gauge(_Metric):
+    """
+    Valeur instantanée. Avec `callback`, la valeur est lue au moment de
+    l'export ({valeurs d'étiquettes: valeur}) : rien n'est fait sur le chemin
+    des requêtes.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        if self.callback is not None:
+            values = sorted(self.callback().items())
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.labels, k)} {_number(v)}' for k, v in values]
+
+
+class Histogram(_Metric):
+    """
+    Histogramme à bornes fixes. Une observation coûte une recherche
+    dichotomique et trois incréments ; les comptes cumulés sont calculés à
+    l'export seulement.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # Valeurs d'étiquettes -> [comptes par borne (+Inf en dernier), somme, nombre].
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        """Mesure la durée d'un bloc `with`."""
+        return _Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        lines = []
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, labels)} {count}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def render() -> str:
+    """Toutes les métriques au format texte de Prometheus (version 0.0.4)."""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+# --- Métriques de l'API ---
+# Les jauges des playbooks en cours et en attente, et la profondeur des files de
+# l'ordonnanceur, sont déclarées avec le limiteur (app/services.py), qui porte leur valeur.
+
+# Le nombre de requêtes par route et code de réponse est le '_count' de l'histogramme.
+HTTP_REQUEST_DURATION = Histogram(
+    'api_http_request_duration_seconds',
+    "Durée des requêtes HTTP jusqu'à l'envoi des en-têtes de la réponse, par route et code de réponse.",
+    ('method', 'route', 'status'),
+)
+PLAYBOOK_DURATION = Histogram(
+    'api_playbook_duration_seconds', "Durée des runs de playbook, attente d'un créneau exclue.",
+    ('service', 'action', 'status'), PLAYBOOK_BUCKETS,
+)
+SUBPROCESS_SPAWN = Histogram(
+    'api_subprocess_spawn_seconds', "Temps de lancement d'un processus ansible-playbook ou d'un worker.",
+    ('kind',), FAST_BUCKETS,
+)
+SUMMARY_PARSE = Histogram(
+    'api_summary_parse_seconds', "Temps d'analyse de la sortie d'Ansible et de construction du résumé, par run.",
+    ('format',), FAST_BUCKETS,
+)
+NATIVE_READ_DURATION = Histogram(
+    'api_native_read_duration_seconds', "Durée des lectures servies sans Ansible (app/native_backend.py).",
+    ('service', 'action'), FAST_BUCKETS,
+)
+SQLITE_WRITE = Histogram(
+    'api_sqlite_write_seconds', "Durée des écritures SQLite (transaction complète).", ('operation',), FAST_BUCKETS,
+)
+SCHEDULER_WAIT = Histogram(
+    'api_scheduler_wait_seconds',
+    "Attente d'un run avant son exécution : verrous de ses ressources ('resource') puis créneau ('slot'), par priorité.",
+    ('stage', 'priority'), WAIT_BUCKETS,
+)
+
+# Route des requêtes qui ne correspondent à aucune route : le chemin brut n'est
+# pas utilisé comme étiquette, pour ne pas créer une série par URL inconnue.
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI qui mesure chaque requête HTTP. L'étiquette 'route' est le
+    modèle de la route (/api/webserver/{server_name}/status), connu une fois la
+    requête routée. La durée s'arrête à l'envoi des en-têtes : une réponse en
+    flux (SSE) compte son temps de première réponse, pas la durée du flux.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if status is None and message['type'] == 'http.response.start':
+                status = message['status']
+                _observe_request(scope, status, time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Exception non gérée avant toute réponse : comptée comme une erreur 500.
+            if status is None:
+                _observe_request(scope, 500, time.perf_counter() - start)
+
+
+def _observe_request(scope, status: int, duration: float):
+    route = getattr(scope.get('route'), 'path', None) or UNMATCHED_ROUTE
+    HTTP_REQUEST_DURATION.observe(duration, scope['method'], route, status)
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import Any, Dict, Literal, Optional
+
+# Définit un modèle de données pour la soumission d'un job asynchrone.
+class JobRequest(BaseModel):
+    # Le service ciblé, comme pour les routes synchrones.
+    service: Literal['user', 'webserver']
+    # L'action du playbook (validée contre app.jobs.JOB_ACTIONS).
+    action: str
+    # Les mêmes champs que la requête synchrone équivalente.
+    payload: Dict[str, Any] = {}
+    # Optionnel : hôte, groupe ou motif de l'inventaire, et hôtes traités en parallèle.
+    target: Optional[str] = None
+    forks:  Optional[int] = None
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 
 # Définit un modèle de données pour les requêtes liées aux utilisateurs.
 # Pydantic valide automatiquement que les données entrantes correspondent à ce schéma.
@@ -13,4 +13,17 @@ class UserRequest(BaseModel):
     # Les autres champs sont optionnels car ils ne sont pas requis pour toutes les actions.
     username: Optional[str] = None
     password: Optional[str] = None
-    group:    Optional[str] = None
\ No newline at end of file
+    group:    Optional[str] = None
+
+
+# Une opération d'un lot : mêmes champs qu'une requête unitaire.
+class UserBatchOperation(BaseModel):
+    action: Literal['create', 'delete', 'add_group', 'del_group', 'create_group']
+    username: Optional[str] = None
+    password: Optional[str] = None
+    group:    Optional[str] = None
+
+
+# Un lot d'opérations exécuté en un seul run de playbook.
+class UserBatchRequest(BaseModel):
+    operations: List[UserBatchOperation]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 
 # Définit un modèle de données pour les requêtes liées aux sites web.
 class WebsiteRequest(BaseModel):
@@ -12,4 +12,8 @@ class WebsiteRequest(BaseModel):
     # Le dossier racine n'est requis que pour certaines actions (ex: 'create').
     root_dir: Optional[str] = None
     # Le port a une valeur par défaut de 80 si non fourni.
-    port: int = 80
\ No newline at end of file
+    port: int = 80
+
+# Un lot de modifications de sites appliqué en un seul run (un seul rechargement de Nginx).
+class WebsiteChangeSetRequest(BaseModel):
+    operations: List[WebsiteRequest]
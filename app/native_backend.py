@@ -0,0 +1,349 @@
+"""
+Backend natif des lectures sur l'hôte local.
+
+Quand la cible d'un run est la machine de l'API, les lectures simples
+(utilisateurs, groupes, sites, statut et configuration d'un site) ne font que
+lire les bases passwd/group et quelques fichiers de NGINX_CONF_DIR : elles
+sont servies ici, en Python, sans lancer Ansible.
+
+La sortie reproduit celle du callback 'json' d'Ansible pour les tâches du rôle
+(inclusions, tâches ignorées, message affiché, statistiques), sans les faits
+ni les paramètres des modules : elle passe ensuite par le même summarize() que
+le backend Ansible, la réponse a donc exactement la même forme. Les écritures,
+les hôtes distants et les motifs de cible restent exécutés par Ansible ; une
+lecture impossible ici (droits insuffisants) lève NativeFallback et repasse
+par le playbook.
+"""
+import datetime
+import grp
+import json
+import os
+import pwd
+import shlex
+import stat
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# '1' pour servir ici les lectures sur l'hôte local ; par défaut, toutes passent par Ansible.
+NATIVE_READS_ENABLED = os.environ.get('API_NATIVE_READS', '0') == '1'
+# Dossier de configuration de Nginx ; passé au rôle nginx_vhost ('nginx_conf_dir').
+NGINX_CONF_DIR = os.environ.get('API_NGINX_CONF_DIR', '/etc/nginx')
+
+# Groupe ciblé par le playbook sans 'target'.
+DEFAULT_TARGET = 'local_managed'
+# Adresses de la machine de l'API.
+LOCAL_ADDRESSES = {'localhost', '127.0.0.1', '::1'}
+# Connexions Ansible qui atteignent l'adresse de l'hôte (SSH ou exécution locale).
+_HOST_CONNECTIONS = {None, 'ssh', 'paramiko', 'smart'}
+
+
+class NativeFallback(Exception):
+    """La lecture ne peut pas être servie par le backend natif : le playbook prend le relais."""
+
+
+# --- Inventaire ---
+
+def _inventory_files(source: str) -> Optional[List[str]]:
+    """Fichiers .ini de l'inventaire ; None si un fichier n'est pas au format INI (YAML, script...)."""
+    if not os.path.isdir(source):
+        return [source] if os.path.isfile(source) else None
+    files = []
+    for name in sorted(os.listdir(source)):
+        if name.startswith('.') or name.endswith('~'):
+            continue
+        if not name.endswith('.ini'):
+            return None
+        files.append(os.path.join(source, name))
+    return files
+
+
+def _parse_inventory(files: List[str]) -> Optional[Dict[str, Dict[str, Dict[str, str]]]]:
+    """
+    Lit des inventaires INI : groupe -> hôte -> variables (celles de la ligne
+    de l'hôte complétées par la section [groupe:vars]). None si un groupe a
+    des sous-groupes ([groupe:children]) : seul Ansible sait alors le résoudre.
+    """
+    groups: Dict[str, Dict[str, Dict[str, str]]] = {}
+    group_vars: Dict[str, Dict[str, str]] = {}
+    for path in files:
+        section, kind = 'ungrouped', 'hosts'
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] in '#;':
+                    continue
+                if line.startswith('[') and line.endswith(']'):
+                    section, _, kind = line[1:-1].partition(':')
+                    kind = kind or 'hosts'
+                    if kind == 'children':
+                        return None
+                    continue
+                tokens = shlex.split(line, comments=True)
+                if kind == 'vars':
+                    key, _, value = line.partition('=')
+                    group_vars.setdefault(section, {})[key.strip()] = value.strip()
+                elif tokens:
+                    host_vars = dict(t.split('=', 1) for t in tokens[1:] if '=' in t)
+                    groups.setdefault(section, {})[tokens[0]] = host_vars
+    for name, variables in group_vars.items():
+        for host_vars in groups.get(name, {}).values():
+            for key, value in variables.items():
+                host_vars.setdefault(key, value)
+    return groups
+
+
+def _is_local(name: str, host_vars: Dict[str, str]) -> bool:
+    connection = host_vars.get('ansible_connection')
+    if connection == 'local':
+        return True
+    return connection in _HOST_CONNECTIONS and host_vars.get('ansible_host', name) in LOCAL_ADDRESSES
+
+
+class LocalInventory:
+    """Résout une cible en hôte local, à partir de l'inventaire relu dès qu'il change."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self._version: Optional[Tuple] = None
+        self._groups: Optional[Dict[str, Dict[str, Dict[str, str]]]] = None
+
+    def _load(self):
+        files = _inventory_files(self.source)
+        try:
+            version = tuple((path, os.stat(path).st_mtime_ns) for path in files) if files else None
+        except OSError:
+            version = None
+        if version != self._version or version is None:
+            self._version = version
+            self._groups = _parse_inventory(files) if version else None
+        return self._groups
+
+    def local_host(self, target: Optional[str] = None) -> Optional[str]:
+        """
+        Nom de l'hôte si `target` (groupe par défaut sans cible) désigne
+        exactement un hôte, et que c'est la machine de l'API ; None sinon.
+        """
+        groups = self._load()
+        if groups is None:
+            return None
+        target = target or DEFAULT_TARGET
+        if target in groups:
+            hosts = groups[target]
+        else:
+            hosts = {}
+            for members in groups.values():
+                if target in members:
+                    hosts = {target: {**hosts.get(target, {}), **members[target]}}
+        if len(hosts) != 1:
+            return None
+        name, host_vars = next(iter(hosts.items()))
+        return name if _is_local(name, host_vars) else None
+
+
+# --- Exécution des lectures ---
+
+class _TaskFailed(Exception):
+    def __init__(self, msg: str, **result):
+        super().__init__(msg)
+        self.result = {'msg': msg, **result}
+
+
+def _now() -> str:
+    # Même format d'horodatage que le callback 'json' (UTC).
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class _Run:
+    """Enregistre les tâches d'un run au format de la sortie du callback 'json'."""
+
+    def __init__(self, host: str, play: str):
+        self.host = host
+        self.play = play
+        self.tasks: List[Dict[str, Any]] = []
+        self.stats = {'ok': 0, 'changed': 0, 'failures': 0, 'unreachable': 0, 'skipped': 0, 'rescued': 0, 'ignored': 0}
+        self.failed = False
+
+    def _record(self, name: str, module: str, result: Dict[str, Any], start: str):
+        result['action'] = module
+        self.tasks.append({'task': {'name': name, 'duration': {'start': start, 'end': _now()}},
+                           'hosts': {self.host: result}})
+
+    def skip(self, name: str, module: str):
+        self.stats['skipped'] += 1
+        self._record(name, module, {'changed': False, 'skipped': True,
+                                    'skip_reason': 'Conditional result was False'}, _now())
+
+    def task(self, name: str, module: str, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Exécute une tâche ; après un échec, les suivantes ne sont plus exécutées (comme Ansible)."""
+        if self.failed:
+            return {}
+        start = _now()
+        try:
+            result = {'changed': False, **fn()}
+            self.stats['ok'] += 1
+        except _TaskFailed as e:
+            result = {'changed': False, 'failed': True, **e.result}
+            self.stats['failures'] = 1
+            self.failed = True
+        self._record(name, module, result, start)
+        return result
+
+    def include(self, action: str):
+        self.task('Action ' + action, 'ansible.builtin.include_tasks',
+                  lambda: {'include': f'{action}.yml', 'include_args': {}})
+
+    def debug(self, name: str, value: Dict[str, Any]):
+        self.task(name, 'ansible.builtin.debug', lambda: {'msg': json.dumps(value)})
+
+    def output(self) -> Dict[str, Any]:
+        return {'plays': [{'play': {'name': self.play}, 'tasks': self.tasks}], 'stats': {self.host: self.stats}}
+
+
+def _passwd() -> Dict[str, List[str]]:
+    # Comme le module getent : nom -> [mot de passe, uid, gid, gecos, home, shell].
+    return {p.pw_name: [p.pw_passwd, str(p.pw_uid), str(p.pw_gid), p.pw_gecos, p.pw_dir, p.pw_shell]
+            for p in pwd.getpwall()}
+
+
+def _group() -> Dict[str, List[str]]:
+    # Comme le module getent : nom -> [mot de passe, gid, membres séparés par des virgules].
+    return {g.gr_name: [g.gr_passwd, str(g.gr_gid), ','.join(g.gr_mem)] for g in grp.getgrall()}
+
+
+def _id_groups(username: str) -> str:
+    """Sortie de `id -nG <utilisateur>` : groupe principal puis groupes secondaires."""
+    try:
+        user = pwd.getpwnam(username)
+    except KeyError:
+        raise _TaskFailed('non-zero return code', rc=1, stdout='', stderr=f"id: '{username}': no such user")
+    gids = [user.pw_gid]
+    for gid in os.getgrouplist(username, user.pw_gid):
+        if gid not in gids:
+            gids.append(gid)
+    names = []
+    for gid in gids:
+        try:
+            names.append(grp.getgrgid(gid).gr_name)
+        except KeyError:
+            names.append(str(gid))
+    return ' '.join(names)
+
+
+def _find(directory: str, file_type: str) -> List[str]:
+    """Noms des entrées d'un dossier, comme le module find (sans récursion ni fichiers cachés)."""
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return []
+    except OSError as e:
+        raise NativeFallback(str(e))
+    names = []
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if file_type == 'any' or stat.S_ISREG(entry.stat(follow_symlinks=False).st_mode):
+            names.append(entry.name)
+    return names
+
+
+def _slurp(path: str) -> str:
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+    except FileNotFoundError:
+        raise _TaskFailed(f'file not found: {path}')
+    except OSError as e:
+        raise NativeFallback(str(e))
+
+
+def _site_path(kind: str, payload: Dict[str, Any]) -> str:
+    return os.path.join(NGINX_CONF_DIR, kind, f"{payload.get('server_name')}.conf")
+
+
+def _list_users(run: _Run, payload: Dict[str, Any]):
+    users = run.task('Lister tous les utilisateurs', 'ansible.builtin.getent', lambda: {'users': _passwd()})
+    run.debug('Afficher la liste des utilisateurs', {'users': users.pop('users')})
+
+
+def _list_groups(run: _Run, payload: Dict[str, Any]):
+    if 'username' in payload:
+        run.skip('Lister tous les groupes du système', 'ansible.builtin.getent')
+        result = run.task("Lister les groupes d'un utilisateur spécifique", 'ansible.builtin.command',
+                          lambda: {'rc': 0, 'stdout': _id_groups(payload['username']), 'stderr': ''})
+        if run.failed:
+            return
+        run.debug('Afficher la liste des groupes', {'groups': result['stdout'].split(' ')})
+    else:
+        groups = run.task('Lister tous les groupes du système', 'ansible.builtin.getent', lambda: {'groups': _group()})
+        run.skip("Lister les groupes d'un utilisateur spécifique", 'ansible.builtin.command')
+        run.debug('Afficher la liste des groupes', {'groups': groups.pop('groups')})
+
+
+def _list_sites(run: _Run, payload: Dict[str, Any]):
+    found = run.task('Lister les sites configurés', 'ansible.builtin.find',
+                     lambda: {'names': _find(os.path.join(NGINX_CONF_DIR, 'sites-available'), 'file')})
+    run.debug('Afficher la liste des sites', {'websites': found.pop('names')})
+
+
+def _inventory(run: _Run, payload: Dict[str, Any]):
+    available = run.task('Lister les sites configurés', 'ansible.builtin.find',
+                         lambda: {'names': _find(os.path.join(NGINX_CONF_DIR, 'sites-available'), 'file')})
+    enabled = run.task('Lister les sites activés', 'ansible.builtin.find',
+                       lambda: {'names': _find(os.path.join(NGINX_CONF_DIR, 'sites-enabled'), 'any')})
+    run.debug("Afficher l'inventaire des sites",
+              {'sites': {'available': available.pop('names'), 'enabled': enabled.pop('names')}})
+
+
+def _site_status(run: _Run, payload: Dict[str, Any]):
+    # Le module stat ne suit pas les liens : un lien cassé existe.
+    result = run.task("Vérifier le statut d'activation du site", 'ansible.builtin.stat',
+                      lambda: {'stat': {'exists': os.path.lexists(_site_path('sites-enabled', payload))}})
+    run.debug('Afficher le statut du site', {'status': 'enabled' if result['stat']['exists'] else 'disabled'})
+
+
+def _site_config(run: _Run, payload: Dict[str, Any]):
+    result = run.task('Lire le fichier de configuration', 'ansible.builtin.slurp',
+                      lambda: {'text': _slurp(_site_path('sites-available', payload))})
+    if run.failed:
+        return
+    run.debug('Afficher la configuration', {'config': result.pop('text')})
+
+
+# Lectures servies, avec leurs tâches. Les résultats intermédiaires (listes
+# lues) ne sont portés que par le message affiché, comme dans la sortie
+# de l'API : ils sont retirés des tâches qui les produisent.
+NATIVE_ACTIONS: Dict[Tuple[str, str], Callable[[_Run, Dict[str, Any]], None]] = {
+    ('user', 'list_users'): _list_users,
+    ('user', 'list_groups'): _list_groups,
+    ('webserver', 'list'): _list_sites,
+    ('webserver', 'inventory'): _inventory,
+    ('webserver', 'status'): _site_status,
+    ('webserver', 'config'): _site_config,
+}
+
+
+class NativeBackend:
+    """Sert les lectures de NATIVE_ACTIONS quand la cible est la machine de l'API."""
+
+    def __init__(self, inventory: str, enabled: bool = True):
+        self.enabled = enabled
+        self.inventory = LocalInventory(inventory)
+
+    def local_host(self, service: str, action: str, target: Optional[str] = None) -> Optional[str]:
+        """Hôte local qui servira la lecture, ou None si elle doit passer par Ansible."""
+        if not self.enabled or (service, action) not in NATIVE_ACTIONS:
+            return None
+        return self.inventory.local_host(target)
+
+    def run(self, service: str, action: str, payload: Dict[str, Any], host: str,
+            target: Optional[str] = None) -> Tuple[int, Dict[str, Any]]:
+        """
+        Exécute la lecture (appel bloquant, en microsecondes ou millisecondes).
+        Retourne le code de retour d'ansible-playbook (0, ou 2 si une tâche a
+        échoué) et la sortie au format du callback 'json'.
+        """
+        run = _Run(host, target or DEFAULT_TARGET)
+        if service == 'webserver':
+            run.skip("Préparer l'hôte", 'ansible.builtin.include_tasks')
+        run.include(action)
+        NATIVE_ACTIONS[(service, action)](run, payload)
+        return (2 if run.failed else 0), run.output()
@@ -0,0 +1,306 @@
+import asyncio
+import base64
+import datetime
+import json
+import os
+import re
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+# Les curseurs illisibles sont signalés comme ceux des listes paginées.
+from app.listing import CursorError
+
+# Dossier des logs Nginx lus par l'API ; doit correspondre à 'nginx_log_dir' du rôle nginx_vhost.
+NGINX_LOG_DIR = os.environ.get('API_NGINX_LOG_DIR', '/var/log/nginx')
+# Intervalle (secondes) entre deux vérifications d'un log sans nouvelle ligne.
+NGINX_LOG_POLL_INTERVAL = float(os.environ.get('API_NGINX_LOG_POLL_INTERVAL', '0.5'))
+# Intervalle (secondes) des messages de maintien d'un flux sans nouvelle ligne.
+NGINX_LOG_HEARTBEAT = float(os.environ.get('API_NGINX_LOG_HEARTBEAT', '15'))
+# Taille maximale d'une lecture dans un fichier de log.
+NGINX_LOG_CHUNK = 64 * 1024
+
+# Fichiers suivis pour chaque site : <server_name>.access.log et <server_name>.error.log.
+LOG_KINDS = ('access', 'error')
+# Un nom de site sert de nom de fichier : pas de séparateur de chemin.
+SERVER_NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,252}$')
+
+# Format 'combined' : $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent ...
+_ACCESS_RE = re.compile(
+    r'^(?P<remote_addr>\S+) \S+ (?P<remote_user>\S+) \[(?P<time>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" (?P<status>\d{3}) (?P<bytes>\d+|-)'
+)
+# Ligne de error.log : 2024/01/31 12:00:00 [error] 123#123: *4 message, ..., request: "GET /x HTTP/1.1", ...
+_ERROR_RE = re.compile(r'^(?P<time>\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}) \[(?P<level>\w+)\]')
+_ERROR_REQUEST_RE = re.compile(r'request: "[A-Z]+ (?P<path>\S+)')
+
+
+def vhost_log_path(server_name: str, kind: str) -> str:
+    return os.path.join(NGINX_LOG_DIR, f'{server_name}.{kind}.log')
+
+
+def parse_line(kind: str, line: str) -> Dict[str, Any]:
+    """
+    Champs d'une ligne de log. 'time' est un datetime avec fuseau (None si la
+    ligne ne suit pas le format attendu) ; la ligne brute est toujours gardée.
+    """
+    entry: Dict[str, Any] = {'line': line, 'time': None}
+    if kind == 'access':
+        m = _ACCESS_RE.match(line)
+        if m:
+            try:
+                entry['time'] = datetime.datetime.strptime(m['time'], '%d/%b/%Y:%H:%M:%S %z')
+            except ValueError:
+                pass
+            entry.update(remote_addr=m['remote_addr'], method=m['method'], path=m['path'],
+                         status=int(m['status']), bytes=0 if m['bytes'] == '-' else int(m['bytes']))
+    else:
+        m = _ERROR_RE.match(line)
+        if m:
+            # error.log est en heure locale, sans fuseau.
+            entry['time'] = datetime.datetime.strptime(m['time'], '%Y/%m/%d %H:%M:%S').astimezone()
+            entry['level'] = m['level']
+            request = _ERROR_REQUEST_RE.search(line)
+            if request:
+                entry['path'] = request['path']
+    return entry
+
+
+def _status_check(spec: str) -> Callable[[int], bool]:
+    """'404', '5xx' ou une liste séparée par des virgules ('404,5xx')."""
+    exact, classes = set(), set()
+    for part in spec.split(','):
+        part = part.strip().lower()
+        if re.fullmatch(r'[1-5]\d\d', part):
+            exact.add(int(part))
+        elif re.fullmatch(r'[1-5]xx', part):
+            classes.add(int(part[0]))
+        else:
+            raise ValueError(f"Filtre de statut invalide : '{part}' (attendu ex: 404 ou 5xx).")
+    return lambda status: status in exact or status // 100 in classes
+
+
+class LogFilter:
+    """
+    Filtres appliqués côté serveur. Une ligne qui ne permet pas d'évaluer un
+    filtre est écartée : le statut ne sélectionne que des lignes d'accès, le
+    chemin les lignes d'accès et les erreurs liées à une requête.
+    """
+
+    def __init__(self, status: Optional[str] = None, path_prefix: Optional[str] = None,
+                 since: Optional[datetime.datetime] = None, until: Optional[datetime.datetime] = None):
+        self.status = _status_check(status) if status else None
+        self.path_prefix = path_prefix
+        # Une borne sans fuseau est en UTC, comme les dates de l'API.
+        self.since = _aware(since)
+        self.until = _aware(until)
+
+    def match(self, entry: Dict[str, Any]) -> bool:
+        if self.status is not None and ('status' not in entry or not self.status(entry['status'])):
+            return False
+        if self.path_prefix is not None and not (entry.get('path') or '').startswith(self.path_prefix):
+            return False
+        if self.since is not None or self.until is not None:
+            t = entry['time']
+            if t is None or (self.since is not None and t < self.since) or (self.until is not None and t > self.until):
+                return False
+        return True
+
+
+def _aware(value: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def encode_cursor(positions: Dict[str, Tuple[int, int]]) -> str:
+    """Curseur de reprise : (inode, offset) de chaque log suivi."""
+    data = json.dumps({kind: list(pos) for kind, pos in positions.items()}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Dict[str, Tuple[int, int]]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return {kind: (int(pos[0]), int(pos[1])) for kind, pos in data.items() if kind in LOG_KINDS}
+    except (ValueError, TypeError, AttributeError, IndexError, KeyError):
+        raise CursorError("Curseur de log invalide.")
+
+
+def _backlog_offset(f, size: int, lines: int) -> int:
+    # Position du début des `lines` dernières lignes complètes, en lisant le fichier à rebours.
+    if lines <= 0:
+        return size
+    pos, found = size, 0
+    while pos > 0:
+        step = min(NGINX_LOG_CHUNK, pos)
+        pos -= step
+        f.seek(pos)
+        block = f.read(step)
+        end = len(block)
+        while True:
+            i = block.rfind(b'\n', 0, end)
+            if i < 0:
+                break
+            # Le saut de ligne final du fichier ne compte pas comme une ligne.
+            if pos + i + 1 < size:
+                found += 1
+                if found >= lines:
+                    return pos + i + 1
+            end = i
+    return 0
+
+
+class LogFollower:
+    """
+    Suit un fichier de log à partir d'une position (inode, offset).
+
+    Rotation : quand le chemin désigne un nouveau fichier (inode différent),
+    la fin de l'ancien fichier, toujours ouvert, est lue avant de passer au
+    nouveau depuis son début. Un fichier tronqué sur place (copytruncate) est
+    relu depuis le début. Au démarrage, un curseur dont l'inode n'est plus
+    celui du fichier est repris dans le fichier renommé (<log>.1) s'il existe.
+    """
+
+    def __init__(self, path: str, position: Optional[Tuple[int, int]] = None, backlog: int = 50):
+        self.path = path
+        self._file = None
+        self.inode = 0
+        self.offset = 0
+        # Fichier renommé dont il reste la fin à lire avant le fichier courant.
+        self._rotated = None
+        self._open(position, backlog)
+
+    def _open(self, position: Optional[Tuple[int, int]], backlog: int):
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return  # pas encore créé : ouvert à la prochaine vérification
+        st = os.fstat(f.fileno())
+        if position is None:
+            self._file, self.inode, self.offset = f, st.st_ino, _backlog_offset(f, st.st_size, backlog)
+            return
+        inode, offset = position
+        if inode == st.st_ino:
+            self._file, self.inode, self.offset = f, inode, offset if offset <= st.st_size else 0
+            return
+        self._file, self.inode, self.offset = f, st.st_ino, 0
+        try:
+            old = open(f'{self.path}.1', 'rb')
+        except OSError:
+            return
+        old_st = os.fstat(old.fileno())
+        if old_st.st_ino == inode and offset <= old_st.st_size:
+            self._rotated = (old, inode, offset)
+        else:
+            old.close()
+
+    @property
+    def position(self) -> Tuple[int, int]:
+        if self._rotated is not None:
+            return self._rotated[1], self._rotated[2]
+        return self.inode, self.offset
+
+    def read_lines(self) -> List[Tuple[str, Tuple[int, int]]]:
+        """
+        Lignes complètes disponibles, chacune avec la position qui suit. Une
+        ligne en cours d'écriture (sans saut de ligne) attend la lecture suivante.
+        """
+        if self._rotated is not None:
+            old, inode, offset = self._rotated
+            lines, offset = _read_lines(old, inode, offset, final=True)
+            if lines:
+                self._rotated = (old, inode, offset)
+                return lines
+            old.close()
+            self._rotated = None
+        if self._file is None:
+            return []
+        lines, self.offset = _read_lines(self._file, self.inode, self.offset)
+        return lines
+
+    def check_rotation(self):
+        """À appeler quand il n'y a plus rien à lire : détecte rotation et troncature."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return  # fichier renommé, pas encore recréé
+        if self._file is None:
+            self._open((st.st_ino, 0), 0)
+        elif st.st_ino != self.inode:
+            # L'ancien fichier a été renommé : sa fin est lue avant le nouveau.
+            old = self._file
+            self._file = None
+            self._rotated = (old, self.inode, self.offset)
+            self._open((st.st_ino, 0), 0)
+        elif st.st_size < self.offset:
+            self.offset = 0
+
+    def close(self):
+        for f in (self._file, self._rotated[0] if self._rotated else None):
+            if f is not None:
+                f.close()
+        self._file = self._rotated = None
+
+
+def _read_lines(f, inode: int, offset: int, final: bool = False) -> Tuple[List[Tuple[str, Tuple[int, int]]], int]:
+    f.seek(offset)
+    data = f.read(NGINX_LOG_CHUNK)
+    end = data.rfind(b'\n')
+    if end < 0:
+        # Ligne plus longue qu'une lecture, ou fin d'un fichier renommé sans saut de ligne final.
+        if len(data) < NGINX_LOG_CHUNK and not (final and data):
+            return [], offset
+        end = len(data) - 1
+    lines = []
+    for raw in data[:end + 1].splitlines(keepends=True):
+        offset += len(raw)
+        lines.append((raw.rstrip(b'\r\n').decode(errors='replace'), (inode, offset)))
+    return lines, offset
+
+
+async def follow_vhost(server_name: str, kinds: Tuple[str, ...], log_filter: LogFilter,
+                       positions: Optional[Dict[str, Tuple[int, int]]] = None, backlog: int = 50,
+                       follow: bool = True) -> AsyncIterator[Tuple[Optional[str], Optional[Dict[str, Any]], str]]:
+    """
+    Produit (type, entrée, curseur) pour chaque ligne retenue par les filtres,
+    à partir du curseur `positions` ou des `backlog` dernières lignes de chaque
+    log. Sans nouvelle ligne pendant NGINX_LOG_HEARTBEAT secondes, produit
+    (None, None, curseur) pour maintenir la connexion. Sans `follow`, s'arrête
+    à la fin des fichiers après avoir produit ('end', None, curseur).
+    """
+    positions = positions or {}
+    followers = {kind: LogFollower(vhost_log_path(server_name, kind), positions.get(kind), backlog)
+                 for kind in kinds}
+    # Position qui suit la dernière ligne traitée (envoyée ou écartée) de chaque log.
+    current = {kind: f.position for kind, f in followers.items()}
+    loop = asyncio.get_running_loop()
+    idle_since = loop.time()
+
+    def cursor() -> str:
+        return encode_cursor(current)
+
+    try:
+        while True:
+            read = False
+            for kind, follower in followers.items():
+                for line, position in follower.read_lines():
+                    read = True
+                    current[kind] = position
+                    entry = parse_line(kind, line)
+                    if log_filter.match(entry):
+                        yield kind, entry, cursor()
+            if read:
+                idle_since = loop.time()
+                continue
+            if not follow:
+                yield 'end', None, cursor()
+                return
+            for kind, follower in followers.items():
+                follower.check_rotation()
+                current[kind] = follower.position
+            if loop.time() - idle_since >= NGINX_LOG_HEARTBEAT:
+                idle_since = loop.time()
+                yield None, None, cursor()
+            await asyncio.sleep(NGINX_LOG_POLL_INTERVAL)
+    finally:
+        for follower in followers.values():
+            follower.close()
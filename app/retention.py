@@ -0,0 +1,53 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+from app.database import prune_history
+
+# Intervalle (secondes) entre deux passes de rétention de l'historique (0 : désactivée).
+RETENTION_INTERVAL = float(os.environ.get('API_RETENTION_INTERVAL', '3600'))
+
+
+class HistoryRetention:
+    """
+    Élague l'historique des métriques en arrière-plan (voir prune_history) :
+    runs bruts et durées des tâches au-delà de leur rétention, agrégats par
+    minute devenus inutiles, sortie brute des runs terminés (entrée et
+    fichier), jobs terminés, puis vacuum incrémental. La passe tourne hors de
+    la boucle d'événements, par petites transactions.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def prune(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        start = time.time()
+        report = await loop.run_in_executor(None, prune_history)
+        self.last_run = {'at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                         'duration': round(time.time() - start, 3), **report}
+        return self.last_run
+
+    async def _run(self):
+        while True:
+            try:
+                await self.prune()
+            except Exception as e:
+                print(f"ERREUR: rétention de l'historique des métriques : {e}")
+            await asyncio.sleep(self.interval)
+
+
+history_retention = HistoryRetention(RETENTION_INTERVAL)
@@ -1,86 +1,98 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from starlette.responses import HTMLResponse
-from app.database import get_dashboard_stats
-from app.services import run_playbook
-import json
+from app.database import STATS_WINDOWS, get_window_stats, get_window_stats_raw
+from app.live_dashboard import dashboard_feed
+from app.retention import history_retention
+from app.run_broker import run_broker
+from app.services import runtime_stats
+from app.snapshot import inventory_snapshot
+import hashlib
+import os
+
+# Page statique du dashboard, lue une fois au démarrage.
+with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", "dashboard.html"), "rb") as f:
+    DASHBOARD_PAGE = f.read()
+DASHBOARD_ETAG = f'"{hashlib.sha1(DASHBOARD_PAGE).hexdigest()[:16]}"'
 
 # Ce routeur a son propre préfixe et tag
 router = APIRouter(prefix="/api/dashboard", tags=["Dashboard"])
 
 @router.get("", response_class=HTMLResponse, summary="Afficher un tableau de bord dynamique")
-async def get_dashboard():
+async def get_dashboard(request: Request):
+    """
+    Retourne la page du dashboard : une page statique qui reçoit ses données
+    en direct de /api/dashboard/live. Rien n'est calculé ici ; un navigateur
+    qui a déjà la page reçoit un 304.
+    """
+    if request.headers.get("if-none-match") == DASHBOARD_ETAG:
+        return Response(status_code=304, headers={"ETag": DASHBOARD_ETAG})
+    return HTMLResponse(content=DASHBOARD_PAGE, headers={"ETag": DASHBOARD_ETAG, "Cache-Control": "no-cache"})
+
+
+@router.get("/live", summary="Flux des métriques du dashboard (SSE)")
+async def stream_dashboard(request: Request):
     """
-    Cet endpoint retourne une page HTML avec les métriques de l'application,
-    collectées depuis la base de données et des appels directs au playbook.
+    Flux Server-Sent Events du dashboard : l'état complet ('snapshot'), puis
+    seulement ses changements ('delta' : compteurs, percentiles, nouveaux runs,
+    jobs et runs en cours). Les messages sont calculés une fois et partagés par
+    tous les écrans connectés. Un client reconnecté (Last-Event-ID) à jour ne
+    reçoit pas de nouveau l'état complet.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    viewer = await dashboard_feed.subscribe(int(last_event_id) if (last_event_id or "").isdigit() else None)
+
+    async def events():
+        try:
+            while True:
+                yield await viewer.get(dashboard_feed)
+        finally:
+            dashboard_feed.unsubscribe(viewer)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/runtime", summary="État interne de l'exécuteur de playbooks et du cache")
+async def get_runtime_stats():
     """
-    # 1. Obtenir les stats depuis la base de données SQLite
-    stats = get_dashboard_stats()
-    
-    # 2. Obtenir le nombre d'utilisateurs en temps réel
-    users_result = run_playbook("user", "list_users", {})
-    user_count = len(users_result.get("result", {}).get("results", []))
-    
-    # 3. Obtenir le nombre de sites en temps réel
-    sites_result = run_playbook("webserver", "list", {})
-    # Note: le playbook pour 'list' retourne la clé 'websites'
-    site_count = len(sites_result.get("result", {}).get("websites", []))
-
-    # 4. Prépare les données pour le graphique Chart.js
-    chart_labels = json.dumps(list(stats["avg_duration"].keys()))
-    chart_data = json.dumps(list(stats["avg_duration"].values()))
-
-    # 5. Construit le HTML avec les vraies données
-    html_content = f"""
-    <html>
-    <head>
-        <title>Dashboard Métriques</title>
-        <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-        <style>
-            body {{ font-family: sans-serif; background-color: #f4f4f9; margin: 40px; }}
-            .grid {{ display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }}
-            .metric {{ background-color: white; border-radius: 8px; padding: 20px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); text-align: center; }}
-            h1, h2 {{ color: #333; text-align: center; }}
-            .value {{ font-size: 2.5em; font-weight: bold; margin: 10px 0; }}
-            .success {{ color: #28a745; }} .failure {{ color: #dc3545; }}
-        </style>
-    </head>
-    <body>
-        <h1>Dashboard des Exécutions</h1>
-        <div class="grid">
-            <div class="metric">
-                <h2>Total des Exécutions</h2>
-                <p class="value">{stats['total']}</p>
-            </div>
-            <div class="metric">
-                <h2>Succès / Échecs</h2>
-                <p class="value">
-                    <span class="success">{stats['success']}</span> / 
-                    <span class="failure">{stats['failure']}</span>
-                </p>
-            </div>
-            <div class="metric" style="grid-column: 1 / -1;">
-                <h2>Durée Moyenne par Action (secondes)</h2>
-                <canvas id="durationChart"></canvas>
-            </div>
-        </div>
-        <script>
-            const ctx = document.getElementById('durationChart');
-            new Chart(ctx, {{
-                type: 'bar',
-                data: {{
-                    labels: {chart_labels},
-                    datasets: [{{
-                        label: 'Durée moyenne (s)',
-                        data: {chart_data},
-                        backgroundColor: 'rgba(54, 162, 235, 0.6)',
-                        borderColor: 'rgba(54, 162, 235, 1)',
-                        borderWidth: 1
-                    }}]
-                }},
-                options: {{ scales: {{ y: {{ beginAtZero: true }} }} }}
-            }});
-        </script>
-    </body>
-    </html>
+    Retourne les créneaux d'exécution occupés, la file d'attente, les rejets (503),
+    les compteurs du cache de résultats (hits, misses, évictions), les runs diffusés,
+    le flux du dashboard (écrans connectés, calculs, messages envoyés) et la
+    dernière passe de rétention de l'historique.
     """
-    return HTMLResponse(content=html_content)
\ No newline at end of file
+    return {"status": "success", "data": {**runtime_stats(), "streams": run_broker.stats(),
+                                          "dashboard": dashboard_feed.stats(),
+                                          "retention": history_retention.last_run}}
+
+
+@router.get("/stats", summary="Statistiques des exécutions sur une fenêtre de temps")
+async def get_stats(
+    window: str = Query("1h", description=f"Fenêtre de temps : {', '.join(STATS_WINDOWS)}"),
+    service: str = Query(None, description="Optionnel: filtre sur le service"),
+    action: str = Query(None, description="Optionnel: filtre sur l'action"),
+    source: str = Query("rollup", description="'rollup' (agrégats) ou 'raw' (parcours des runs, pour vérification)")
+):
+    """
+    Retourne le nombre de runs, le taux d'échec et les percentiles de durée
+    (p50/p95/p99), au total et par action, sur la fenêtre demandée.
+    """
+    if window not in STATS_WINDOWS:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Fenêtre inconnue (attendu : {', '.join(STATS_WINDOWS)})."})
+    if source not in ("rollup", "raw"):
+        raise HTTPException(400, detail={"status": "fail", "message": "La source doit être 'rollup' ou 'raw'."})
+
+    compute = get_window_stats if source == "rollup" else get_window_stats_raw
+    return {"status": "success", "data": compute(STATS_WINDOWS[window], service=service, action=action)}
+
+
+@router.get("/snapshot", summary="Instantané des utilisateurs, groupes et sites")
+async def get_snapshot():
+    """Retourne le dernier instantané de l'inventaire, sans lancer de playbook."""
+    return {"status": "success", "data": inventory_snapshot.data}
+
+
+@router.post("/refresh", summary="Reconstruire l'instantané de l'inventaire")
+async def refresh_snapshot():
+    """Relance immédiatement les playbooks de lecture et retourne l'instantané à jour."""
+    return {"status": "success", "data": await inventory_snapshot.refresh()}
@@ -0,0 +1,140 @@
+from typing import Any, Dict
+from fastapi import APIRouter, HTTPException, Query, Response
+from pydantic import ValidationError
+# On importe le modèle Pydantic pour la validation des données.
+from app.models.job import JobRequest
+# Un payload de job est validé avec les mêmes modèles et règles que la route synchrone.
+from app.models.user import UserBatchRequest, UserRequest
+from app.models.webserver import WebsiteRequest
+from app.routes.user import BATCH_REQUIRED_FIELDS, MAX_BATCH_SIZE
+from app.nginx_logs import SERVER_NAME_PATTERN
+from app.vhost_changes import CHANGESET_REQUIRED_FIELDS
+# Le gestionnaire de jobs exécute les playbooks en arrière-plan.
+from app.jobs import JOB_ACTIONS, JOB_STATES, JobQueueFullError, job_manager
+from app.fleet import TARGET_PATTERN
+from app.services import PLAYBOOK_MAX_FORKS
+
+# Le préfixe /api/jobs sera ajouté à toutes les URL de ce routeur.
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+# Champs requis des actions unitaires sur les utilisateurs (mêmes règles que les routes /api/user).
+USER_REQUIRED_FIELDS = {**BATCH_REQUIRED_FIELDS, 'password': ('username', 'password'), 'list_users': (), 'list_groups': ()}
+
+
+def _invalid(message: str, errors=None):
+    detail = {"status": "fail", "message": message}
+    if errors:
+        detail["errors"] = errors
+    return HTTPException(400, detail=detail)
+
+
+def _missing(action: str, obj, required) -> None:
+    missing = [f for f in required if not getattr(obj, f)]
+    if missing:
+        raise _invalid(f"Champs requis pour '{action}' : {', '.join(missing)}.")
+
+
+def job_payload(service: str, action: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Valide le payload d'un job et le réécrit comme la route synchrone équivalente :
+    champs requis, types, et seulement les champs connus du rôle.
+    """
+    try:
+        if service == 'user' and action == 'batch':
+            req = UserBatchRequest(**payload)
+            if not req.operations or len(req.operations) > MAX_BATCH_SIZE:
+                raise _invalid(f"Le lot doit contenir entre 1 et {MAX_BATCH_SIZE} opérations.")
+            errors = []
+            for i, op in enumerate(req.operations):
+                missing = [f for f in BATCH_REQUIRED_FIELDS[op.action] if not getattr(op, f)]
+                if missing:
+                    errors.append({"id": i, "message": f"Champs requis pour '{op.action}' : {', '.join(missing)}."})
+            if errors:
+                raise _invalid("Opérations invalides.", errors)
+            return {"operations": [{"id": i, **op.dict()} for i, op in enumerate(req.operations)]}
+        if service == 'user':
+            req = UserRequest(**{**payload, "action": action})
+            _missing(action, req, USER_REQUIRED_FIELDS[action])
+            if action == 'list_users':
+                return {}
+            if action == 'list_groups':
+                return {"username": req.username} if req.username else {}
+            return req.dict()
+        if action in CHANGESET_REQUIRED_FIELDS:
+            req = WebsiteRequest(**{**payload, "action": action})
+            _missing(action, req, CHANGESET_REQUIRED_FIELDS[action])
+            if action == 'create':
+                return req.dict()
+            if action == 'update':
+                return {"server_name": req.server_name, "root_dir": req.root_dir, "action": action}
+            return {"server_name": req.server_name, "action": action}
+        if action in ('list', 'inventory'):
+            return {"action": "list"} if action == 'list' else {}
+        server_name = payload.get('server_name')
+        if not isinstance(server_name, str) or not SERVER_NAME_PATTERN.match(server_name):
+            raise _invalid(f"Champ 'server_name' requis et valide pour '{action}'.")
+        return {"server_name": server_name, "action": action}
+    except ValidationError as e:
+        errors = [{"field": ".".join(str(p) for p in err["loc"]), "message": err["msg"]} for err in e.errors()]
+        raise _invalid("Payload invalide.", errors)
+
+
+@router.post("", status_code=202, summary="Soumettre une action de playbook en arrière-plan")
+async def submit_job(req: JobRequest, response: Response):
+    """
+    Place l'action dans la file des jobs et répond immédiatement (202) avec
+    l'identifiant du job, à suivre sur GET /api/jobs/{job_id}.
+    """
+    if req.action not in JOB_ACTIONS[req.service]:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Action '{req.action}' inconnue pour le service '{req.service}'."})
+    if req.target is not None and not TARGET_PATTERN.match(req.target):
+        raise HTTPException(400, detail={"status": "fail", "message": f"Cible '{req.target}' invalide."})
+    if req.forks is not None and not 1 <= req.forks <= PLAYBOOK_MAX_FORKS:
+        raise HTTPException(400, detail={"status": "fail", "message": f"'forks' doit être compris entre 1 et {PLAYBOOK_MAX_FORKS}."})
+    payload = job_payload(req.service, req.action, req.payload)
+    try:
+        job = await job_manager.submit(req.service, req.action, payload, req.target, req.forks)
+    except JobQueueFullError as e:
+        raise HTTPException(503, detail={"status": "error", "message": str(e)})
+
+    response.headers["Location"] = f"/api/jobs/{job['id']}"
+    return {"status": "accepted", "data": {"job_id": job["id"], "state": job["state"]}}
+
+
+@router.get("", summary="Lister les jobs")
+async def get_jobs(
+    state: str = Query(None, description="Optionnel: filtre sur l'état du job"),
+    service: str = Query(None, description="Optionnel: filtre sur le service"),
+    action: str = Query(None, description="Optionnel: filtre sur l'action"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200)
+):
+    if state is not None and state not in JOB_STATES:
+        raise HTTPException(400, detail={"status": "fail", "message": f"État inconnu (attendu : {', '.join(JOB_STATES)})."})
+    jobs = await job_manager.list_jobs(state=state, service=service, action=action, limit=limit, offset=skip)
+    return {"status": "success", "data": {"jobs": jobs}}
+
+
+@router.get("/{job_id}", summary="Obtenir l'état et le résultat d'un job")
+async def get_job(job_id: str):
+    """
+    Retourne l'état du job, sa durée et, une fois terminé, la sortie résumée du playbook.
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(404, detail={"status": "fail", "message": f"Job '{job_id}' introuvable."})
+    return {"status": "success", "data": job}
+
+
+@router.delete("/{job_id}", summary="Annuler un job en attente ou en cours")
+async def cancel_job(job_id: str):
+    """
+    Annule un job : retiré de la file s'il attend, processus Ansible tué s'il est en cours.
+    """
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        existing = await job_manager.get(job_id)
+        if existing is None:
+            raise HTTPException(404, detail={"status": "fail", "message": f"Job '{job_id}' introuvable."})
+        raise HTTPException(409, detail={"status": "fail", "message": f"Job '{job_id}' déjà terminé ({existing['state']})."})
+    return {"status": "success", "data": job}
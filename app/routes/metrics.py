@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+# Les métriques sont tenues en mémoire par app.metrics ; la route ne fait que les exporter.
+from app.metrics import render
+
+# Pas de préfixe : /metrics est l'URL attendue par défaut par Prometheus.
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, summary="Métriques au format Prometheus")
+def get_metrics():
+    """
+    Latences des routes, durée des playbooks, playbooks en cours et en attente,
+    temps de lancement des processus, d'analyse des sorties et d'écriture
+    SQLite, au format texte de Prometheus.
+    """
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,126 @@
+import datetime
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+# Les sorties des runs sont conservées dans des fichiers indexés par run_id.
+from app.database import (
+    EXPORT_FORMATS, SLOWEST_TASKS_SORTS, STATS_WINDOWS, export_runs, get_run_timeline, get_slowest_tasks,
+    list_run_logs,
+)
+from app.run_logs import RUN_LOG_READ_LIMIT, run_log_store
+
+# Le préfixe /api/runs sera ajouté à toutes les URL de ce routeur.
+router = APIRouter(prefix="/api/runs", tags=["runs"])
+
+# Les routes sont synchrones : FastAPI les exécute dans un thread, hors de la
+# boucle d'événements, le temps des accès à SQLite et aux fichiers.
+
+
+def _get_run(run_id: str):
+    info = run_log_store.info(run_id)
+    if info is None:
+        raise HTTPException(404, detail={"status": "fail", "message": f"Run '{run_id}' introuvable."})
+    return info
+
+
+@router.get("", summary="Lister les runs dont la sortie est conservée")
+def get_runs(
+    service: str = Query(None, description="Optionnel: filtre sur le service"),
+    action: str = Query(None, description="Optionnel: filtre sur l'action"),
+    state: str = Query(None, description="Optionnel: filtre sur l'état du run"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200)
+):
+    runs = list_run_logs(service=service, action=action, state=state, limit=limit, offset=skip)
+    return {"status": "success", "data": {"runs": runs}}
+
+
+@router.get("/tasks/slowest", summary="Tâches les plus lentes, tous runs confondus")
+def get_runs_slowest_tasks(
+    window: str = Query("24h", description=f"Fenêtre de temps : {', '.join(STATS_WINDOWS)}"),
+    service: str = Query(None, description="Optionnel: filtre sur le service"),
+    action: str = Query(None, description="Optionnel: filtre sur l'action"),
+    sort: str = Query("total", description=f"Tri : {', '.join(SLOWEST_TASKS_SORTS)}"),
+    limit: int = Query(10, ge=1, le=100)
+):
+    """
+    Classe les tâches des rôles par temps passé sur la fenêtre : 'total' (temps
+    cumulé, ce qui pèse le plus sur les runs), 'avg' ou 'max' (durée sur un hôte).
+    """
+    if window not in STATS_WINDOWS:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Fenêtre inconnue (attendu : {', '.join(STATS_WINDOWS)})."})
+    if sort not in SLOWEST_TASKS_SORTS:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Tri inconnu (attendu : {', '.join(SLOWEST_TASKS_SORTS)})."})
+    data = get_slowest_tasks(STATS_WINDOWS[window], service=service, action=action, sort=sort, limit=limit)
+    return {"status": "success", "data": data}
+
+
+def _utc(value: datetime.datetime) -> str:
+    # Même format que les horodatages de la base (UTC) ; une date sans fuseau est en UTC.
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+@router.get("/export", summary="Exporter l'historique des runs (CSV ou NDJSON)")
+def get_runs_export(
+    format: str = Query("csv", description="'csv' ou 'ndjson'"),
+    service: str = Query(None, description="Optionnel: filtre sur le service"),
+    action: str = Query(None, description="Optionnel: filtre sur l'action"),
+    status: str = Query(None, description="Optionnel: 'success' ou 'failure'"),
+    since: datetime.datetime = Query(None, description="Optionnel: runs à partir de cette date (ISO 8601, UTC par défaut)"),
+    until: datetime.datetime = Query(None, description="Optionnel: runs avant cette date (ISO 8601, UTC par défaut)")
+):
+    """
+    Diffuse les runs de 'playbook_runs' qui correspondent aux filtres, du plus
+    ancien au plus récent. La réponse est produite au fil de la lecture, par
+    morceaux : la mémoire utilisée ne dépend pas du nombre de runs exportés.
+    Seuls les runs encore dans la rétention (API_RUNS_RETENTION_DAYS) sont exportés.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Format inconnu (attendu : {', '.join(EXPORT_FORMATS)})."})
+    body = export_runs(format, service=service, action=action, status=status,
+                       since=_utc(since) if since else None, until=_utc(until) if until else None)
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="runs.{format}"'})
+
+
+@router.get("/{run_id}", summary="Obtenir l'état d'un run et la taille de sa sortie")
+def get_run(run_id: str):
+    return {"status": "success", "data": _get_run(run_id)}
+
+
+@router.get("/{run_id}/log", summary="Lire la sortie brute d'un run par plage d'octets")
+def get_run_log(
+    run_id: str,
+    offset: int = Query(0, ge=0, description="Position (octets) du début de la lecture"),
+    limit: int = Query(65536, ge=1, le=RUN_LOG_READ_LIMIT, description="Nombre maximal d'octets lus")
+):
+    """
+    Retourne la sortie du run à partir de `offset`. Pour lire la suite, on
+    rappelle la route avec `next_offset` ; `complete` indique que le run est
+    terminé et que toute sa sortie a été lue.
+    """
+    info = _get_run(run_id)
+    data, size = run_log_store.read(info, offset, limit)
+    next_offset = offset + len(data)
+    return {"status": "success", "data": {
+        "run_id": run_id,
+        "state": info["state"],
+        "offset": offset,
+        "next_offset": next_offset,
+        "size": size,
+        "complete": info["finished_at"] is not None and next_offset >= size,
+        "data": data.decode(errors="replace"),
+    }}
+
+
+@router.get("/{run_id}/timeline", summary="Chronologie des tâches d'un run, par hôte")
+def get_run_timeline_route(run_id: str):
+    """
+    Début ('offset', en secondes depuis le début du run) et durée de chaque
+    tâche, et de chaque hôte dans la tâche. Vide pour un run sans sortie
+    analysable ou antérieur à la mesure des tâches.
+    """
+    info = _get_run(run_id)
+    return {"status": "success", "data": {"state": info["state"], **get_run_timeline(run_id)}}
@@ -1,22 +1,65 @@
 import asyncio
 import json
+import shlex
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-
-# Variables de configuration Ansible
-ANSIBLE_PLAYBOOK_PATH = '/home/deb/API/FPJ/venv/bin/ansible-playbook'
-INVENTORY = 'inventory/hosts.ini'
-PLAYBOOK = 'playbook.yml'
-VAULT_OPTS = "--vault-password-file /home/deb/.vault_pass.txt"
+# Les runs diffusés sont lancés et partagés par le broker (sortie, abonnés, créneaux d'exécution).
+from app.fleet import TARGET_PATTERN
+from app.run_broker import SUBSCRIBER_QUEUE_SIZE, Subscriber, run_broker
+from app.run_logs import run_log_store
+from app.services import PLAYBOOK_ACTIONS, PLAYBOOK_MAX_FORKS, build_command
 
 router = APIRouter(prefix="/ws", tags=["streaming"])
 
+
+def _start_error(service, action, payload, target=None, forks=None):
+    """Message d'erreur si les paramètres d'un run ne sont pas acceptables, None sinon."""
+    if action not in PLAYBOOK_ACTIONS.get(service, ()):
+        return f"Action '{action}' inconnue pour le service '{service}'."
+    if not isinstance(payload, dict):
+        return "Le payload doit être un objet JSON."
+    if target is not None and not (isinstance(target, str) and TARGET_PATTERN.match(target)):
+        return f"Cible '{target}' invalide."
+    if forks is not None and not (isinstance(forks, int) and 1 <= forks <= PLAYBOOK_MAX_FORKS):
+        return f"'forks' doit être compris entre 1 et {PLAYBOOK_MAX_FORKS}."
+    return None
+
+
+def _readable(line: str) -> str:
+    """
+    Version lisible d'un événement du callback 'ndjson_events' pour /ws/run ;
+    les autres lignes (avertissements, sortie 'json') passent telles quelles.
+    """
+    try:
+        event = json.loads(line)
+    except json.JSONDecodeError:
+        return line
+    if not isinstance(event, dict) or "event" not in event:
+        return line
+    if event["event"] == "play_start":
+        return f"PLAY [{event.get('play')}]"
+    if event["event"] == "result":
+        text = f"{event.get('status')}: [{event.get('host')}] {event.get('task')}"
+        msg = (event.get("result") or {}).get("msg")
+        return f"{text} => {msg}" if msg else text
+    if event["event"] == "stats":
+        return "PLAY RECAP " + " ; ".join(
+            f"{host}: " + " ".join(f"{k}={v}" for k, v in counts.items())
+            for host, counts in (event.get("stats") or {}).items()
+        )
+    return line
+
+
 # On retire la dépendance de sécurité de la signature de la fonction
 @router.websocket("/run")
 async def websocket_run_playbook(websocket: WebSocket):
     """
     Endpoint WebSocket ouvert pour lancer des playbooks et streamer la sortie.
+    Un seul run par connexion, en texte brut (un événement d'Ansible par ligne) ;
+    le run est interrompu si le client se déconnecte. Voir /ws/runs pour suivre
+    plusieurs runs sur une connexion.
     """
     await websocket.accept()
+    run = None
     try:
         # Attend les paramètres du client.
         params_json = await websocket.receive_text()
@@ -25,32 +68,157 @@ async def websocket_run_playbook(websocket: WebSocket):
         service = params.get("service")
         action = params.get("user_action")
         payload = params.get("payload", {})
+        error = _start_error(service, action, payload)
+        if error:
+            await websocket.send_text(f"ERREUR: {error}\n")
+            return
 
-        # Construit et lance la commande Ansible.
-        extra_vars = json.dumps({'service': service, 'user_action': action, 'payload': payload})
-        cmd = f"{ANSIBLE_PLAYBOOK_PATH} -i {INVENTORY} {VAULT_OPTS} {PLAYBOOK} --extra-vars '{extra_vars}'"
-
-        await websocket.send_text(f"INFO: Lancement de la commande : {cmd}\n\n")
+        # La commande est construite sans shell : les arguments ne sont pas réinterprétés.
+        await websocket.send_text(f"INFO: Lancement de la commande : {shlex.join(build_command(service, action, payload))}\n\n")
 
-        process = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        # Lit et envoie la sortie en temps réel.
-        while process.returncode is None:
-            output = await asyncio.wait_for(process.stdout.readline(), timeout=300.0)
-            if not output:
+        subscriber = Subscriber(SUBSCRIBER_QUEUE_SIZE)
+        run = run_broker.start(service, action, payload)
+        run_broker.subscribe(run.id, subscriber)
+        # Lit et envoie la sortie en temps réel, jusqu'à la fin du run.
+        while True:
+            message = await subscriber.get()
+            if message["type"] == "line":
+                await websocket.send_text(_readable(message["data"]) + "\n")
+            elif message["type"] == "dropped":
+                await websocket.send_text(f"INFO: {message['count']} lignes ignorées (client trop lent).\n")
+            elif message["type"] == "end":
                 break
-            await websocket.send_text(output.decode().strip() + "\n")
-        
-        await process.wait()
-        await websocket.send_text("\nINFO: Exécution du playbook terminée.\n")
+
+        if run.state == "rejected":
+            await websocket.send_text(f"ERREUR: {run.error}\n")
+        else:
+            await websocket.send_text("\nINFO: Exécution du playbook terminée.\n")
 
     except WebSocketDisconnect:
         print("Client déconnecté")
     except Exception as e:
         await websocket.send_text(f"ERREUR: {str(e)}\n")
     finally:
-        await websocket.close()
\ No newline at end of file
+        if run is not None:
+            await run_broker.cancel(run.id)
+        await websocket.close()
+
+
+async def _send_loop(websocket: WebSocket, subscriber: Subscriber):
+    # Seule tâche qui écrit sur la connexion : un client lent ne ralentit que sa propre file.
+    while True:
+        await websocket.send_json(await subscriber.get())
+
+
+async def _tail(run_id: str, offset: int, subscriber: Subscriber):
+    # Sortie conservée du run depuis `offset`, puis en direct jusqu'à sa fin. Les
+    # messages attendent de la place dans la file : rien n'est perdu, le rythme
+    # est celui du client.
+    loop = asyncio.get_running_loop()
+    info = await loop.run_in_executor(None, run_log_store.info, run_id)
+    if info is None:
+        subscriber.offer({"type": "error", "run_id": run_id, "message": f"Run '{run_id}' introuvable."})
+        return
+    async for chunk_offset, data in run_log_store.tail(info, offset):
+        await subscriber.put({"type": "log", "run_id": run_id, "offset": chunk_offset,
+                              "data": data.decode(errors="replace")})
+        offset = chunk_offset + len(data)
+    info = await loop.run_in_executor(None, run_log_store.info, run_id)
+    await subscriber.put({"type": "log_end", "run_id": run_id, "offset": offset, "state": info["state"]})
+
+
+def _handle_message(message: dict, subscriber: Subscriber, tails: dict):
+    """Traite un message client de /ws/runs ; les réponses passent par la file de la connexion."""
+    kind = message.get("type")
+    run_id = message.get("run_id")
+
+    if kind == "start":
+        service, action = message.get("service"), message.get("user_action")
+        payload, target, forks = message.get("payload") or {}, message.get("target"), message.get("forks")
+        error = _start_error(service, action, payload, target, forks)
+        if error:
+            subscriber.offer({"type": "error", "ref": message.get("ref"), "message": error})
+            return
+        run = run_broker.start(service, action, payload, target, forks)
+        subscriber.offer({"type": "started", "run_id": run.id, "ref": message.get("ref")})
+        run_broker.subscribe(run.id, subscriber)
+    elif kind == "subscribe":
+        if run_broker.subscribe(run_id, subscriber) is None:
+            subscriber.offer({"type": "error", "run_id": run_id, "message": f"Run '{run_id}' introuvable."})
+    elif kind == "tail":
+        offset = message.get("offset", 0)
+        if not isinstance(offset, int) or offset < 0:
+            subscriber.offer({"type": "error", "run_id": run_id, "message": "L'offset doit être un entier positif."})
+            return
+        if run_id in tails:
+            tails.pop(run_id).cancel()
+        tails[run_id] = asyncio.ensure_future(_tail(run_id, offset, subscriber))
+        tails[run_id].add_done_callback(lambda task: tails.get(run_id) is task and tails.pop(run_id))
+    elif kind == "unsubscribe":
+        run_broker.unsubscribe(run_id, subscriber)
+        if run_id in tails:
+            tails.pop(run_id).cancel()
+        subscriber.offer({"type": "unsubscribed", "run_id": run_id})
+    elif kind == "cancel":
+        # L'abonné reçoit le message 'end' (état 'cancelled') comme pour toute fin de run.
+        asyncio.ensure_future(run_broker.cancel(run_id))
+    elif kind == "list":
+        subscriber.offer({"type": "runs", "runs": [run.info() for run in run_broker.runs.values()]})
+    else:
+        subscriber.offer({"type": "error", "message": f"Type de message inconnu : '{kind}'."})
+
+
+@router.websocket("/runs")
+async def websocket_runs(websocket: WebSocket):
+    """
+    Endpoint WebSocket multiplexé : une connexion peut lancer et suivre plusieurs
+    runs, et plusieurs connexions peuvent suivre le même run.
+
+    Messages du client (JSON) :
+        {"type": "start", "service": ..., "user_action": ..., "payload": {...}, "ref": ...,
+         "target": ..., "forks": ...}  (target et forks optionnels)
+        {"type": "subscribe" | "unsubscribe" | "cancel", "run_id": ...}
+        {"type": "tail", "run_id": ..., "offset": 0}
+        {"type": "list"}
+
+    Messages du serveur, tous marqués par leur run_id :
+        started, subscribed, line (seq, stream 'stdout' ou 'stderr', data : ligne
+        brute, au format ANSIBLE_OUTPUT_FORMAT), dropped (lignes perdues par cette
+        connexion), end (state, return_code, result : résumé comme celui des
+        routes HTTP), error.
+
+    Les services et actions acceptés sont ceux des rôles (PLAYBOOK_ACTIONS). Un
+    run terminé est enregistré comme ceux des routes HTTP (dashboard, /api/runs,
+    durée des tâches), et une écriture appliquée évince les lectures en cache.
+
+    'tail' relit la sortie conservée d'un run (en cours ou terminé, même
+    avant un redémarrage de l'API) à partir d'une position en octets, sans
+    perte : messages log (offset, data) puis log_end (offset final, state).
+    Un client qui se reconnecte reprend au dernier offset reçu.
+
+    Les runs continuent si la connexion se ferme ; ils ne sont interrompus que par 'cancel'.
+    """
+    await websocket.accept()
+    subscriber = Subscriber(SUBSCRIBER_QUEUE_SIZE)
+    sender = asyncio.ensure_future(_send_loop(websocket, subscriber))
+    tails = {}
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+            except json.JSONDecodeError:
+                subscriber.offer({"type": "error", "message": "Message JSON invalide."})
+                continue
+            if not isinstance(message, dict):
+                subscriber.offer({"type": "error", "message": "Un message doit être un objet JSON."})
+                continue
+            _handle_message(message, subscriber, tails)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        run_broker.unsubscribe_all(subscriber)
+        tasks = [sender, *tails.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
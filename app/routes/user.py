@@ -1,120 +1,244 @@
 # On importe les classes de base de FastAPI.
-from fastapi import APIRouter, HTTPException, Query
-# On importe le modèle Pydantic pour la validation des données.
-from app.models.user import UserRequest
+from typing import Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+# On importe les modèles Pydantic pour la validation des données.
+from app.models.user import UserBatchRequest, UserRequest
 # On importe la fonction principale qui exécute les playbooks.
-from app.services import run_playbook
+from app.services import BATCH_ITEM_FIELDS, run_playbook
+# Index des listes d'utilisateurs et de groupes (filtres, tri, curseurs).
+from app.listing import build_group_index, build_user_index, listing_cache
+# Cible (hôtes) et parallélisme des runs, réponse agrégée par hôte.
+from app.fleet import Fleet, fleet_outcome, fleet_response, fleet_results
 
 # Le préfixe /api/user sera ajouté à toutes les URL de ce routeur.
 router = APIRouter(prefix="/api/user", tags=["user"])
 
+# Champs requis pour chaque type d'opération d'un lot.
+BATCH_REQUIRED_FIELDS = {
+    'create':       ('username', 'password'),
+    'delete':       ('username',),
+    'add_group':    ('username', 'group'),
+    'del_group':    ('username', 'group'),
+    'create_group': ('group',),
+}
+# Nombre maximal d'opérations par lot.
+MAX_BATCH_SIZE = 1000
+
+
+def _page(index, sort: str, **params):
+    try:
+        return index.page(sort=sort, **params)
+    except ValueError as e:  # tri inconnu ou CursorError
+        raise HTTPException(400, detail={"status": "fail", "message": str(e)})
+
 
 @router.get("", summary="Lister tous les utilisateurs")
-async def list_users(skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=200)):
-    result = run_playbook("user", "list_users", {})
-    if result.get('return_code') != 0:
+async def list_users(
+    response: Response,
+    prefix: str = Query(None, description="Optionnel: début du nom d'utilisateur"),
+    search: str = Query(None, description="Optionnel: texte contenu dans le nom ou le gecos"),
+    uid_min: int = Query(None, ge=0), uid_max: int = Query(None, ge=0),
+    shell: str = Query(None, description="Optionnel: shell exact (ex: /bin/bash)"),
+    sort: str = Query("name", description="Tri : 'name' ou 'uid'"),
+    cursor: str = Query(None, description="Curseur 'next_cursor' de la page précédente"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    fleet: Fleet = Depends()
+):
+    """
+    Liste les utilisateurs (nom, uid, gid, gecos, home, shell), filtrés et triés
+    à partir d'un index construit une fois par résultat du playbook. Sur
+    plusieurs hôtes, la liste est celle du premier hôte en succès.
+    """
+    result = await run_playbook("user", "list_users", {}, **fleet.options)
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(status_code=500, detail={"status": "error", "data": result})
-    
-    all_users = result['result'].get('results', [])
-    paginated_users = all_users[skip : skip + limit]
-    
-    return {"status": "success", "data": {"users": paginated_users, "total": len(all_users)}}
+
+    index = listing_cache.get(("user", "list_users", fleet.target), fleet_results(result, []), build_user_index)
+    page = _page(
+        index, sort, prefix=prefix, search=search, id_min=uid_min, id_max=uid_max,
+        match=(lambda e: e['shell'] == shell) if shell else None, match_key=('shell', shell),
+        cursor=cursor, skip=skip, limit=limit,
+    )
+    return fleet_response(result, {"users": page['items'], "total": page['total'], "next_cursor": page['next_cursor']}, response)
 
 
 @router.get("/groups", summary="Lister les groupes")
 async def list_groups(
+    response: Response,
     username: str = Query(None, description="Optionnel: nom d'utilisateur pour filtrer les groupes"),
+    prefix: str = Query(None, description="Optionnel: début du nom de groupe"),
+    search: str = Query(None, description="Optionnel: texte contenu dans le nom du groupe"),
+    gid_min: int = Query(None, ge=0), gid_max: int = Query(None, ge=0),
+    member: str = Query(None, description="Optionnel: groupes dont cet utilisateur est membre secondaire"),
+    sort: str = Query("name", description="Tri : 'name' ou 'gid'"),
+    cursor: str = Query(None, description="Curseur 'next_cursor' de la page précédente"),
     skip: int = Query(0, ge=0),
-    limit: int = Query(60, ge=1, le=200)
+    limit: int = Query(60, ge=1, le=200),
+    fleet: Fleet = Depends()
 ):
+    """
+    Liste les groupes (nom, gid, membres). Avec `username`, seuls les noms des
+    groupes de cet utilisateur sont connus (gid et membres à null).
+    """
     payload = {"username": username} if username else {}
-    result = run_playbook("user", "list_groups", payload)
-    
-    if result.get('return_code') != 0:
+    result = await run_playbook("user", "list_groups", payload, **fleet.options)
+
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(status_code=500, detail={"status": "error", "data": result})
-        
-    all_groups = result['result'].get('results', [])
-    paginated_groups = all_groups[skip : skip + limit]
 
-    return {"status": "success", "data": {"groups": paginated_groups, "total": len(all_groups)}}
+    raw = fleet_results(result, [])
+    # Les groupes d'un utilisateur sont une courte liste : inutile de garder leur index.
+    index = build_group_index(raw) if username else listing_cache.get(("user", "list_groups", fleet.target), raw, build_group_index)
+    page = _page(
+        index, sort, prefix=prefix, search=search, id_min=gid_min, id_max=gid_max,
+        match=(lambda e: member in (e['members'] or ())) if member else None, match_key=('member', member),
+        cursor=cursor, skip=skip, limit=limit,
+    )
+    return fleet_response(result, {"groups": page['items'], "total": page['total'], "next_cursor": page['next_cursor']}, response)
 
 
 @router.post("", summary="Créer un nouvel utilisateur")
-async def create_user(req: UserRequest):
+async def create_user(req: UserRequest, response: Response, fleet: Fleet = Depends()):
     if req.action != 'create' or not req.username or not req.password:
         raise HTTPException(400, detail={"status": "fail", "message": "Action 'create' et champs 'username'/'password' requis."})
     
     # On exécute directement le playbook, sans interaction avec la DB.
-    result = run_playbook("user", req.action, req.dict())
+    result = await run_playbook("user", req.action, req.dict(), **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail={"status": "error", "data": result})
     
-    return {"status": "success", "data": {"message": f"Utilisateur '{req.username}' créé avec succès."}}
+    return fleet_response(result, {"message": f"Utilisateur '{req.username}' créé avec succès."}, response)
 
 
 @router.put("", summary="Changer le mot de passe d'un utilisateur")
-async def change_password(req: UserRequest):
+async def change_password(req: UserRequest, response: Response, fleet: Fleet = Depends()):
     if req.action != 'password' or not req.username or not req.password:
         raise HTTPException(400, detail={"status": "fail", "message": "Action 'password' et champs 'username'/'password' requis."})
     
-    result = run_playbook("user", req.action, req.dict())
+    result = await run_playbook("user", req.action, req.dict(), **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail={"status": "error", "data": result})
     
-    return {"status": "success", "data": {"message": f"Mot de passe de l'utilisateur '{req.username}' changé avec succès."}}
+    return fleet_response(result, {"message": f"Mot de passe de l'utilisateur '{req.username}' changé avec succès."}, response)
 
 
 @router.delete("", summary="Supprimer un utilisateur")
-async def delete_user(req: UserRequest):
+async def delete_user(req: UserRequest, response: Response, fleet: Fleet = Depends()):
     if req.action != 'delete' or not req.username:
         raise HTTPException(400, detail={"status": "fail", "message": "Action 'delete' et champ 'username' requis."})
     
-    result = run_playbook("user", req.action, req.dict())
+    result = await run_playbook("user", req.action, req.dict(), **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail={"status": "error", "data": result})
     
-    return {"status": "success", "data": {"message": f"Utilisateur '{req.username}' supprimé avec succès."}}
+    return fleet_response(result, {"message": f"Utilisateur '{req.username}' supprimé avec succès."}, response)
 
 
 # --- Routes pour les Groupes ---
 
 @router.post("/group/create", summary="Créer un nouveau groupe")
-async def create_group(req: UserRequest):
+async def create_group(req: UserRequest, response: Response, fleet: Fleet = Depends()):
     if req.action != 'create_group' or not req.group:
         raise HTTPException(400, detail={"status": "fail", "message": "Action 'create_group' et champ 'group' requis."})
     
-    result = run_playbook("user", req.action, req.dict())
+    result = await run_playbook("user", req.action, req.dict(), **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail={"status": "error", "data": result})
     
-    return {"status": "success", "data": {"message": f"Groupe '{req.group}' créé avec succès."}}
+    return fleet_response(result, {"message": f"Groupe '{req.group}' créé avec succès."}, response)
 
 
 @router.post("/group", summary="Ajouter un utilisateur à un groupe")
-async def add_user_to_group(req: UserRequest):
+async def add_user_to_group(req: UserRequest, response: Response, fleet: Fleet = Depends()):
     if req.action != 'add_group' or not req.username or not req.group:
         raise HTTPException(400, detail={"status": "fail", "message": "Action 'add_group' et champs 'username'/'group' requis."})
         
-    result = run_playbook("user", req.action, req.dict())
+    result = await run_playbook("user", req.action, req.dict(), **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail={"status": "error", "data": result})
         
-    return {"status": "success", "data": {"message": f"L'utilisateur '{req.username}' a été ajouté au groupe '{req.group}'."}}
+    return fleet_response(result, {"message": f"L'utilisateur '{req.username}' a été ajouté au groupe '{req.group}'."}, response)
 
 
 @router.delete("/group", summary="Retirer un utilisateur d'un groupe")
-async def remove_user_from_group(req: UserRequest):
+async def remove_user_from_group(req: UserRequest, response: Response, fleet: Fleet = Depends()):
     if req.action != 'del_group' or not req.username or not req.group:
         raise HTTPException(400, detail={"status": "fail", "message": "Action 'del_group' et champs 'username'/'group' requis."})
         
-    result = run_playbook("user", req.action, req.dict())
+    result = await run_playbook("user", req.action, req.dict(), **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail={"status": "error", "data": result})
         
-    return {"status": "success", "data": {"message": f"L'utilisateur '{req.username}' a été retiré du groupe '{req.group}'."}}
\ No newline at end of file
+    return fleet_response(result, {"message": f"L'utilisateur '{req.username}' a été retiré du groupe '{req.group}'."}, response)
+
+
+# --- Routes pour les opérations groupées ---
+
+async def _run_batch(req: UserBatchRequest, allowed: Tuple[str, ...], response: Response, fleet: Fleet):
+    """
+    Valide un lot d'opérations, l'exécute en un seul run de playbook (action 'batch')
+    et retourne le statut de chaque opération, dans l'ordre de la requête, ainsi
+    que l'état de chaque hôte ciblé.
+    """
+    if not req.operations or len(req.operations) > MAX_BATCH_SIZE:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Le lot doit contenir entre 1 et {MAX_BATCH_SIZE} opérations."})
+
+    errors = []
+    for i, op in enumerate(req.operations):
+        if op.action not in allowed:
+            errors.append({"id": i, "message": f"Action '{op.action}' non autorisée (attendu : {', '.join(allowed)})."})
+            continue
+        missing = [f for f in BATCH_REQUIRED_FIELDS[op.action] if not getattr(op, f)]
+        if missing:
+            errors.append({"id": i, "message": f"Champs requis pour '{op.action}' : {', '.join(missing)}."})
+    if errors:
+        raise HTTPException(400, detail={"status": "fail", "message": "Opérations invalides.", "errors": errors})
+
+    operations = [{"id": i, **op.dict()} for i, op in enumerate(req.operations)]
+    result = await run_playbook("user", "batch", {"operations": operations}, **fleet.options)
+    reported = {}
+    for item in result.get("result", {}).get("items", []):
+        # Sur plusieurs hôtes, une opération échouée sur l'un d'eux est rapportée en échec.
+        if item["id"] not in reported or item["status"] == "failed":
+            reported[item["id"]] = item
+    if result.get("return_code") != 0 and not reported:
+        raise HTTPException(500, detail={"status": "error", "data": result})
+
+    # Une opération absente de la sortie n'a pas été exécutée (run interrompu).
+    items = [
+        reported.get(op["id"]) or {
+            "id": op["id"], **{f: op[f] for f in BATCH_ITEM_FIELDS if op.get(f) is not None}, "status": "unknown"
+        }
+        for op in operations
+    ]
+    failed = sum(1 for item in items if item["status"] in ("failed", "unknown"))
+    body = fleet_response(result, {"items": items, "succeeded": len(items) - failed, "failed": failed}, response)
+    if failed:
+        response.status_code = 207
+        body["status"] = "error" if failed == len(items) else "partial"
+    return body
+
+
+@router.post("/batch", summary="Créer, supprimer et gérer les groupes de plusieurs utilisateurs")
+async def batch_users(req: UserBatchRequest, response: Response, fleet: Fleet = Depends()):
+    """
+    Exécute un lot d'opérations 'create', 'delete', 'add_group' et 'del_group'
+    en un seul run de playbook. Répond 207 si au moins une opération a échoué.
+    """
+    return await _run_batch(req, ('create', 'delete', 'add_group', 'del_group'), response, fleet)
+
+
+@router.post("/group/batch", summary="Créer des groupes et gérer leurs membres par lot")
+async def batch_groups(req: UserBatchRequest, response: Response, fleet: Fleet = Depends()):
+    """
+    Exécute un lot d'opérations 'create_group', 'add_group' et 'del_group'
+    en un seul run de playbook. Répond 207 si au moins une opération a échoué.
+    """
+    return await _run_batch(req, ('create_group', 'add_group', 'del_group'), response, fleet)
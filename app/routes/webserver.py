@@ -1,16 +1,34 @@
 # On importe les classes de base de FastAPI. 'Depends' n'est plus nécessaire.
-from fastapi import APIRouter, HTTPException
+import asyncio
+import datetime
+import json
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 # On importe le modèle Pydantic pour la validation des données.
-from app.models.webserver import WebsiteRequest
+from app.models.webserver import WebsiteChangeSetRequest, WebsiteRequest
 # On importe la fonction principale qui exécute les playbooks.
 from app.services import run_playbook
+# Modifications de sites par lots : un seul rechargement de Nginx par lot.
+from app.vhost_changes import (
+    CHANGESET_REJECTED_TASK, CHANGESET_REQUIRED_FIELDS, MAX_CHANGESET_SIZE, changeset_items, reload_batcher
+)
+# Cible (hôtes) et parallélisme des runs, réponse agrégée par hôte.
+from app.fleet import Fleet, fleet_outcome, fleet_response, fleet_results
+# Suivi des logs Nginx de chaque site, lus directement sur la machine de l'API.
+from app.nginx_logs import (
+    LOG_KINDS, SERVER_NAME_PATTERN, LogFilter, decode_cursor, follow_vhost, vhost_log_path
+)
+# Statistiques de trafic tirées des logs d'accès des sites.
+from app.database import STATS_WINDOWS, get_access_log_stats
+from app.log_analytics import access_log_ingester
 
 # Le préfixe /api/webserver sera ajouté à toutes les URL de ce routeur.
 router = APIRouter(prefix="/api/webserver", tags=["webserver"])
 
 
 @router.post("", summary="Créer et activer un nouveau site web")
-async def create_website(req: WebsiteRequest):
+async def create_website(req: WebsiteRequest, response: Response, fleet: Fleet = Depends()):
     """
     Crée une nouvelle configuration de site Nginx, le dossier racine,
     une page de test, et active le site. Route ouverte.
@@ -18,31 +36,71 @@ async def create_website(req: WebsiteRequest):
     if req.action != 'create' or not req.root_dir:
         raise HTTPException(400, detail={"status": "fail", "message": "L'action doit être 'create' et 'root_dir' est requis."})
     
-    result = run_playbook("webserver", req.action, req.dict())
+    result = await reload_batcher.submit(req.action, req.dict(), **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"message": f"Site '{req.server_name}' créé et activé."}}
+    return fleet_response(result, {"message": f"Site '{req.server_name}' créé et activé."}, response)
+
+
+@router.post("/changeset", summary="Appliquer un lot de modifications de sites")
+async def apply_changeset(req: WebsiteChangeSetRequest, response: Response, fleet: Fleet = Depends()):
+    """
+    Applique des opérations 'create', 'update', 'enable', 'disable' et 'delete'
+    en un seul run : une validation 'nginx -t' et un rechargement pour tout le
+    lot. Si une étape échoue, la configuration est restaurée et aucune opération
+    n'est appliquée (422 si Nginx refuse la configuration, 500 sinon). Une seule
+    opération par site. Route ouverte.
+    """
+    if not req.operations or len(req.operations) > MAX_CHANGESET_SIZE:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Le lot doit contenir entre 1 et {MAX_CHANGESET_SIZE} opérations."})
+
+    errors, seen = [], set()
+    for i, op in enumerate(req.operations):
+        missing = [f for f in CHANGESET_REQUIRED_FIELDS[op.action] if not getattr(op, f)]
+        if missing:
+            errors.append({"id": i, "message": f"Champs requis pour '{op.action}' : {', '.join(missing)}."})
+        elif op.server_name in seen:
+            errors.append({"id": i, "message": f"Le site '{op.server_name}' apparaît plusieurs fois dans le lot."})
+        seen.add(op.server_name)
+    if errors:
+        raise HTTPException(400, detail={"status": "fail", "message": "Opérations invalides.", "errors": errors})
+
+    operations = [{"id": i, **op.dict()} for i, op in enumerate(req.operations)]
+    result = await run_playbook("webserver", "changeset", {"operations": operations}, **fleet.options)
+    # Sur plusieurs hôtes, le lot est annulé sur les hôtes en échec seulement (voir 'hosts').
+    rolled_back = fleet_outcome(result) == 'failed'
+    items = changeset_items(result, operations, rolled_back)
+
+    if rolled_back:
+        summary = result.get('result') or {}
+        if summary.get('failed_task') == CHANGESET_REJECTED_TASK:
+            raise HTTPException(422, detail={"status": "fail", "message": "Configuration refusée par Nginx : lot annulé.",
+                                             "reason": summary.get('reason'), "items": items})
+        raise HTTPException(500, detail={"status": "error", "message": "Lot annulé, configuration restaurée.",
+                                         "items": items, "data": result})
+
+    return fleet_response(result, {"items": items, "applied": len(items)}, response)
 
 
 @router.delete("/{server_name}", summary="Supprimer un site web")
-async def delete_website(server_name: str):
+async def delete_website(server_name: str, response: Response, fleet: Fleet = Depends()):
     """
     Supprime complètement un site web (désactivation puis suppression du fichier de conf).
     Route ouverte.
     """
     payload = {"server_name": server_name, "action": "delete"}
-    result = run_playbook("webserver", "delete", payload)
+    result = await reload_batcher.submit("delete", payload, **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"message": f"Site '{server_name}' supprimé."}}
+    return fleet_response(result, {"message": f"Site '{server_name}' supprimé."}, response)
 
 
 @router.put("/{server_name}/status", summary="Activer ou désactiver un site")
-async def set_website_status(server_name: str, req: WebsiteRequest):
+async def set_website_status(server_name: str, req: WebsiteRequest, response: Response, fleet: Fleet = Depends()):
     """
     Change le statut d'un site (activé/désactivé) sans supprimer sa configuration.
     Route ouverte.
@@ -51,58 +109,58 @@ async def set_website_status(server_name: str, req: WebsiteRequest):
         raise HTTPException(400, detail={"status": "fail", "message": "L'action doit être 'enable' ou 'disable'."})
 
     payload = {"server_name": server_name, "action": req.action}
-    result = run_playbook("webserver", req.action, payload)
+    result = await reload_batcher.submit(req.action, payload, **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"message": f"Site '{server_name}' - statut changé à '{req.action}'."}}
+    return fleet_response(result, {"message": f"Site '{server_name}' - statut changé à '{req.action}'."}, response)
 
 
 @router.get("/{server_name}/status", summary="Vérifier le statut d'un site web")
-async def get_website_status(server_name: str):
+async def get_website_status(server_name: str, response: Response, fleet: Fleet = Depends()):
     """
     Vérifie si un site est actuellement activé ou désactivé. Route ouverte.
     """
     payload = {"server_name": server_name, "action": "status"}
-    result = run_playbook("webserver", "status", payload)
+    result = await run_playbook("webserver", "status", payload, **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"status": result.get('result', {}).get('status', 'unknown')}}
+    return fleet_response(result, {"status": result.get('result', {}).get('status', 'unknown')}, response, with_results=True)
 
 
 @router.get("", summary="Lister tous les sites web")
-async def list_websites():
+async def list_websites(response: Response, fleet: Fleet = Depends()):
     """
     Liste tous les sites configurés. Route ouverte.
     """
     payload = {"action": "list"}
-    result = run_playbook("webserver", "list", payload)
+    result = await run_playbook("webserver", "list", payload, **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"websites": result.get('result', {}).get('results', [])}}
+    return fleet_response(result, {"websites": fleet_results(result, [])}, response)
 
 
 @router.get("/{server_name}/config", summary="Obtenir la configuration d'un site web")
-async def get_website_config(server_name: str):
+async def get_website_config(server_name: str, response: Response, fleet: Fleet = Depends()):
     """
     Retourne le contenu du fichier de configuration Nginx pour un site. Route ouverte.
     """
     payload = {"server_name": server_name, "action": "config"}
-    result = run_playbook("webserver", "config", payload)
+    result = await run_playbook("webserver", "config", payload, **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"config": result.get('result', {}).get('config', {})}}
+    return fleet_response(result, {"config": result.get('result', {}).get('config', {})}, response, with_results=True)
 
 
 @router.put("/{server_name}/config", summary="Mettre à jour la configuration d'un site web")
-async def update_website_config(server_name: str, req: WebsiteRequest):
+async def update_website_config(server_name: str, req: WebsiteRequest, response: Response, fleet: Fleet = Depends()):
     """
     Met à jour un fichier de configuration de site existant. Route ouverte.
     """
@@ -110,23 +168,109 @@ async def update_website_config(server_name: str, req: WebsiteRequest):
         raise HTTPException(400, detail={"status": "fail", "message": "L'action doit être 'update' et 'root_dir' est requis."})
     
     payload = {"server_name": server_name, "root_dir": req.root_dir, "action": "update"}
-    result = run_playbook("webserver", "update", payload)
+    result = await reload_batcher.submit("update", payload, **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"message": f"Configuration du site '{server_name}' mise à jour."}}
+    return fleet_response(result, {"message": f"Configuration du site '{server_name}' mise à jour."}, response)
 
 
 @router.get("/{server_name}/logs", summary="Obtenir les logs d'un site web")
-async def get_website_logs(server_name: str):
+async def get_website_logs(server_name: str, response: Response, fleet: Fleet = Depends()):
     """
     Récupère les dernières lignes des logs Nginx. Route ouverte.
     """
     payload = {"server_name": server_name, "action": "logs"}
-    result = run_playbook("webserver", "logs", payload)
+    result = await run_playbook("webserver", "logs", payload, **fleet.options)
     
-    if result.get('return_code') != 0:
+    if fleet_outcome(result) == 'failed':
         raise HTTPException(500, detail=result)
         
-    return {"status": "success", "data": {"logs": result.get('result', {}).get('logs', [])}}
\ No newline at end of file
+    return fleet_response(result, {"logs": result.get('result', {}).get('logs', [])}, response, with_results=True)
+
+
+def _sse(event_id: str, event: str = None, data: dict = None) -> str:
+    # Sans 'data', le message ne fait que mettre à jour Last-Event-ID côté client.
+    message = f"id: {event_id}\n"
+    if event is None:
+        return message + ": ping\n\n"
+    # Seules les dates ne sont pas sérialisables telles quelles.
+    return message + f"event: {event}\ndata: {json.dumps(data, default=lambda v: v.isoformat())}\n\n"
+
+
+@router.get("/{server_name}/logs/stream", summary="Suivre les logs d'un site en direct (SSE)")
+async def stream_website_logs(
+    server_name: str,
+    request: Request,
+    kinds: str = Query("access,error", description="Logs suivis : 'access', 'error' ou 'access,error'"),
+    status: str = Query(None, description="Optionnel: statut ou classe de statut (ex: 404, 5xx, 404,5xx)"),
+    path: str = Query(None, description="Optionnel: début du chemin des requêtes"),
+    since: datetime.datetime = Query(None, description="Optionnel: lignes à partir de cette date (ISO 8601, UTC par défaut)"),
+    until: datetime.datetime = Query(None, description="Optionnel: lignes jusqu'à cette date (ISO 8601, UTC par défaut)"),
+    lines: int = Query(50, ge=0, le=10000, description="Dernières lignes relues avant le suivi, sans curseur"),
+    cursor: str = Query(None, description="Optionnel: curseur de reprise (sinon l'en-tête Last-Event-ID)"),
+    follow: bool = Query(True, description="false pour s'arrêter à la fin des fichiers")
+):
+    """
+    Flux Server-Sent Events des logs d'accès et d'erreur d'un site
+    (<server_name>.access.log / .error.log), filtré côté serveur. Chaque
+    événement ('access' ou 'error') porte en 'id' la position atteinte dans
+    chaque fichier : un client reconnecté (Last-Event-ID) reprend sans perte
+    ni doublon, y compris après une rotation des logs. Route ouverte.
+    """
+    if not SERVER_NAME_PATTERN.match(server_name):
+        raise HTTPException(400, detail={"status": "fail", "message": f"Nom de site '{server_name}' invalide."})
+    selected = tuple(k for k in LOG_KINDS if k in {part.strip() for part in kinds.split(',')})
+    if not selected:
+        raise HTTPException(400, detail={"status": "fail", "message": "kinds doit contenir 'access' et/ou 'error'."})
+    try:
+        log_filter = LogFilter(status=status, path_prefix=path, since=since, until=until)
+        cursor = cursor or request.headers.get("last-event-id")
+        positions = decode_cursor(cursor) if cursor else None
+    except ValueError as e:  # filtre de statut ou CursorError
+        raise HTTPException(400, detail={"status": "fail", "message": str(e)})
+    if not any(os.path.exists(vhost_log_path(server_name, kind)) for kind in selected):
+        raise HTTPException(404, detail={"status": "fail", "message": f"Aucun log pour le site '{server_name}'."})
+    # Une période déjà écoulée se lit jusqu'à la fin des fichiers, sans suivi.
+    if log_filter.until is not None and log_filter.until <= datetime.datetime.now(datetime.timezone.utc):
+        follow = False
+
+    async def events():
+        async for kind, entry, position in follow_vhost(server_name, selected, log_filter, positions, lines, follow):
+            if kind is None:
+                if await request.is_disconnected():
+                    return
+                yield _sse(position)
+            else:
+                yield _sse(position, kind, entry or {})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/{server_name}/stats", summary="Statistiques de trafic d'un site")
+async def get_website_stats(
+    server_name: str,
+    window: str = Query("1h", description=f"Fenêtre de temps : {', '.join(STATS_WINDOWS)}"),
+    step: str = Query(None, description="Intervalle de la série : 'minute' ou 'hour' (par défaut selon la fenêtre)")
+):
+    """
+    Requêtes (total et par seconde), répartition des statuts, octets servis et
+    latences (p50/p95/p99 de $request_time et $upstream_response_time) d'un site,
+    au total et par intervalle. Les lignes du log d'accès ajoutées depuis la
+    dernière lecture sont analysées avant de répondre. Route ouverte.
+    """
+    if not SERVER_NAME_PATTERN.match(server_name):
+        raise HTTPException(400, detail={"status": "fail", "message": f"Nom de site '{server_name}' invalide."})
+    if window not in STATS_WINDOWS:
+        raise HTTPException(400, detail={"status": "fail", "message": f"Fenêtre inconnue (attendu : {', '.join(STATS_WINDOWS)})."})
+    if step is None:
+        step = "minute" if STATS_WINDOWS[window] <= 21600 else "hour"
+    if step not in ("minute", "hour"):
+        raise HTTPException(400, detail={"status": "fail", "message": "L'intervalle doit être 'minute' ou 'hour'."})
+
+    ingested = await access_log_ingester.ingest(server_name)
+    loop = asyncio.get_running_loop()
+    stats = await loop.run_in_executor(None, get_access_log_stats, server_name, STATS_WINDOWS[window], step)
+    return {"status": "success", "data": {**stats, "ingested": ingested}}
@@ -0,0 +1,300 @@
+import asyncio
+import collections
+import json
+import os
+import time
+import uuid
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from app.run_logs import RunLog, run_log_store
+from app.scheduler import action_priority
+from app.services import (
+    ANSIBLE_OUTPUT_FORMAT, ENV, ExecutorSaturatedError, PLAYBOOK_RUN_TIMEOUT, READ_ACTIONS, SummaryBuilder,
+    build_command, invalidate_after_write, record_run, scheduled_slot, summarize, task_timings,
+)
+
+# Nombre de lignes gardées par run pour les abonnés qui arrivent en cours de route.
+RUN_BUFFER_LINES = int(os.environ.get('API_RUN_BUFFER_LINES', '1000'))
+# Nombre de messages en attente d'envoi par connexion ; au-delà, les lignes sont abandonnées.
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('API_SUBSCRIBER_QUEUE_SIZE', '256'))
+# Durée (secondes) pendant laquelle un run terminé reste consultable.
+RUN_RETENTION = float(os.environ.get('API_RUN_RETENTION', '300'))
+# Taille maximale d'une ligne de sortie lue sur les tubes du processus.
+RUN_MAX_LINE = 16 * 1024 * 1024
+
+
+class Subscriber:
+    """
+    File d'envoi d'une connexion, partagée par tous les runs qu'elle suit.
+    Elle ne bloque jamais le run : quand elle est pleine, les lignes sont
+    abandonnées et le nombre de lignes perdues est signalé dès qu'il y a de la
+    place. Les messages de contrôle (fin de run, pertes) ne sont jamais abandonnés.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.dropped = 0
+        self._messages: Deque[Dict[str, Any]] = collections.deque()
+        self._pending_drops: Dict[str, int] = {}
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+
+    def offer(self, message: Dict[str, Any]):
+        run_id = message.get('run_id')
+        if message['type'] != 'line':
+            self._flush_drops(run_id)
+            self._push(message)
+            return
+        if len(self._messages) >= self.max_size:
+            self._pending_drops[run_id] = self._pending_drops.get(run_id, 0) + 1
+            self.dropped += 1
+            return
+        self._flush_drops(run_id)
+        self._push(message)
+
+    def _flush_drops(self, run_id: Optional[str]):
+        count = self._pending_drops.pop(run_id, 0)
+        if count:
+            self._push({'type': 'dropped', 'run_id': run_id, 'count': count})
+
+    def _push(self, message: Dict[str, Any]):
+        self._messages.append(message)
+        self._ready.set()
+
+    async def put(self, message: Dict[str, Any]):
+        """Ajoute un message sans jamais l'abandonner : attend qu'il y ait de la place."""
+        while len(self._messages) >= self.max_size:
+            self._space.clear()
+            await self._space.wait()
+        self._push(message)
+
+    async def get(self) -> Dict[str, Any]:
+        while not self._messages:
+            self._ready.clear()
+            await self._ready.wait()
+        self._space.set()
+        return self._messages.popleft()
+
+
+class Run:
+    """
+    Un run de playbook diffusé : sa sortie récente et ses abonnés. La sortie
+    complète est aussi conservée dans son fichier (même identifiant).
+    """
+
+    def __init__(self, service: str, action: str, buffer_lines: int):
+        self.id = uuid.uuid4().hex
+        self.log: RunLog = run_log_store.open(service, action, 'stream', self.id)
+        self.service = service
+        self.action = action
+        self.state = 'queued'
+        self.return_code: Optional[int] = None
+        self.error: Optional[str] = None
+        # Résumé du run terminé, comme celui de run_playbook (None si la sortie n'en donne pas).
+        self.result: Optional[Dict[str, Any]] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.seq = 0
+        self.buffer: Deque[Dict[str, Any]] = collections.deque(maxlen=buffer_lines)
+        self.subscribers: Set[Subscriber] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def publish_line(self, stream: str, data: str):
+        self.seq += 1
+        self.log.write((data + '\n').encode())
+        message = {'type': 'line', 'run_id': self.id, 'seq': self.seq, 'stream': stream, 'data': data}
+        self.buffer.append(message)
+        for subscriber in self.subscribers:
+            subscriber.offer(message)
+
+    def end_message(self) -> Dict[str, Any]:
+        message = {'type': 'end', 'run_id': self.id, 'state': self.state, 'return_code': self.return_code}
+        if self.error:
+            message['message'] = self.error
+        if self.result is not None:
+            message['result'] = self.result
+        return message
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'run_id': self.id, 'service': self.service, 'action': self.action,
+            'state': self.state, 'return_code': self.return_code,
+            'lines': self.seq, 'first_seq': self.buffer[0]['seq'] if self.buffer else self.seq + 1,
+            'subscribers': len(self.subscribers),
+        }
+
+
+class RunBroker:
+    """
+    Lance des playbooks dont la sortie (stdout et stderr, lus en parallèle) est
+    diffusée à un nombre quelconque d'abonnés. Un run ne dépend d'aucune
+    connexion : il continue si ses abonnés se déconnectent, et un abonné qui
+    arrive en cours de route reçoit d'abord les dernières lignes gardées.
+    """
+
+    def __init__(self, buffer_lines: int, retention: float):
+        self.buffer_lines = buffer_lines
+        self.retention = retention
+        self.runs: Dict[str, Run] = {}
+
+    def start(self, service: str, action: str, payload: Dict[str, Any],
+              target: Optional[str] = None, forks: Optional[int] = None) -> Run:
+        run = Run(service, action, self.buffer_lines)
+        self.runs[run.id] = run
+        run.task = asyncio.ensure_future(
+            self._execute(run, payload, build_command(service, action, payload, target, forks))
+        )
+        return run
+
+    def get(self, run_id: str) -> Optional[Run]:
+        return self.runs.get(run_id)
+
+    def subscribe(self, run_id: str, subscriber: Subscriber) -> Optional[Run]:
+        """Abonne la connexion au run ; les lignes gardées sont envoyées avant les suivantes."""
+        run = self.runs.get(run_id)
+        if run is None:
+            return None
+        subscriber.offer({'type': 'subscribed', **run.info()})
+        for message in run.buffer:
+            subscriber.offer(message)
+        if run.finished:
+            subscriber.offer(run.end_message())
+        else:
+            run.subscribers.add(subscriber)
+        return run
+
+    def unsubscribe(self, run_id: str, subscriber: Subscriber):
+        run = self.runs.get(run_id)
+        if run is not None:
+            run.subscribers.discard(subscriber)
+
+    def unsubscribe_all(self, subscriber: Subscriber):
+        for run in self.runs.values():
+            run.subscribers.discard(subscriber)
+
+    async def cancel(self, run_id: str) -> bool:
+        """Interrompt un run en cours (le processus Ansible est tué)."""
+        run = self.runs.get(run_id)
+        if run is None or run.finished:
+            return False
+        run.task.cancel()
+        await asyncio.gather(run.task, return_exceptions=True)
+        return True
+
+    async def stop(self):
+        for run in list(self.runs.values()):
+            await self.cancel(run.id)
+
+    async def _execute(self, run: Run, payload: Dict[str, Any], cmd: List[str]):
+        # La sortie est au même format que celle des runs de l'API : elle est résumée
+        # au fil de l'eau ('ndjson') ou en fin de run ('json').
+        builder = SummaryBuilder() if ANSIBLE_OUTPUT_FORMAT == 'ndjson' else None
+        stdout_lines: List[str] = []
+        start_time = None
+        try:
+            # Un run diffusé occupe ses ressources et un créneau d'exécution comme
+            # n'importe quel appel HTTP.
+            priority = action_priority((run.service, run.action), (run.service, run.action) in READ_ACTIONS)
+            async with scheduled_slot(run.service, run.action, payload, priority):
+                run.state = 'running'
+                start_time = time.time()
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    env=ENV,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    limit=RUN_MAX_LINE,
+                )
+
+                async def pump():
+                    await asyncio.gather(
+                        self._pump(run, 'stdout', process.stdout,
+                                   builder.feed if builder is not None else stdout_lines.append),
+                        self._pump(run, 'stderr', process.stderr),
+                    )
+                    return await process.wait()
+
+                try:
+                    run.return_code = await asyncio.wait_for(pump(), PLAYBOOK_RUN_TIMEOUT)
+                    run.state = 'succeeded' if run.return_code == 0 else 'failed'
+                except asyncio.TimeoutError:
+                    run.state, run.error = 'failed', f"Playbook interrompu après {PLAYBOOK_RUN_TIMEOUT:g}s."
+                finally:
+                    # Le créneau n'est rendu qu'une fois le processus arrêté.
+                    if process.returncode is None:
+                        process.kill()
+                        run.return_code = await process.wait()
+        except ExecutorSaturatedError as e:
+            run.state, run.error = 'rejected', str(e)
+        except asyncio.CancelledError:
+            run.state = 'cancelled'
+        except Exception as e:
+            run.state, run.error = 'failed', str(e)
+        finally:
+            # Comme run_playbook : seuls les runs dont le processus s'est terminé sont enregistrés.
+            if run.return_code is not None and run.state in ('succeeded', 'failed'):
+                self._record(run, payload, time.time() - start_time, builder, stdout_lines)
+            self._finish(run)
+
+    @staticmethod
+    def _record(run: Run, payload: Dict[str, Any], duration: float,
+                builder: Optional[SummaryBuilder], stdout_lines: List[str]):
+        """
+        Suite commune à tous les runs (voir run_playbook) : le run est enregistré
+        avec la durée de ses tâches, et une écriture appliquée évince du cache
+        les lectures qu'elle rend obsolètes.
+        """
+        if builder is not None:
+            timings = builder.timings
+            run.result = builder.summary() if builder.events else None
+        else:
+            try:
+                ans_json = json.loads('\n'.join(stdout_lines))
+            except json.JSONDecodeError:
+                ans_json = None
+            timings = task_timings(ans_json) if ans_json is not None else []
+            run.result = summarize(ans_json) if ans_json is not None else None
+        record_run(run.service, run.action, run.id, run.return_code, duration, timings)
+        invalidate_after_write(run.service, run.action, payload,
+                               {'return_code': run.return_code, 'result': run.result})
+
+    async def _pump(self, run: Run, stream: str, reader: asyncio.StreamReader,
+                    on_line: Optional[Callable[[str], None]] = None):
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                line = e.partial  # dernière ligne, sans fin de ligne
+            except asyncio.LimitOverrunError as e:
+                # Ligne plus longue que RUN_MAX_LINE : on la transmet par morceaux.
+                line = await reader.read(e.consumed)
+            if not line:
+                return
+            data = line.decode(errors='replace').rstrip('\n')
+            if on_line is not None:
+                on_line(data)
+            run.publish_line(stream, data)
+
+    def _finish(self, run: Run):
+        run.finished_at = time.time()
+        run_log_store.close(run.log, run.state, run.return_code)
+        message = run.end_message()
+        for subscriber in run.subscribers:
+            subscriber.offer(message)
+        run.subscribers.clear()
+        asyncio.get_running_loop().call_later(self.retention, self.runs.pop, run.id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        active = [r for r in self.runs.values() if not r.finished]
+        return {
+            'active_runs': len(active),
+            'retained_runs': len(self.runs) - len(active),
+            'subscribers': sum(len(r.subscribers) for r in active),
+        }
+
+
+run_broker = RunBroker(RUN_BUFFER_LINES, RUN_RETENTION)
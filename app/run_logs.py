@@ -0,0 +1,175 @@
+import asyncio
+import collections
+import mmap
+import os
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.database import _utc_timestamp, get_run_log, save_run_log
+
+# Dossier des fichiers de sortie des runs (un fichier <run_id>.log par run).
+RUN_LOG_DIR = os.environ.get('API_RUN_LOG_DIR', 'run_logs')
+# Taille maximale (octets) d'une lecture de sortie, par requête ou par message.
+RUN_LOG_READ_LIMIT = 1024 * 1024
+# Taille des morceaux envoyés lors du suivi d'une sortie en direct.
+RUN_LOG_TAIL_CHUNK = 64 * 1024
+# Nombre de runs terminés gardés en mémoire, le temps que leur entrée soit écrite en base.
+RUN_LOG_RECENT = 256
+
+
+def read_range(path: str, offset: int, limit: int) -> bytes:
+    """Lit `limit` octets au plus à partir de `offset`, par projection mémoire du fichier."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset >= size:
+            return b''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[offset:min(offset + limit, size)]
+
+
+def _cut_at_line(data: bytes) -> bytes:
+    # On coupe après le dernier saut de ligne pour ne pas couper un caractère
+    # multi-octets ; une ligne plus longue que le morceau est envoyée telle quelle.
+    end = data.rfind(b'\n')
+    return data[:end + 1] if end >= 0 else data
+
+
+class RunLog:
+    """
+    Fichier de sortie d'un run en cours, en ajout seul. Les lecteurs qui suivent
+    la sortie en direct sont réveillés à chaque écriture et à la fermeture.
+    """
+
+    def __init__(self, run_id: str, service: str, action: str, source: str, path: str):
+        self.run_id = run_id
+        self.service = service
+        self.action = action
+        self.source = source
+        self.path = path
+        self.size = 0
+        self.state = 'running'
+        self.return_code: Optional[int] = None
+        self.started_at = _utc_timestamp()
+        self.finished_at: Optional[str] = None
+        self._file = open(path, 'ab')
+        self._waiters: List[asyncio.Future] = []
+
+    @property
+    def closed(self) -> bool:
+        return self.finished_at is not None
+
+    def write(self, data: bytes):
+        if not data or self.closed:
+            return
+        self._file.write(data)
+        # Écrit aussitôt : les lectures par projection mémoire voient la sortie en direct.
+        self._file.flush()
+        self.size += len(data)
+        self._notify()
+
+    def close(self, state: str, return_code: Optional[int]):
+        if self.closed:
+            return
+        self._file.close()
+        self.state = state
+        self.return_code = return_code
+        self.finished_at = _utc_timestamp()
+        self._notify()
+
+    def changed(self) -> asyncio.Future:
+        """Future résolue à la prochaine écriture ou à la fermeture."""
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        return fut
+
+    def _notify(self):
+        waiters, self._waiters = self._waiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'run_id': self.run_id, 'service': self.service, 'action': self.action,
+            'source': self.source, 'path': self.path, 'state': self.state,
+            'return_code': self.return_code, 'size': self.size,
+            'started_at': self.started_at, 'finished_at': self.finished_at,
+        }
+
+
+class RunLogStore:
+    """
+    Conserve la sortie brute de chaque run dans un fichier, indexé par run_id
+    dans la table 'run_logs'. Les runs en cours sont aussi gardés en mémoire
+    pour être suivis en direct.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.active: Dict[str, RunLog] = {}
+        self.recent: 'collections.OrderedDict[str, Dict[str, Any]]' = collections.OrderedDict()
+
+    def open(self, service: str, action: str, source: str, run_id: Optional[str] = None) -> RunLog:
+        """Crée le fichier de sortie d'un nouveau run. source : 'api', 'stream' ou 'native' (lecture servie sans Ansible)."""
+        os.makedirs(self.directory, exist_ok=True)
+        run_id = run_id or uuid.uuid4().hex
+        log = RunLog(run_id, service, action, source, os.path.join(self.directory, f'{run_id}.log'))
+        self.active[run_id] = log
+        save_run_log(log.info())
+        return log
+
+    def close(self, log: RunLog, state: str, return_code: Optional[int] = None):
+        log.close(state, return_code)
+        self.active.pop(log.run_id, None)
+        info = log.info()
+        self.recent[log.run_id] = info
+        while len(self.recent) > RUN_LOG_RECENT:
+            self.recent.popitem(last=False)
+        save_run_log(info)
+
+    def info(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Entrée d'un run (en cours ou terminé), ou None. Accède à SQLite pour les runs terminés."""
+        log = self.active.get(run_id)
+        if log is not None:
+            return log.info()
+        info = self.recent.get(run_id)
+        if info is not None:
+            return info
+        return get_run_log(run_id)
+
+    def read(self, info: Dict[str, Any], offset: int, limit: int) -> Tuple[bytes, int]:
+        """Retourne (données, taille actuelle du fichier) pour une lecture par plage."""
+        try:
+            size = os.path.getsize(info['path'])
+        except OSError:
+            return b'', 0
+        return read_range(info['path'], offset, min(limit, RUN_LOG_READ_LIMIT)), size
+
+    async def tail(self, info: Dict[str, Any], offset: int = 0) -> AsyncIterator[Tuple[int, bytes]]:
+        """
+        Produit (offset, données) depuis `offset` jusqu'à la fin de la sortie,
+        en attendant les nouvelles écritures tant que le run est en cours.
+        """
+        run_id, path = info['run_id'], info['path']
+        while True:
+            log = self.active.get(run_id)
+            size = log.size if log is not None else _file_size(path)
+            if offset < size:
+                data = _cut_at_line(read_range(path, offset, min(size - offset, RUN_LOG_TAIL_CHUNK)))
+                yield offset, data
+                offset += len(data)
+            elif log is None:
+                return
+            else:
+                # Pas d'attente entre la lecture de la taille et celle-ci : aucune écriture n'est manquée.
+                await log.changed()
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+run_log_store = RunLogStore(RUN_LOG_DIR)
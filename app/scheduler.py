@@ -0,0 +1,146 @@
+"""
+Ordonnancement des runs selon les ressources qu'ils modifient.
+
+Chaque action d'écriture déclare ses ressources (utilisateur, groupe, site,
+rechargement de Nginx). Un run attend que chacune soit libre avant de demander
+un créneau d'exécution : deux écritures sur la même ressource passent l'une
+après l'autre, dans l'ordre d'arrivée, et des écritures sur des ressources
+différentes s'exécutent en parallèle. Les lectures n'attendent aucune ressource.
+"""
+import asyncio
+import collections
+import contextlib
+import time
+from typing import Any, Deque, Dict, Iterable, List, Tuple
+
+from app.metrics import SCHEDULER_WAIT
+
+# Classes de priorité pour l'accès aux créneaux d'exécution, de la plus prioritaire
+# à la moins prioritaire : lectures interactives, écritures unitaires, écritures par lots.
+PRIORITIES = ('read', 'write', 'bulk')
+BULK_ACTIONS = {('user', 'batch'), ('webserver', 'changeset')}
+
+Resource = Tuple[str, str]
+
+
+class ResourceWaitTimeout(Exception):
+    """Levée quand les ressources d'un run ne se libèrent pas à temps."""
+
+
+def _user_resources(op: Dict[str, Any]) -> List[Resource]:
+    resources = []
+    if op.get('action') != 'create_group' and op.get('username'):
+        resources.append(('user', op['username']))
+    if op.get('group'):
+        resources.append(('group', op['group']))
+    return resources
+
+
+def action_resources(service: str, action: str, payload: Dict[str, Any]) -> List[Resource]:
+    """
+    Ressources modifiées par une action d'écriture (aucune pour une lecture).
+
+    Les ressources ne dépendent pas de la cible : un même utilisateur sur deux
+    groupes d'hôtes qui se recouvrent ne doit pas être modifié deux fois en même
+    temps. Toute écriture de site recharge Nginx : les écritures de sites passent
+    donc une à une (ReloadBatcher les regroupe en amont, voir app/vhost_changes.py).
+    """
+    resources = set()
+    if service == 'user':
+        operations = payload.get('operations') if action == 'batch' else [{**payload, 'action': action}]
+        for op in operations or []:
+            resources.update(_user_resources(op))
+    elif service == 'webserver':
+        operations = payload.get('operations') if action == 'changeset' else [payload]
+        for op in operations or []:
+            if op.get('server_name'):
+                resources.add(('site', op['server_name']))
+        resources.add(('nginx', 'reload'))
+    return sorted(resources)
+
+
+def action_priority(action_key: Tuple[str, str], is_read: bool) -> str:
+    if is_read:
+        return 'read'
+    return 'bulk' if action_key in BULK_ACTIONS else 'write'
+
+
+class _Ticket:
+    """Place d'un run dans la file de chacune de ses ressources."""
+
+    __slots__ = ('resources', 'granted')
+
+    def __init__(self, resources: List[Resource], granted: asyncio.Future):
+        self.resources = resources
+        self.granted = granted
+
+
+class ResourceLocks:
+    """
+    Une file d'attente par ressource. Un run prend place dans la file de chacune
+    de ses ressources à son arrivée, en une fois, et s'exécute quand il est en
+    tête de toutes : les runs qui partagent une ressource passent dans leur ordre
+    d'arrivée, sans interblocage possible (l'ordre d'arrivée est le même dans
+    toutes les files). Une file n'existe que tant qu'un run y attend ou s'exécute.
+    """
+
+    def __init__(self):
+        self._queues: Dict[Resource, Deque[_Ticket]] = {}
+        self.acquired = 0
+        self.contended = 0
+
+    def _ready(self, ticket: _Ticket) -> bool:
+        return all(self._queues[r][0] is ticket for r in ticket.resources)
+
+    def _leave(self, ticket: _Ticket):
+        """Retire le run de ses files et accorde les ressources aux runs désormais en tête."""
+        heads = []
+        for resource in ticket.resources:
+            queue = self._queues[resource]
+            queue.remove(ticket)
+            if queue:
+                heads.append(queue[0])
+            else:
+                del self._queues[resource]
+        for head in heads:
+            if not head.granted.done() and self._ready(head):
+                head.granted.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, resources: Iterable[Resource], priority: str, timeout: float):
+        """
+        Tient les ressources pendant le bloc. ResourceWaitTimeout si elles ne
+        sont pas toutes libres à temps.
+        """
+        start = time.perf_counter()
+        ticket = _Ticket(list(resources), asyncio.get_running_loop().create_future())
+        for resource in ticket.resources:
+            self._queues.setdefault(resource, collections.deque()).append(ticket)
+        if self._ready(ticket):
+            ticket.granted.set_result(None)
+        else:
+            self.contended += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket.granted), timeout)
+            except BaseException as e:
+                self._leave(ticket)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise ResourceWaitTimeout(', '.join(f"{kind}:{name}" for kind, name in ticket.resources)) from None
+                raise
+        self.acquired += 1
+        SCHEDULER_WAIT.observe(time.perf_counter() - start, 'resource', priority)
+        try:
+            yield
+        finally:
+            self._leave(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        waiting: Dict[str, int] = collections.defaultdict(int)
+        for (kind, _), queue in self._queues.items():
+            waiting[kind] += sum(1 for ticket in queue if not ticket.granted.done())
+        return {
+            'held': sum(1 for queue in self._queues.values() if queue[0].granted.done()),
+            'waiting': {kind: n for kind, n in waiting.items() if n},
+            'acquired': self.acquired,
+            'contended': self.contended,
+        }
@@ -1,41 +1,608 @@
-import subprocess
+import asyncio
+import collections
+import contextlib
+import datetime
 import json
 import os
 import ast # Utilisé pour évaluer une chaîne de caractères
 import time
-from typing import Any, Dict
+from typing import Any, Deque, Dict, List, Optional, Tuple
 # On garde la fonction de log pour le dashboard
-from app.database import log_playbook_run
+from app.database import log_playbook_run, log_task_timings, metrics_writer
+from app.metrics import NATIVE_READ_DURATION, PLAYBOOK_DURATION, SCHEDULER_WAIT, SUBPROCESS_SPAWN, SUMMARY_PARSE, Gauge
+from app.native_backend import NATIVE_READS_ENABLED, NGINX_CONF_DIR, NativeBackend, NativeFallback
+from app.run_logs import RunLog, run_log_store
+from app.scheduler import PRIORITIES, ResourceLocks, ResourceWaitTimeout, action_priority, action_resources
+from app.warm_pool import WarmPool, WorkerError, worker_command
 
 
 # --- Configuration Globale Ansible ---
-ANSIBLE_PLAYBOOK_PATH = '/home/deb/API/FPJ/venv/bin/ansible-playbook'
-INVENTORY  = 'inventory/hosts.ini'
+ANSIBLE_PLAYBOOK_PATH = os.environ.get('ANSIBLE_PLAYBOOK_PATH', '/home/deb/API/FPJ/venv/bin/ansible-playbook')
+# Source(s) d'inventaire : un fichier, ou un dossier dont tous les fichiers sont lus
+# (ex: 'inventory/' pour ajouter la flotte de test inventory/local_fleet.ini).
+INVENTORY  = os.environ.get('API_INVENTORY', 'inventory/hosts.ini')
 PLAYBOOK   = 'playbook.yml'
 VAULT_OPTS = ['--vault-password-file', '/home/deb/.vault_pass.txt']
 ENV        = os.environ.copy()
-ENV['ANSIBLE_STDOUT_CALLBACK'] = 'json'
+# Format de la sortie d'Ansible :
+# 'ndjson' : un événement JSON par ligne (callback_plugins/ndjson_events.py), lu au fil de l'eau.
+# 'json'   : un seul document JSON en fin de run (callback 'json' d'Ansible, comportement historique).
+ANSIBLE_OUTPUT_FORMAT = os.environ.get('ANSIBLE_OUTPUT_FORMAT', 'ndjson')
+ENV['ANSIBLE_STDOUT_CALLBACK'] = 'ndjson_events' if ANSIBLE_OUTPUT_FORMAT == 'ndjson' else 'json'
+
+# --- Backend d'exécution ---
+# 'subprocess' : un processus ansible-playbook par run (comportement historique).
+# 'warm_pool'  : des workers persistants qui ont déjà chargé Ansible, l'inventaire
+#                et le playbook (voir app/ansible_worker.py).
+ANSIBLE_BACKEND = os.environ.get('ANSIBLE_BACKEND', 'subprocess')
+WARM_POOL_SIZE = int(os.environ.get('ANSIBLE_WARM_POOL_SIZE', '4'))
+# Nombre de runs après lequel un worker est remplacé.
+WARM_POOL_MAX_RUNS = int(os.environ.get('ANSIBLE_WARM_POOL_MAX_RUNS', '50'))
+# Interpréteur Python des workers : il doit pouvoir importer ansible.
+WARM_POOL_PYTHON = os.environ.get('ANSIBLE_WORKER_PYTHON', '')
+
+# --- Limites d'exécution des playbooks ---
+# Nombre maximal de playbooks exécutés en même temps, tous services confondus.
+MAX_CONCURRENT_PLAYBOOKS = int(os.environ.get('API_MAX_CONCURRENT_PLAYBOOKS', '8'))
+# Limite par service : le service 'webserver' passe par apt/dpkg, qui ne supporte
+# pas bien les exécutions parallèles.
+MAX_CONCURRENT_PER_SERVICE = {
+    'user':      int(os.environ.get('API_MAX_CONCURRENT_USER', '4')),
+    'webserver': int(os.environ.get('API_MAX_CONCURRENT_WEBSERVER', '2')),
+}
+# Nombre maximal de requêtes en attente d'un créneau avant de répondre 503.
+PLAYBOOK_MAX_QUEUE = int(os.environ.get('API_PLAYBOOK_MAX_QUEUE', '32'))
+# Temps d'attente maximal (secondes) d'un créneau d'exécution.
+PLAYBOOK_QUEUE_TIMEOUT = float(os.environ.get('API_PLAYBOOK_QUEUE_TIMEOUT', '30'))
+# Les créneaux libérés vont d'abord aux lectures, puis aux écritures unitaires, puis
+# aux lots ; au-delà de cette attente (secondes), une requête passe en tête quelle
+# que soit sa priorité, pour qu'un flot de lectures n'affame pas les écritures.
+PRIORITY_MAX_WAIT = float(os.environ.get('API_PRIORITY_MAX_WAIT', '5'))
+# Temps d'attente maximal (secondes) des verrous des ressources modifiées (voir app/scheduler.py).
+RESOURCE_WAIT_TIMEOUT = float(os.environ.get('API_RESOURCE_WAIT_TIMEOUT', '120'))
+# Durée maximale (secondes) d'un playbook avant qu'il ne soit tué.
+PLAYBOOK_RUN_TIMEOUT = float(os.environ.get('API_PLAYBOOK_RUN_TIMEOUT', '600'))
+# Nombre d'hôtes traités en parallèle par un run (--forks), par défaut et au maximum.
+PLAYBOOK_DEFAULT_FORKS = int(os.environ.get('API_PLAYBOOK_FORKS', '20'))
+PLAYBOOK_MAX_FORKS = int(os.environ.get('API_PLAYBOOK_MAX_FORKS', '100'))
+# Format 'ndjson' uniquement : tue le playbook dès le premier échec non ignoré,
+# sans attendre la fin du play (le code de retour est alors celui du processus tué).
+PLAYBOOK_FAIL_FAST = os.environ.get('API_PLAYBOOK_FAIL_FAST', '0') == '1'
+# Actions jamais interrompues au premier échec : leur section 'rescue' doit
+# pouvoir restaurer la configuration (voir roles/nginx_vhost/tasks/changeset.yml).
+TRANSACTIONAL_ACTIONS = {('webserver', 'changeset')}
+
+
+class ExecutorSaturatedError(Exception):
+    """Levée quand aucun créneau d'exécution ne se libère à temps (réponse HTTP 503)."""
+
+
+class PlaybookLimiter:
+    """
+    Limite le nombre de playbooks exécutés simultanément, globalement et par service.
+    Les requêtes excédentaires attendent dans une file bornée, avec un délai maximal ;
+    les créneaux libérés sont accordés par priorité (voir PRIORITIES), puis par ordre d'arrivée.
+    """
+
+    def __init__(self, limit: int, per_service: Dict[str, int], max_queue: int, queue_timeout: float,
+                 priority_max_wait: float = PRIORITY_MAX_WAIT):
+        self.limit = limit
+        self.per_service = per_service
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.priority_max_wait = priority_max_wait
+        self.rejected = 0
+        self._running = 0
+        self._running_by_service: Dict[str, int] = collections.defaultdict(int)
+        # File d'attente : (rang de priorité, numéro d'arrivée, heure d'arrivée, service,
+        # future résolue quand le créneau est accordé)
+        self._waiters: List[Tuple[int, int, float, str, asyncio.Future]] = []
+        self._arrivals = 0
+
+    def _can_start(self, service: str) -> bool:
+        return (self._running < self.limit
+                and self._running_by_service[service] < self.per_service.get(service, self.limit))
+
+    def _take(self, service: str):
+        self._running += 1
+        self._running_by_service[service] += 1
+
+    def _wake_waiters(self):
+        # On accorde les créneaux libres par priorité puis par ordre d'arrivée, en
+        # sautant les services déjà à leur limite pour ne pas bloquer les autres.
+        # Une requête qui attend depuis plus de priority_max_wait passe en tête.
+        aged = asyncio.get_running_loop().time() - self.priority_max_wait
+        order = sorted(self._waiters, key=lambda w: (0 if w[2] <= aged else w[0], w[1]))
+        for entry in order:
+            service, fut = entry[3], entry[4]
+            if fut.done():
+                self._waiters.remove(entry)
+            elif self._can_start(service):
+                self._waiters.remove(entry)
+                self._take(service)
+                fut.set_result(None)
+
+    async def acquire(self, service: str, priority: str = 'write'):
+        # Les créneaux libres étant accordés dès leur libération, un créneau
+        # disponible ici ne peut revenir à aucune requête déjà en attente.
+        if self._can_start(service):
+            self._take(service)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise ExecutorSaturatedError(f"File d'attente pleine ({self.max_queue} requêtes en attente).")
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._arrivals += 1
+        entry = (PRIORITIES.index(priority), self._arrivals, loop.time(), service, fut)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+            self.rejected += 1
+            raise ExecutorSaturatedError(
+                f"Aucun créneau d'exécution libéré en {self.queue_timeout:g}s pour le service '{service}'."
+            )
+        except asyncio.CancelledError:
+            # Le créneau a pu être accordé juste avant l'annulation : on le rend.
+            if fut.done() and not fut.cancelled():
+                self.release(service)
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+            raise
+
+    def release(self, service: str):
+        self._running -= 1
+        self._running_by_service[service] -= 1
+        self._wake_waiters()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, service: str, priority: str = 'write'):
+        """Context manager asynchrone qui réserve un créneau pour la durée du bloc."""
+        start = time.perf_counter()
+        await self.acquire(service, priority)
+        SCHEDULER_WAIT.observe(time.perf_counter() - start, 'slot', priority)
+        try:
+            yield
+        finally:
+            self.release(service)
+
+    def stats(self) -> Dict[str, Any]:
+        queued_by_priority = collections.Counter(PRIORITIES[w[0]] for w in self._waiters if not w[4].done())
+        return {
+            'limit': self.limit,
+            'per_service_limit': dict(self.per_service),
+            'running': self._running,
+            'running_by_service': {s: n for s, n in self._running_by_service.items() if n},
+            'queued': sum(queued_by_priority.values()),
+            'queued_by_priority': dict(queued_by_priority),
+            'rejected': self.rejected,
+        }
+
+
+limiter = PlaybookLimiter(
+    MAX_CONCURRENT_PLAYBOOKS, MAX_CONCURRENT_PER_SERVICE, PLAYBOOK_MAX_QUEUE, PLAYBOOK_QUEUE_TIMEOUT
+)
+
+# Jauges de /metrics : lues dans le limiteur au moment de l'export seulement.
+Gauge('api_playbooks_in_flight', "Playbooks en cours d'exécution, par service.", ('service',),
+      callback=lambda: {(s,): limiter.stats()['running_by_service'].get(s, 0) for s in MAX_CONCURRENT_PER_SERVICE})
+Gauge('api_playbooks_queued', "Requêtes en attente d'un créneau d'exécution.",
+      callback=lambda: {(): limiter.stats()['queued']})
+
+# Verrous des ressources modifiées par les écritures (voir app/scheduler.py).
+resource_locks = ResourceLocks()
+
+
+@contextlib.asynccontextmanager
+async def scheduled_slot(service: str, action: str, payload: Dict[str, Any], priority: str):
+    """
+    Réserve les ressources modifiées par l'action, puis un créneau d'exécution,
+    pour la durée du bloc. Les verrous sont pris avant le créneau : une écriture
+    qui attend une ressource occupée n'immobilise aucun créneau.
+    """
+    try:
+        async with resource_locks.hold(action_resources(service, action, payload), priority, RESOURCE_WAIT_TIMEOUT):
+            async with limiter.slot(service, priority):
+                yield
+    except ResourceWaitTimeout as e:
+        limiter.rejected += 1
+        raise ExecutorSaturatedError(
+            f"Ressources de '{service}/{action}' toujours occupées après {RESOURCE_WAIT_TIMEOUT:g}s ({e})."
+        )
+
+
+def _scheduler_depth():
+    depth = {('slot', p): n for p, n in limiter.stats()['queued_by_priority'].items()}
+    depth.update({('resource', kind): n for kind, n in resource_locks.stats()['waiting'].items()})
+    return depth
+
+
+Gauge('api_scheduler_queue_depth',
+      "Runs en attente, par étape ('resource' : par type de ressource, 'slot' : par priorité).",
+      ('stage', 'kind'), callback=_scheduler_depth)
+
+
+# --- Actions des rôles ---
+# Actions que le playbook sait exécuter, par service (un fichier de tâches par action
+# dans roles/linux_user et roles/nginx_vhost). Toute action reçue d'un client est
+# vérifiée contre cette liste avant de lancer ansible-playbook.
+PLAYBOOK_ACTIONS = {
+    'user': {
+        'create', 'delete', 'password', 'add_group', 'del_group',
+        'list_groups', 'list_users', 'create_group', 'batch',
+    },
+    'webserver': {
+        'create', 'delete', 'enable', 'disable', 'update', 'changeset',
+        'list', 'status', 'config', 'logs', 'inventory',
+    },
+}
+
+# --- Actions en lecture ---
+# Elles ne modifient rien sur les machines : leurs résultats peuvent être mis en
+# cache et les runs identiques simultanés peuvent être fusionnés.
+READ_ACTIONS = {
+    ('user', 'list_users'), ('user', 'list_groups'),
+    ('webserver', 'list'), ('webserver', 'status'), ('webserver', 'config'), ('webserver', 'logs'),
+    ('webserver', 'inventory'),
+}
+
+# --- Cache des actions en lecture ---
+CACHE_ENABLED = os.environ.get('API_CACHE_ENABLED', '1') == '1'
+# Nombre maximal de résultats conservés ; au-delà, le moins récemment utilisé est évincé.
+CACHE_MAX_ENTRIES = int(os.environ.get('API_CACHE_MAX_ENTRIES', '256'))
+# Durée de vie (secondes) des résultats, par (service, action). Seules ces actions sont mises en cache.
+CACHE_TTL = {
+    ('user', 'list_users'):   30,
+    ('user', 'list_groups'):  30,
+    ('webserver', 'list'):    30,
+    ('webserver', 'status'):  30,
+    ('webserver', 'config'):  30,
+    ('webserver', 'logs'):    5,
+    ('webserver', 'inventory'): 30,
+}
+# Entrées à évincer après une écriture réussie : (service, action d'écriture) -> [(action en lecture, clé du payload)].
+# Si la clé est renseignée, seules les entrées portant la même valeur pour cette clé sont évincées
+# (ex: supprimer un site n'évince que le 'status' et la 'config' de ce site).
+CACHE_INVALIDATIONS = {
+    ('user', 'create'):       [('list_users', None), ('list_groups', None)],
+    ('user', 'delete'):       [('list_users', None), ('list_groups', None)],
+    ('user', 'create_group'): [('list_groups', None)],
+    ('user', 'add_group'):    [('list_groups', None)],
+    ('user', 'del_group'):    [('list_groups', None)],
+    ('user', 'batch'):        [('list_users', None), ('list_groups', None)],
+    ('webserver', 'create'):  [('list', None), ('inventory', None), ('status', 'server_name'), ('config', 'server_name')],
+    ('webserver', 'delete'):  [('list', None), ('inventory', None), ('status', 'server_name'), ('config', 'server_name')],
+    ('webserver', 'enable'):  [('inventory', None), ('status', 'server_name')],
+    ('webserver', 'disable'): [('inventory', None), ('status', 'server_name')],
+    ('webserver', 'update'):  [('config', 'server_name')],
+    ('webserver', 'changeset'): [('list', None), ('inventory', None), ('status', None), ('config', None)],
+}
+
+CacheKey = Tuple[str, str, str]
+
+
+def request_key(service: str, action: str, payload: Dict[str, Any], target: Optional[str] = None) -> CacheKey:
+    """
+    Clé normalisée d'une requête : l'ordre des champs du payload n'a pas
+    d'importance. Les runs sur des cibles différentes ont des clés différentes.
+    """
+    normalized = json.dumps(payload, sort_keys=True, default=str)
+    if target is not None:
+        normalized = f'{target}|{normalized}'
+    return (service, action, normalized)
+
+
+class ResultCache:
+    """
+    Cache LRU à durée de vie limitée des résultats de run_playbook,
+    indexé par (service, action, payload normalisé).
+    """
+
+    def __init__(self, max_entries: int, ttls: Dict[Tuple[str, str], float],
+                 invalidations: Dict[Tuple[str, str], List[Tuple[str, Optional[str]]]]):
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.invalidations = invalidations
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidated = 0
+        self.stale_puts = 0
+        # clé -> (date d'expiration, payload, résultat) ; l'ordre sert à l'éviction LRU.
+        self._entries: 'collections.OrderedDict[CacheKey, Tuple[float, Dict[str, Any], Dict[str, Any]]]' = \
+            collections.OrderedDict()
+        # Génération d'invalidation par (service, action en lecture) : incrémentée à
+        # chaque écriture qui rend cette lecture obsolète.
+        self._generations: Dict[Tuple[str, str], int] = collections.defaultdict(int)
+
+    def is_cacheable(self, service: str, action: str) -> bool:
+        return (service, action) in self.ttls
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def generation(self, service: str, action: str) -> int:
+        return self._generations[(service, action)]
+
+    def put(self, key: CacheKey, payload: Dict[str, Any], result: Dict[str, Any], generation: int):
+        """
+        Conserve le résultat d'une lecture lancée à la génération `generation` ; il
+        est ignoré si une écriture a invalidé cette lecture pendant le run.
+        """
+        service, action, _ = key
+        if self._generations[(service, action)] != generation:
+            self.stale_puts += 1
+            return
+        self._entries[key] = (time.monotonic() + self.ttls[(service, action)], payload, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, service: str, action: str, payload: Dict[str, Any]):
+        """Évince les lectures rendues obsolètes par une écriture réussie."""
+        rules = self.invalidations.get((service, action))
+        if not rules:
+            return
+        for read_action, _ in rules:
+            self._generations[(service, read_action)] += 1
+        for key, (_, cached_payload, _) in list(self._entries.items()):
+            if key[0] != service:
+                continue
+            for read_action, field in rules:
+                if key[1] == read_action and (field is None or cached_payload.get(field) == payload.get(field)):
+                    del self._entries[key]
+                    self.invalidated += 1
+                    break
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidated,
+            'stale_puts': self.stale_puts,
+        }
+
+
+result_cache = ResultCache(CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_INVALIDATIONS)
+
+
+class SingleFlight:
+    """
+    Fusionne les runs identiques simultanés : la première requête lance le run,
+    les suivantes attendent ce même run et partagent son résultat.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._inflight: Dict[Tuple[Any, ...], asyncio.Task] = {}
+
+    async def do(self, key: Tuple[Any, ...], fn):
+        task = self._inflight.get(key)
+        if task is None:
+            # Le run est une tâche à part : si le client qui l'a lancé abandonne,
+            # les autres requêtes en attente obtiennent quand même le résultat.
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'in_flight': len(self._inflight), 'runs': self.leaders, 'coalesced_waiters': self.coalesced}
+
+
+single_flight = SingleFlight()
+
+warm_pool = WarmPool(
+    WARM_POOL_SIZE, WARM_POOL_MAX_RUNS, worker_command(WARM_POOL_PYTHON, INVENTORY, PLAYBOOK, VAULT_OPTS)
+)
+
+
+async def start_backend():
+    """Démarre le backend d'exécution choisi (appelé depuis le lifespan de l'application)."""
+    if ANSIBLE_BACKEND == 'warm_pool':
+        try:
+            await warm_pool.start()
+        except WorkerError as e:
+            # L'API démarre quand même : le pool sera relancé au premier run.
+            print(f"ERREUR: {e}")
+
+
+async def stop_backend():
+    await warm_pool.stop()
+
+
+def runtime_stats() -> Dict[str, Any]:
+    """
+    Retourne l'état interne de l'exécuteur (créneaux occupés, file d'attente),
+    des files des ressources, du backend, du cache et de la fusion des runs identiques.
+    """
+    backend = {'name': ANSIBLE_BACKEND}
+    if ANSIBLE_BACKEND == 'warm_pool':
+        backend['warm_pool'] = warm_pool.stats()
+    return {
+        'executor': limiter.stats(),
+        'resources': resource_locks.stats(),
+        'backend': backend,
+        'cache': result_cache.stats(),
+        'single_flight': single_flight.stats(),
+        'metrics_writer': metrics_writer.stats(),
+    }
+
+
+# Champs d'une opération groupée renvoyés au client (jamais le mot de passe).
+BATCH_ITEM_FIELDS = ('action', 'username', 'group', 'server_name')
+
+
+def _loop_item(res: Dict[str, Any]) -> Any:
+    # Élément de boucle d'un résultat, sous le nom de sa variable ('item' par défaut, 'loop_var').
+    return res.get(res.get('ansible_loop_var') or 'item')
+
+
+def _batch_items(res: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Retourne les résultats d'une tâche en boucle sur des opérations groupées (éléments avec un 'id')."""
+    results = res.get('results')
+    if not isinstance(results, list):
+        return []
+    return [r for r in results
+            if isinstance(r, dict) and isinstance(_loop_item(r), dict) and 'id' in _loop_item(r)]
+
+
+def _item_status(res: Dict[str, Any]) -> Dict[str, Any]:
+    item = _loop_item(res)
+    entry = {'id': item['id'], **{f: item[f] for f in BATCH_ITEM_FIELDS if item.get(f) is not None}}
+    if res.get('failed'):
+        entry['status'] = 'failed'
+        entry['reason'] = res.get('msg', 'Aucun message d\'erreur détaillé trouvé.')
+    elif res.get('skipped'):
+        entry['status'] = 'skipped'
+    else:
+        entry['status'] = 'changed' if res.get('changed') else 'ok'
+    return entry
+
+
+def _display_value(msg_content: Any) -> Any:
+    """Valeur d'un message 'Afficher ...' : la première valeur du JSON, sinon le message brut."""
+    try:
+        # Le message est du JSON (ex: {'users': [...]}) : on garde sa première valeur.
+        return list(json.loads(msg_content).values())[0]
+    except (json.JSONDecodeError, TypeError, AttributeError, IndexError):
+        return msg_content
+
+
+def _host_status(entry: Dict[str, Any], counts: Optional[Dict[str, int]]) -> str:
+    # Les statistiques finales font foi ; à défaut (run interrompu), les résultats reçus.
+    if counts:
+        if counts.get('unreachable'):
+            return 'unreachable'
+        if counts.get('failures'):
+            return 'failed'
+        return 'ok'
+    return entry['status']
+
+
+def _hosts_summary(hosts: Dict[str, Dict[str, Any]], stats: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Résumé par hôte : état (ok, failed, unreachable), premier échec, durée et résultat affiché."""
+    summary = {}
+    for name in sorted(set(hosts) | set(stats)):
+        entry = dict(hosts.get(name) or {'status': 'ok', 'changed': 0, 'start': None, 'end': None})
+        entry['status'] = _host_status(entry, stats.get(name))
+        if entry.get('start') is not None and entry.get('end') is not None:
+            entry['duration'] = round(entry['end'] - entry['start'], 3)
+        summary[name] = entry
+    return summary
+
+
+def _result_status(res: Dict[str, Any]) -> str:
+    """Statut d'un résultat du callback 'json', avec les mêmes noms que le callback 'ndjson_events'."""
+    if res.get('unreachable'):
+        return 'unreachable'
+    if res.get('failed'):
+        return 'failed'
+    if res.get('skipped'):
+        return 'skipped'
+    return 'changed' if res.get('changed') else 'ok'
+
+
+def _epoch(value: Any) -> Optional[float]:
+    """Horodatage ISO 8601 du callback 'json' (UTC, avec ou sans 'Z') en secondes depuis l'epoch."""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+def task_timings(ansible_json: Dict[str, Any]) -> List[Tuple]:
+    """
+    Durée de chaque tâche sur chaque hôte dans la sortie du callback 'json' :
+    (tâche, module, hôte, statut, début, fin). Ce callback ne date que la tâche
+    ('duration' : premier hôte lancé, dernier résultat reçu) ; tous ses hôtes
+    reçoivent ces bornes.
+    """
+    timings = []
+    for play in ansible_json.get('plays', []):
+        for task in play.get('tasks', []):
+            name = task['task'].get('name', 'Tâche inconnue')
+            duration = task['task'].get('duration') or {}
+            start, end = _epoch(duration.get('start')), _epoch(duration.get('end'))
+            for host, res in task['hosts'].items():
+                timings.append((name, res.get('action'), host, _result_status(res), start, end))
+    return timings
 
 
 def summarize(ansible_json: Dict[str, Any]) -> Dict[str, Any]:
     """
     Version finale et robuste qui analyse la sortie JSON d'Ansible.
+    0. Relève le statut de chaque élément des opérations groupées (clé 'items').
     1. Cherche les erreurs en premier.
     2. Si pas d'erreur, cherche un message à afficher et place TOUJOURS
        le résultat final et propre dans une clé nommée 'results'.
+    Dans tous les cas, 'hosts' donne l'état et le résultat de chaque hôte.
     """
     stats = ansible_json.get('stats', {})
-    
+
+    # Étape 0 : Statut par élément des opérations groupées. Leurs échecs sont
+    # rapportés élément par élément et ne masquent pas les autres. On relève
+    # aussi l'état de chaque hôte (sans durée : le callback 'json' ne la donne pas).
+    items = []
+    hosts: Dict[str, Dict[str, Any]] = {}
+    for play in ansible_json.get('plays', []):
+        for task in play.get('tasks', []):
+            name = task['task'].get('name', 'Tâche inconnue')
+            for host, res in task['hosts'].items():
+                batch = _batch_items(res)
+                items.extend(_item_status(r) for r in batch)
+                entry = hosts.setdefault(host, {'status': 'ok', 'changed': 0, 'start': None, 'end': None})
+                entry['changed'] += 1 if res.get('changed') else 0
+                if (res.get('failed') or res.get('unreachable')) and not batch and 'failed_task' not in entry:
+                    entry.update(status='unreachable' if res.get('unreachable') else 'failed', failed_task=name,
+                                 reason=res.get('msg', 'Aucun message d\'erreur détaillé trouvé.'))
+                elif res.get('msg') and 'afficher' in name.lower() and 'results' not in entry:
+                    entry['results'] = _display_value(res['msg'])
+    items.sort(key=lambda i: i['id'])
+    extra = {'items': items} if items else {}
+    extra['hosts'] = _hosts_summary(hosts, stats)
+
     # Étape 1 : Recherche d'erreurs
     for play in ansible_json.get('plays', []):
         for task in play.get('tasks', []):
             name = task['task'].get('name', 'Tâche inconnue')
             for host, res in task['hosts'].items():
-                if res.get('failed'):
+                if res.get('failed') and not _batch_items(res):
                     return {
                         'stats': stats,
                         'failed_task': name,
-                        'reason': res.get('msg', 'Aucun message d\'erreur détaillé trouvé.')
+                        'reason': res.get('msg', 'Aucun message d\'erreur détaillé trouvé.'),
+                        **extra
                     }
 
     # Étape 2 : Recherche de résultats de succès à parser
@@ -50,43 +617,396 @@ def summarize(ansible_json: Dict[str, Any]) -> Dict[str, Any]:
                         parsed_data = json.loads(msg_content)
                         # On extrait la première valeur du dictionnaire, qui est notre liste
                         final_result = list(parsed_data.values())[0]
-                        return {'stats': stats, 'results': final_result}
+                        return {'stats': stats, 'results': final_result, **extra}
                     except (json.JSONDecodeError, AttributeError, IndexError):
                         # Cas 2: Le message est une chaîne (ex: "Groupes: [...]")
                         try:
                             list_str = msg_content.split(':', 1)[1].strip()
                             final_result = ast.literal_eval(list_str)
-                            return {'stats': stats, 'results': final_result}
+                            return {'stats': stats, 'results': final_result, **extra}
                         except: # En dernier recours, si le parsing échoue
-                            return {'stats': stats, 'results': msg_content}
+                            return {'stats': stats, 'results': msg_content, **extra}
 
     # Si aucune erreur et aucune tâche d'affichage (ex: une action 'create' réussie)
-    return {'stats': stats, 'results': []}
+    return {'stats': stats, 'results': [], **extra}
 
 
-def run_playbook(service: str, action: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    """Exécute un playbook et enregistre le résultat dans la base de données de métriques."""
-    start_time = time.time()
+class SummaryBuilder:
+    """
+    Construit le même résumé que summarize() à partir des événements émis ligne
+    par ligne par le callback 'ndjson_events', sans garder toute la sortie en
+    mémoire : seuls le premier échec, le premier message à afficher, le statut
+    des opérations groupées et, par hôte, l'état, le premier échec, les bornes
+    de temps et le message affiché sont conservés. 'timings' garde la durée de
+    chaque tâche sur chaque hôte, au format de task_timings().
+    """
+
+    # Nombre de lignes hors événements (avertissements...) gardées pour 'raw'.
+    MAX_RAW_LINES = 200
+
+    def __init__(self):
+        self.stats: Dict[str, Any] = {}
+        self.failure: Optional[Dict[str, Any]] = None
+        self.events = 0
+        self._results: Any = None
+        self._items: List[Dict[str, Any]] = []
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+        self.timings: List[Tuple] = []
+        self._raw: Deque[str] = collections.deque(maxlen=self.MAX_RAW_LINES)
+
+    def feed(self, line: str):
+        """Traite une ligne de la sortie d'Ansible."""
+        line = line.strip()
+        if not line:
+            return
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            event = None
+        if not isinstance(event, dict) or 'event' not in event:
+            self._raw.append(line)
+            return
+        self.events += 1
+
+        kind = event['event']
+        if kind == 'stats':
+            self.stats = event.get('stats', {})
+        elif kind == 'result':
+            self._on_result(event)
+
+    def _on_result(self, event: Dict[str, Any]):
+        res = event.get('result') or {}
+        status = event.get('status')
+        host = self._hosts.setdefault(event.get('host'), {'status': 'ok', 'changed': 0, 'start': None, 'end': None})
+        if event.get('start') is not None:
+            host['start'] = event['start'] if host['start'] is None else min(host['start'], event['start'])
+        if event.get('end') is not None:
+            host['end'] = event['end'] if host['end'] is None else max(host['end'], event['end'])
+        host['changed'] += 1 if status == 'changed' else 0
+        self.timings.append((event.get('task') or 'Tâche inconnue', event.get('action'), event.get('host'),
+                             status, event.get('start'), event.get('end')))
+
+        items = _batch_items(res)
+        if items:
+            # Les échecs des opérations groupées sont rapportés élément par élément.
+            self._items.extend(_item_status(r) for r in items)
+            return
+        if status in ('failed', 'unreachable'):
+            if not event.get('ignore_errors'):
+                failure = {
+                    'failed_task': event.get('task') or 'Tâche inconnue',
+                    'reason': res.get('msg', 'Aucun message d\'erreur détaillé trouvé.'),
+                }
+                if 'failed_task' not in host:
+                    host.update(status=status, **failure)
+                if self.failure is None:
+                    self.failure = failure
+            return
+        if res.get('msg') and 'afficher' in (event.get('task') or '').lower() and 'results' not in host:
+            host['results'] = _display_value(res['msg'])
+            if self._results is None:
+                self._results = host['results']
+
+    @property
+    def failed(self) -> bool:
+        return self.failure is not None
+
+    def summary(self) -> Dict[str, Any]:
+        extra = {'items': sorted(self._items, key=lambda i: i['id'])} if self._items else {}
+        extra['hosts'] = _hosts_summary(self._hosts, self.stats)
+        if self.failure is not None:
+            return {'stats': self.stats, **self.failure, **extra}
+        results = self._results if self._results is not None else []
+        return {'stats': self.stats, 'results': results, **extra}
+
+    def raw(self) -> str:
+        """Lignes de sortie qui n'étaient pas des événements (les dernières seulement)."""
+        return '\n'.join(self._raw)
 
+
+def extra_vars(service: str, action: str, payload: Dict[str, Any], target: Optional[str] = None) -> Dict[str, Any]:
+    """Variables passées au playbook ; 'target' (hôte, groupe ou motif) remplace le groupe par défaut."""
     extra = {'service': service, 'user_action': action, 'payload': payload}
-    cmd = [
+    if service == 'webserver':
+        # Même dossier que celui lu par le backend natif.
+        extra['nginx_conf_dir'] = NGINX_CONF_DIR
+    if target:
+        extra['target'] = target
+    return extra
+
+
+def build_command(service: str, action: str, payload: Dict[str, Any],
+                  target: Optional[str] = None, forks: Optional[int] = None) -> List[str]:
+    """Construit la ligne de commande ansible-playbook pour une action donnée."""
+    return [
         ANSIBLE_PLAYBOOK_PATH, '-i', INVENTORY, *VAULT_OPTS, PLAYBOOK,
-        '--extra-vars', json.dumps(extra)
+        '--forks', str(forks or PLAYBOOK_DEFAULT_FORKS),
+        '--extra-vars', json.dumps(extra_vars(service, action, payload, target))
     ]
-    proc = subprocess.run(cmd, env=ENV, capture_output=True, text=True)
+
+
+async def _run_subprocess(cmd: List[str], log: Optional[RunLog] = None) -> Tuple[int, str, str]:
+    """
+    Lance la commande sans bloquer la boucle d'événements et retourne
+    (code de retour, stdout, stderr). Le processus est tué en cas de
+    dépassement de PLAYBOOK_RUN_TIMEOUT ou d'annulation de la requête.
+    La sortie complète est ajoutée au fichier de sortie du run, s'il y en a un.
+    """
+    with SUBPROCESS_SPAWN.time('ansible_playbook'):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, env=ENV, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), PLAYBOOK_RUN_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return proc.returncode, '', f"Playbook interrompu après {PLAYBOOK_RUN_TIMEOUT:g}s."
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    if log is not None:
+        log.write(stdout)
+        log.write(stderr)
+    return proc.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+
+async def _drain(stream: asyncio.StreamReader, limit: int, log: Optional[RunLog] = None) -> str:
+    """
+    Lit un flux ligne par ligne jusqu'au bout en ne gardant que ses `limit`
+    derniers octets ; chaque ligne est aussi ajoutée au fichier de sortie du run.
+    """
+    tail = b''
+    async for line in stream:
+        if log is not None:
+            log.write(line)
+        tail = (tail + line)[-limit:]
+    return tail.decode(errors='replace')
+
+
+async def _run_subprocess_events(cmd: List[str], log: Optional[RunLog] = None,
+                                 fail_fast: bool = False) -> Tuple[int, SummaryBuilder, str]:
+    """
+    Variante de _run_subprocess pour le format 'ndjson' : stdout est lu ligne
+    par ligne et passé au SummaryBuilder pendant l'exécution, stderr est lu en
+    parallèle. Avec `fail_fast`, le processus est tué au premier échec.
+    Les deux flux sont ajoutés au fichier de sortie du run au fil de l'eau.
+    """
+    builder = SummaryBuilder()
+    with SUBPROCESS_SPAWN.time('ansible_playbook'):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, env=ENV, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            # Une ligne = un événement ; un message de liste peut être volumineux.
+            limit=64 * 1024 * 1024,
+        )
+    stderr_task = asyncio.ensure_future(_drain(proc.stderr, 64 * 1024, log))
+
+    async def read_events():
+        # Temps passé dans l'analyse des événements, cumulé sur tout le run.
+        parse_time = 0.0
+        async for line in proc.stdout:
+            if log is not None:
+                log.write(line)
+            start = time.perf_counter()
+            builder.feed(line.decode(errors='replace'))
+            parse_time += time.perf_counter() - start
+            if fail_fast and builder.failed:
+                proc.kill()
+                break
+        SUMMARY_PARSE.observe(parse_time, 'ndjson')
+        return await proc.wait()
+
+    try:
+        returncode = await asyncio.wait_for(read_events(), PLAYBOOK_RUN_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        stderr_task.cancel()
+        return proc.returncode, builder, f"Playbook interrompu après {PLAYBOOK_RUN_TIMEOUT:g}s."
+    except asyncio.CancelledError:
+        proc.kill()
+        stderr_task.cancel()
+        raise
+    return returncode, builder, await stderr_task
+
+
+async def run_playbook(service: str, action: str, payload: Dict[str, Any],
+                       use_cache: bool = True, target: Optional[str] = None,
+                       forks: Optional[int] = None, priority: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Exécute un playbook de façon asynchrone et enregistre le résultat dans la
+    base de données de métriques. Lève ExecutorSaturatedError si aucun créneau
+    d'exécution n'est disponible à temps.
+
+    Les actions en lecture sont servies depuis le cache tant que leur résultat
+    est valide, et les lectures identiques simultanées partagent un seul run.
+    Les écritures ne sont jamais fusionnées ; une écriture réussie, même sur une
+    partie des hôtes seulement, évince les entrées du cache qu'elle rend obsolètes.
+
+    `target` choisit les hôtes (groupe 'local_managed' par défaut) et `forks`
+    le nombre d'hôtes traités en parallèle ; le résumé donne le détail par
+    hôte dans 'hosts'.
+
+    Les écritures attendent que les ressources qu'elles modifient soient libres
+    (voir app/scheduler.py). `priority` ('read', 'write' ou 'bulk') fixe le rang
+    de la requête dans la file des créneaux ; par défaut, il dépend de l'action.
+    """
+    key = request_key(service, action, payload, target)
+    is_read = (service, action) in READ_ACTIONS
+    priority = priority or action_priority((service, action), is_read)
+    cacheable = CACHE_ENABLED and use_cache and result_cache.is_cacheable(service, action)
+    if cacheable:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if is_read:
+        # Une lecture arrivée après une invalidation ne rejoint pas un run lancé avant.
+        generation = result_cache.generation(service, action)
+        result = await single_flight.do(
+            (*key, generation), lambda: _execute_playbook(service, action, payload, target, forks, priority)
+        )
+        if cacheable and result.get('return_code') == 0:
+            result_cache.put(key, payload, result, generation)
+    else:
+        result = await _execute_playbook(service, action, payload, target, forks, priority)
+        invalidate_after_write(service, action, payload, result)
+    return result
+
+
+def _write_applied(result: Dict[str, Any]) -> bool:
+    """
+    Vrai si l'écriture a pu modifier au moins un hôte : run réussi, ou échec
+    partiel dont un hôte est en succès ou a déjà modifié quelque chose.
+    """
+    if result.get('return_code') == 0:
+        return True
+    hosts = (result.get('result') or {}).get('hosts') or {}
+    return any(h.get('status') == 'ok' or h.get('changed') for h in hosts.values())
+
+
+def invalidate_after_write(service: str, action: str, payload: Dict[str, Any], result: Dict[str, Any]):
+    """Évince du cache les lectures rendues obsolètes par une écriture appliquée, même en partie."""
+    if (service, action) not in READ_ACTIONS and _write_applied(result):
+        result_cache.invalidate(service, action, payload)
+
+
+def record_run(service: str, action: str, run_id: str, returncode: Optional[int], duration: float,
+               timings: List[Tuple]):
+    """
+    Enregistre un run de playbook terminé (dashboard, historique, histogramme des
+    durées, durée des tâches). Commun aux runs de l'API et aux runs diffusés sur
+    WebSocket (app/run_broker.py).
+    """
+    status_label = "success" if returncode == 0 else "failure"
+    log_playbook_run(service, action, status_label, duration, run_id)
+    PLAYBOOK_DURATION.observe(duration, service, action, status_label)
+    log_task_timings(run_id, service, action, timings)
+
+
+# Lectures servies sans Ansible quand la cible est la machine de l'API (app/native_backend.py).
+native_backend = NativeBackend(INVENTORY, NATIVE_READS_ENABLED)
+
+
+async def _execute_native(service: str, action: str, payload: Dict[str, Any],
+                          host: str, target: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Exécute une lecture avec le backend natif, hors limiteur : elle ne lance
+    aucun processus. Le run est enregistré comme un run de playbook (sortie,
+    durée, durée des tâches) ; NativeFallback si la lecture doit passer par Ansible.
+    """
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    returncode, ans_json = await loop.run_in_executor(
+        None, native_backend.run, service, action, payload, host, target
+    )
+    duration = time.time() - start_time
+    log = run_log_store.open(service, action, 'native')
+    log.write(json.dumps(ans_json).encode())
+    run_log_store.close(log, 'succeeded' if returncode == 0 else 'failed', returncode)
+
+    status_label = "success" if returncode == 0 else "failure"
+    log_playbook_run(service, action, status_label, duration, log.run_id)
+    NATIVE_READ_DURATION.observe(duration, service, action)
+    log_task_timings(log.run_id, service, action, task_timings(ans_json))
+    return {'return_code': returncode, 'result': summarize(ans_json), 'stderr': '', 'run_id': log.run_id}
+
+
+async def _execute_playbook(service: str, action: str, payload: Dict[str, Any],
+                            target: Optional[str] = None, forks: Optional[int] = None,
+                            priority: str = 'write') -> Dict[str, Any]:
+    """
+    Lance réellement le playbook avec le backend configuré, sans passer par le cache.
+    La sortie brute du run est conservée (voir app/run_logs.py) ; son identifiant
+    est retourné dans 'run_id'. Les lectures sur l'hôte local sont servies par le
+    backend natif, avec la même réponse.
+    """
+    host = native_backend.local_host(service, action, target)
+    if host is not None:
+        try:
+            return await _execute_native(service, action, payload, host, target)
+        except NativeFallback:
+            pass
+    async with scheduled_slot(service, action, payload, priority):
+        start_time = time.time()
+        log = run_log_store.open(service, action, 'api')
+        try:
+            if ANSIBLE_BACKEND == 'warm_pool':
+                extra = extra_vars(service, action, payload, target)
+                try:
+                    returncode, ans_json, stderr = await warm_pool.run(
+                        extra, PLAYBOOK_RUN_TIMEOUT, forks or PLAYBOOK_DEFAULT_FORKS
+                    )
+                    stdout = None
+                except WorkerError as e:
+                    returncode, ans_json, stderr, stdout = -1, None, str(e), ''
+                # Le worker ne renvoie que la sortie déjà décodée : on conserve celle-ci.
+                if ans_json is not None:
+                    log.write(json.dumps(ans_json).encode())
+                log.write(stderr.encode())
+            elif ANSIBLE_OUTPUT_FORMAT == 'ndjson':
+                returncode, builder, stderr = await _run_subprocess_events(
+                    build_command(service, action, payload, target, forks), log,
+                    PLAYBOOK_FAIL_FAST and (service, action) not in TRANSACTIONAL_ACTIONS,
+                )
+            else:
+                returncode, stdout, stderr = await _run_subprocess(
+                    build_command(service, action, payload, target, forks), log
+                )
+        except asyncio.CancelledError:
+            run_log_store.close(log, 'cancelled')
+            raise
+        except Exception:
+            run_log_store.close(log, 'failed')
+            raise
+        run_log_store.close(log, 'succeeded' if returncode == 0 else 'failed', returncode)
 
     # Enregistrement dans la base de données pour le dashboard
     duration = time.time() - start_time
-    status_label = "success" if proc.returncode == 0 else "failure"
-    log_playbook_run(service, action, status_label, duration)
 
-    try:
-        ans_json = json.loads(proc.stdout)
-    except json.JSONDecodeError:
-        return {'return_code': proc.returncode, 'stderr': proc.stderr, 'raw': proc.stdout}
+    if ANSIBLE_BACKEND != 'warm_pool' and ANSIBLE_OUTPUT_FORMAT == 'ndjson':
+        record_run(service, action, log.run_id, returncode, duration, builder.timings)
+        if not builder.events:
+            return {'return_code': returncode, 'stderr': stderr, 'raw': builder.raw(), 'run_id': log.run_id}
+        return {'return_code': returncode, 'result': builder.summary(), 'stderr': stderr, 'run_id': log.run_id}
+
+    parse_start = time.perf_counter()
+    if stdout is not None:
+        try:
+            ans_json = json.loads(stdout)
+        except json.JSONDecodeError:
+            ans_json = None
+    if ans_json is None:
+        record_run(service, action, log.run_id, returncode, duration, [])
+        return {'return_code': returncode, 'stderr': stderr, 'raw': stdout, 'run_id': log.run_id}
 
+    summary = summarize(ans_json)
+    timings = task_timings(ans_json)
+    SUMMARY_PARSE.observe(time.perf_counter() - parse_start, 'json' if stdout is not None else 'warm_pool')
+    record_run(service, action, log.run_id, returncode, duration, timings)
     return {
-        'return_code': proc.returncode,
-        'result':      summarize(ans_json),
-        'stderr':      proc.stderr
-    }
\ No newline at end of file
+        'return_code': returncode,
+        'result':      summary,
+        'stderr':      stderr,
+        'run_id':      log.run_id
+    }
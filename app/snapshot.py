@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from app.services import run_playbook
+
+# Intervalle (secondes) entre deux rafraîchissements automatiques de l'instantané.
+SNAPSHOT_REFRESH_INTERVAL = float(os.environ.get('API_SNAPSHOT_INTERVAL', '60'))
+
+
+def _sites(inventory: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """Transforme la sortie de l'action 'inventory' en une liste de sites avec leur état."""
+    enabled = set(inventory.get('enabled', []))
+    return [
+        {
+            'server_name': filename[:-len('.conf')] if filename.endswith('.conf') else filename,
+            'file': filename,
+            'enabled': filename in enabled,
+        }
+        for filename in sorted(inventory.get('available', []))
+    ]
+
+
+class InventorySnapshot:
+    """
+    Instantané des utilisateurs, groupes et sites (avec leur état d'activation),
+    rafraîchi en arrière-plan. Le dashboard s'affiche à partir de cet instantané
+    au lieu de lancer des playbooks à chaque chargement.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.data: Dict[str, Any] = {
+            'users': [], 'groups': [], 'sites': [],
+            'updated_at': None, 'duration': None, 'errors': {},
+        }
+        self._loop_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> Dict[str, Any]:
+        """Reconstruit l'instantané ; les appels simultanés partagent le même rafraîchissement."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._rebuild())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _rebuild(self) -> Dict[str, Any]:
+        start = time.time()
+        # Le cache est ignoré : l'instantané doit refléter l'état réel des machines.
+        users, groups, sites = await asyncio.gather(
+            run_playbook('user', 'list_users', {}, use_cache=False),
+            run_playbook('user', 'list_groups', {}, use_cache=False),
+            run_playbook('webserver', 'inventory', {}, use_cache=False),
+            return_exceptions=True,
+        )
+
+        data = dict(self.data)
+        errors = {}
+        # Une partie en échec garde sa dernière valeur connue.
+        for name, result, convert in (
+            ('users', users, list),
+            ('groups', groups, list),
+            ('sites', sites, _sites),
+        ):
+            if isinstance(result, Exception):
+                errors[name] = str(result)
+            elif result.get('return_code') != 0:
+                errors[name] = result.get('result', {}).get('reason') or result.get('stderr', '')
+            else:
+                data[name] = convert(result['result'].get('results') or [])
+
+        data.update(
+            updated_at=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+            duration=round(time.time() - start, 3),
+            errors=errors,
+        )
+        self.data = data
+        return data
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"ERREUR: rafraîchissement de l'instantané impossible : {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+
+inventory_snapshot = InventorySnapshot(SNAPSHOT_REFRESH_INTERVAL)
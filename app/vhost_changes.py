@@ -0,0 +1,159 @@
+"""
+Modifications de sites Nginx par lots (action 'changeset' du rôle nginx_vhost).
+
+Un lot applique plusieurs créations, mises à jour, activations, désactivations
+et suppressions de sites en un seul run : une seule validation 'nginx -t' et un
+seul rechargement, ou la restauration de la configuration si une étape échoue
+(voir roles/nginx_vhost/tasks/changeset.yml).
+
+ReloadBatcher regroupe de la même façon les appels unitaires des routes
+/api/webserver reçus pendant une courte fenêtre : une rafale de modifications
+ne recharge Nginx qu'une fois.
+"""
+import asyncio
+import collections
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.metrics import Counter
+from app.services import BATCH_ITEM_FIELDS, run_playbook
+
+# Fenêtre (secondes) pendant laquelle les modifications unitaires de sites sont
+# regroupées en un seul lot ; 0 pour exécuter chaque appel dans son propre run.
+VHOST_RELOAD_WINDOW = float(os.environ.get('API_VHOST_RELOAD_WINDOW', '0.2'))
+# Nombre maximal d'opérations d'un lot, par requête ou par regroupement.
+MAX_CHANGESET_SIZE = int(os.environ.get('API_VHOST_CHANGESET_MAX', '200'))
+
+# Champs requis par type d'opération d'un lot.
+CHANGESET_REQUIRED_FIELDS = {
+    'create':  ('server_name', 'root_dir'),
+    'update':  ('server_name', 'root_dir'),
+    'enable':  ('server_name',),
+    'disable': ('server_name',),
+    'delete':  ('server_name',),
+}
+# Tâche du rôle qui échoue quand 'nginx -t' refuse la configuration du lot.
+CHANGESET_REJECTED_TASK = "Lot de sites : configuration refusée"
+
+VHOST_CHANGES = Counter(
+    'api_vhost_changes_total',
+    "Modifications unitaires de sites, par mode d'exécution : seule dans son run ('single'), "
+    "regroupée dans un lot ('merged'), ou rejouée seule après l'échec de son lot ('replayed').",
+    ('mode',),
+)
+
+
+def changeset_items(result: Dict[str, Any], operations: List[Dict[str, Any]],
+                    rolled_back: bool = False) -> List[Dict[str, Any]]:
+    """
+    Statut de chaque opération d'un lot, dans l'ordre du lot. Une opération
+    passe par plusieurs tâches (configuration, lien...) et sur plusieurs
+    hôtes : elle est en échec si l'une a échoué, modifiée si l'une a modifié.
+    Si le lot a été annulé (`rolled_back`), celles qui n'ont pas échoué sont 'rolled_back'.
+    """
+    rank = {'ok': 0, 'skipped': 0, 'changed': 1, 'failed': 2}
+    reported: Dict[int, Dict[str, Any]] = {}
+    for item in (result.get('result') or {}).get('items', []):
+        current = reported.get(item['id'])
+        if current is None or rank[item['status']] > rank[current['status']]:
+            reported[item['id']] = item
+    items = []
+    for op in operations:
+        item = reported.get(op['id']) or {
+            'id': op['id'], **{f: op[f] for f in BATCH_ITEM_FIELDS if op.get(f) is not None}, 'status': 'ok'
+        }
+        if rolled_back and item['status'] != 'failed':
+            item = {**item, 'status': 'rolled_back'}
+        items.append(item)
+    return items
+
+
+class _Batch:
+    def __init__(self):
+        self.operations: List[Tuple[str, Dict[str, Any]]] = []
+        self.waiters: List[asyncio.Future] = []
+        self.names = set()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class ReloadBatcher:
+    """
+    Regroupe les modifications unitaires de sites d'une même cible reçues
+    pendant `window` secondes en un seul run 'changeset'. Chaque appelant reçoit
+    le résultat du lot ; une opération seule dans sa fenêtre est exécutée avec
+    son action habituelle.
+
+    Un lot ne contient qu'une opération par site : la suivante ouvre un nouveau
+    lot, et les lots d'une même cible sont exécutés dans l'ordre. Si un lot
+    échoue (il a alors été annulé), ses opérations sont rejouées une à une pour
+    que seule l'opération fautive échoue.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self._pending: Dict[Tuple, _Batch] = {}
+        self._locks: Dict[Tuple, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+        self._tasks = set()
+
+    async def submit(self, action: str, payload: Dict[str, Any],
+                     target: Optional[str] = None, forks: Optional[int] = None) -> Dict[str, Any]:
+        """Exécute une modification de site, regroupée avec celles reçues pendant la fenêtre."""
+        if self.window <= 0:
+            VHOST_CHANGES.inc('single')
+            return await run_playbook('webserver', action, payload, target=target, forks=forks)
+        key = (target, forks)
+        batch = self._pending.get(key)
+        if batch is not None and (payload['server_name'] in batch.names or len(batch.operations) >= self.max_size):
+            self._flush(key, batch)
+            batch = None
+        loop = asyncio.get_running_loop()
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = loop.call_later(self.window, self._flush, key, batch)
+        waiter = loop.create_future()
+        batch.operations.append((action, payload))
+        batch.waiters.append(waiter)
+        batch.names.add(payload['server_name'])
+        # Si l'appelant abandonne, le lot est tout de même appliqué.
+        return await asyncio.shield(waiter)
+
+    def _flush(self, key: Tuple, batch: _Batch):
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self._apply(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _apply(self, key: Tuple, batch: _Batch):
+        async with self._locks[key]:
+            try:
+                results = await self._run(batch, *key)
+            except Exception as e:
+                for waiter in batch.waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+        for waiter, result in zip(batch.waiters, results):
+            if not waiter.done():
+                waiter.set_result(result)
+
+    async def _run(self, batch: _Batch, target: Optional[str], forks: Optional[int]) -> List[Dict[str, Any]]:
+        if len(batch.operations) == 1:
+            VHOST_CHANGES.inc('single')
+            action, payload = batch.operations[0]
+            return [await run_playbook('webserver', action, payload, target=target, forks=forks)]
+
+        operations = [{**payload, 'id': i, 'action': action} for i, (action, payload) in enumerate(batch.operations)]
+        result = await run_playbook('webserver', 'changeset', {'operations': operations}, target=target, forks=forks)
+        if result.get('return_code') == 0:
+            VHOST_CHANGES.inc('merged', amount=len(operations))
+            return [result] * len(operations)
+        VHOST_CHANGES.inc('replayed', amount=len(operations))
+        return [await run_playbook('webserver', action, payload, target=target, forks=forks)
+                for action, payload in batch.operations]
+
+
+reload_batcher = ReloadBatcher(VHOST_RELOAD_WINDOW, MAX_CHANGESET_SIZE)
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import sys
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.metrics import SUBPROCESS_SPAWN
+
+# Taille maximale d'une réponse d'un worker (une ligne JSON).
+_MAX_REPLY_BYTES = 64 * 1024 * 1024
+# Attente (secondes) avant de réessayer le démarrage d'un worker de remplacement,
+# doublée à chaque échec jusqu'au maximum.
+_RESPAWN_BACKOFF = 0.5
+_RESPAWN_BACKOFF_MAX = 30.0
+
+
+class WorkerError(Exception):
+    """Levée quand un worker meurt, ne démarre pas ou ne répond pas à temps."""
+
+
+class _Worker:
+    def __init__(self, proc: asyncio.subprocess.Process, startup: float):
+        self.proc = proc
+        self.startup = startup
+        self.runs = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+
+    def kill(self):
+        if self.alive:
+            self.proc.kill()
+
+
+class WarmPool:
+    """
+    Pool de workers Ansible persistants (voir app/ansible_worker.py).
+
+    Chaque worker a déjà chargé Ansible, l'inventaire et le playbook ; un run
+    ne paie donc plus le démarrage de l'interpréteur ni ces chargements.
+    Un worker est recyclé après `max_runs` exécutions pour borner les fuites
+    de mémoire et d'état, et remplacé en arrière-plan.
+    """
+
+    def __init__(self, size: int, max_runs: int, worker_cmd: List[str]):
+        self.size = size
+        self.max_runs = max_runs
+        self.worker_cmd = worker_cmd
+        self.recycled = 0
+        self.crashed = 0
+        self.spawn_failures = 0
+        self.last_startup: Optional[float] = None
+        self.last_spawn_error: Optional[str] = None
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[_Worker] = []
+        self._start_lock: Optional[asyncio.Lock] = None
+        # Positionné quand plus aucun worker ne vit et que son remplacement échoue :
+        # les runs qui attendent un worker sont alors réveillés avec une erreur.
+        self._lost: Optional[asyncio.Event] = None
+        self._replacing: Set[asyncio.Task] = set()
+
+    async def _spawn(self) -> _Worker:
+        with SUBPROCESS_SPAWN.time('warm_pool_worker'):
+            proc = await asyncio.create_subprocess_exec(
+                *self.worker_cmd,
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL, limit=_MAX_REPLY_BYTES,
+            )
+        line = await proc.stdout.readline()
+        try:
+            hello = json.loads(line) if line else {'ready': False, 'error': 'le worker s\'est arrêté au démarrage'}
+        except ValueError:
+            hello = {'ready': False, 'error': f"réponse illisible : {line[:200]!r}"}
+        if not hello.get('ready'):
+            if proc.returncode is None:
+                proc.kill()
+            raise WorkerError(f"Démarrage du worker Ansible impossible : {hello.get('error')}")
+        worker = _Worker(proc, hello['startup'])
+        self.last_startup = worker.startup
+        self._workers.append(worker)
+        return worker
+
+    async def start(self):
+        """Démarre les workers (idempotent)."""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._idle is not None:
+                return
+            workers = await asyncio.gather(*(self._spawn() for _ in range(self.size)),
+                                           return_exceptions=True)
+            errors = [w for w in workers if isinstance(w, BaseException)]
+            if errors:
+                for worker in workers:
+                    if isinstance(worker, _Worker):
+                        worker.kill()
+                        self._workers.remove(worker)
+                raise errors[0]
+            self._idle = asyncio.Queue()
+            self._lost = asyncio.Event()
+            for worker in workers:
+                self._idle.put_nowait(worker)
+
+    def _schedule_replace(self, worker: _Worker):
+        task = asyncio.ensure_future(self._replace(worker))
+        self._replacing.add(task)
+        task.add_done_callback(self._replacing.discard)
+
+    async def _replace(self, worker: _Worker):
+        """
+        Retire un worker et en démarre un nouveau, sans bloquer l'appelant. Le
+        démarrage est réessayé avec un délai croissant tant que le pool n'a pas
+        retrouvé sa taille : un échec ne réduit pas le pool définitivement.
+        """
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if worker.alive:
+            worker.proc.stdin.close()
+            try:
+                await asyncio.wait_for(worker.proc.wait(), 10)
+            except asyncio.TimeoutError:
+                worker.kill()
+        delay = _RESPAWN_BACKOFF
+        while self._idle is not None and len(self._workers) < self.size:
+            try:
+                new = await self._spawn()
+            except WorkerError as e:
+                self.spawn_failures += 1
+                self.last_spawn_error = str(e)
+                if not any(w.alive for w in self._workers):
+                    self._lost.set()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _RESPAWN_BACKOFF_MAX)
+                continue
+            if self._idle is None:
+                new.kill()  # pool arrêté pendant le démarrage
+                return
+            self._lost.clear()
+            self._idle.put_nowait(new)
+            return
+
+    async def _get_idle(self, timeout: float) -> _Worker:
+        """
+        Prend un worker libre. WorkerError si aucun ne se libère en `timeout`
+        secondes, ou dès que le pool a perdu tous ses workers sans pouvoir les remplacer.
+        """
+        get = asyncio.ensure_future(self._idle.get())
+        lost = asyncio.ensure_future(self._lost.wait())
+        try:
+            await asyncio.wait({get, lost}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            # Appelant annulé : un worker déjà obtenu est rendu au pool.
+            if get.done() and not get.cancelled():
+                self._idle.put_nowait(get.result())
+            get.cancel()
+            raise
+        finally:
+            lost.cancel()
+        if get.done():
+            return get.result()
+        # Un get annulé avant d'aboutir laisse le worker dans la file.
+        get.cancel()
+        if self._lost.is_set():
+            raise WorkerError(f"Aucun worker Ansible disponible : {self.last_spawn_error}")
+        raise WorkerError(f"Aucun worker Ansible libéré en {timeout:g}s.")
+
+    async def run(self, extra_vars: Dict[str, Any], timeout: float,
+                  forks: Optional[int] = None) -> Tuple[int, Dict[str, Any], str]:
+        """Exécute un run sur un worker libre et retourne (code de retour, sortie JSON, stderr)."""
+        await self.start()
+        if not self._workers and self._idle.empty():
+            try:
+                self._idle.put_nowait(await self._spawn())
+            except WorkerError as e:
+                self.spawn_failures += 1
+                self.last_spawn_error = str(e)
+                raise
+            self._lost.clear()
+
+        worker = await self._get_idle(timeout)
+        healthy = False
+        try:
+            request = {**extra_vars, '_forks': forks} if forks else extra_vars
+            worker.proc.stdin.write(json.dumps(request).encode() + b'\n')
+            await worker.proc.stdin.drain()
+            line = await asyncio.wait_for(worker.proc.stdout.readline(), timeout)
+            if not line:
+                self.crashed += 1
+                raise WorkerError("Le worker Ansible s'est arrêté pendant l'exécution.")
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                # Réponse tronquée ou mêlée à une autre sortie : le worker n'est plus fiable.
+                self.crashed += 1
+                raise WorkerError(f"Réponse illisible du worker Ansible : {line[:200]!r}")
+            worker.runs += 1
+            healthy = True
+        except asyncio.TimeoutError:
+            raise WorkerError(f"Playbook interrompu après {timeout:g}s.")
+        finally:
+            if healthy and worker.runs < self.max_runs:
+                self._idle.put_nowait(worker)
+            else:
+                # Worker en fin de vie, tué par un timeout/une annulation, ou mort.
+                if healthy:
+                    self.recycled += 1
+                else:
+                    worker.kill()
+                self._schedule_replace(worker)
+        return reply['return_code'], reply['output'], reply['stderr']
+
+    async def stop(self):
+        for task in list(self._replacing):
+            task.cancel()
+        await asyncio.gather(*self._replacing, return_exceptions=True)
+        for worker in list(self._workers):
+            if worker.alive:
+                worker.proc.stdin.close()
+        for worker in list(self._workers):
+            try:
+                await asyncio.wait_for(worker.proc.wait(), 10)
+            except asyncio.TimeoutError:
+                worker.kill()
+        self._workers.clear()
+        self._idle = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': self.size,
+            'alive': sum(1 for w in self._workers if w.alive),
+            'idle': self._idle.qsize() if self._idle is not None else 0,
+            'max_runs': self.max_runs,
+            'recycled': self.recycled,
+            'crashed': self.crashed,
+            'spawn_failures': self.spawn_failures,
+            'last_spawn_error': self.last_spawn_error,
+            'last_startup': round(self.last_startup, 3) if self.last_startup is not None else None,
+        }
+
+
+def worker_command(python: str, inventory: str, playbook: str, vault_opts: List[str]) -> List[str]:
+    return [python or sys.executable, '-m', 'app.ansible_worker',
+            '--inventory', inventory, '--playbook', playbook, *vault_opts]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Mesure le débit d'analyse d'un log d'accès Nginx synthétique (format
+'api_vhost' : 'combined' suivi de $request_time et $upstream_response_time) :
+
+- avant : ligne par ligne, décodage, expression régulière et strptime par ligne
+  (parse_line de app/nginx_logs.py), agrégation par minute et statut ;
+- après : app/log_analytics.py, une expression appliquée à des morceaux de
+  8 Mo, conversions mises en cache, compteurs et position enregistrés dans
+  SQLite à chaque morceau ; puis une seconde passe (rien de nouveau à lire).
+
+Les deux méthodes doivent compter le même nombre de requêtes par statut.
+
+Usage :
+    python benchmarks/bench_access_log.py [--size-mb 200]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PATHS = ['/', '/index.html', '/api/items', '/api/items/42', '/static/app.js', '/static/style.css', '/login']
+STATUSES = [200] * 85 + [304] * 5 + [404] * 6 + [500, 502, 503, 301]
+
+
+def _write_log(path, size_mb):
+    rng = random.Random(42)
+    start = int(time.time()) - 3 * 3600
+    with open(path, 'w') as f:
+        written, i = 0, 0
+        lines = []
+        while written < size_mb * 1024 * 1024:
+            ts = time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(start + i // 200))
+            upstream = f'{rng.random() / 10:.3f}' if rng.random() < 0.7 else '-'
+            line = (f'10.0.{rng.randrange(256)}.{rng.randrange(256)} - - [{ts}] '
+                    f'"GET {rng.choice(PATHS)} HTTP/1.1" {rng.choice(STATUSES)} {rng.randrange(50000)} '
+                    f'"-" "Mozilla/5.0 (X11; Linux x86_64)" {rng.random() / 5:.3f} {upstream}\n')
+            lines.append(line)
+            written += len(line)
+            i += 1
+            if len(lines) == 10000:
+                f.write(''.join(lines))
+                lines = []
+        f.write(''.join(lines))
+    return i
+
+
+def _per_line(nginx_logs, path):
+    counts = {}
+    with open(path, 'rb') as f:
+        for raw in f:
+            entry = nginx_logs.parse_line('access', raw.decode(errors='replace').rstrip('\n'))
+            if 'status' in entry:
+                key = (entry['time'].strftime('%Y-%m-%d %H:%M'), entry['status'])
+                counts[key] = counts.get(key, 0) + 1
+    by_status = {}
+    for (_, status), n in counts.items():
+        by_status[status] = by_status.get(status, 0) + n
+    return by_status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=200, help="taille du log généré (Mo)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(workdir, 'metrics.db'))
+    os.environ['API_NGINX_LOG_DIR'] = workdir
+    sys.path.insert(0, str(ROOT))
+    from app import database, log_analytics, nginx_logs
+    database.init_db()
+
+    path = nginx_logs.vhost_log_path('bench.local', 'access')
+    lines = _write_log(path, args.size_mb)
+    size = os.path.getsize(path) / 1e6
+    print(f"log : {size:.0f} Mo, {lines} lignes")
+
+    start = time.perf_counter()
+    before = _per_line(nginx_logs, path)
+    elapsed = time.perf_counter() - start
+    print(f"{'ligne par ligne (avant)':>28} {elapsed:>7.2f}s {size / elapsed:>8.1f} Mo/s")
+
+    start = time.perf_counter()
+    report = log_analytics.ingest_vhost('bench.local')
+    elapsed = time.perf_counter() - start
+    print(f"{'par morceaux (après)':>28} {elapsed:>7.2f}s {size / elapsed:>8.1f} Mo/s "
+          f"({report['lines']} lignes, {report['skipped']} ignorées)")
+
+    start = time.perf_counter()
+    again = log_analytics.ingest_vhost('bench.local')
+    print(f"{'seconde passe':>28} {time.perf_counter() - start:>7.3f}s ({again['bytes']} octets lus)")
+
+    stats = database.get_access_log_stats('bench.local', database.STATS_WINDOWS['24h'])
+    after = {int(k): v for k, v in stats['totals']['status'].items()}
+    if after != before:
+        raise SystemExit(f"Comptes différents : {before} / {after}")
+    print(f"statuts : {stats['totals']['status_classes']}, upstream p95 : {stats['totals']['upstream_time']['p95']}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare les backends d'exécution 'subprocess' et 'warm_pool'.
+
+Nécessite un vrai Ansible (le faux ansible-playbook ne mesure pas le coût de
+chargement d'Ansible) : ANSIBLE_PLAYBOOK_PATH pour le backend 'subprocess',
+ANSIBLE_WORKER_PYTHON (interpréteur capable d'importer ansible) pour 'warm_pool'.
+
+Pour chaque backend, exécute N fois une action en lecture et affiche le temps
+de démarrage des workers, la latence du premier run, la médiane et le p95.
+
+Usage :
+    python benchmarks/bench_backends.py [-n 20] [--service user] [--action list_users]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def _measure(services, backend, service, action, n):
+    services.ANSIBLE_BACKEND = backend
+    startup = None
+    if backend == 'warm_pool':
+        start = time.perf_counter()
+        await services.warm_pool.start()
+        startup = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        result = await services._execute_playbook(service, action, {})
+        latencies.append(time.perf_counter() - start)
+        if result.get('return_code') != 0:
+            raise SystemExit(f"Échec du run ({backend}) : {result}")
+
+    if backend == 'warm_pool':
+        await services.warm_pool.stop()
+    return startup, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=20, help="nombre de runs par backend")
+    parser.add_argument('--service', default='user')
+    parser.add_argument('--action', default='list_users')
+    args = parser.parse_args()
+
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(tempfile.mkdtemp(), 'metrics.db'))
+    os.environ['ANSIBLE_WARM_POOL_SIZE'] = '1'
+    os.environ['ANSIBLE_WARM_POOL_MAX_RUNS'] = str(args.n + 1)
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+
+    from app.database import init_db
+    from app import services
+    init_db()
+
+    print(f"{'backend':<12} {'démarrage':>10} {'1er run':>9} {'médiane':>9} {'p95':>9}")
+    for backend in ('subprocess', 'warm_pool'):
+        startup, latencies = asyncio.run(_measure(services, backend, args.service, args.action, args.n))
+        startup_str = f"{startup:.3f}s" if startup is not None else '-'
+        print(f"{backend:<12} {startup_str:>10} {latencies[0]:>8.3f}s "
+              f"{statistics.median(latencies):>8.3f}s {_percentile(latencies, 0.95):>8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
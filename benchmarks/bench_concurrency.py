@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'exécuteur asynchrone de playbooks.
+
+Lance N requêtes `list_users` concurrentes contre le faux ansible-playbook
+(durées différentes pour chaque requête) et compare le temps total observé
+à la durée de la requête la plus lente et à la somme de toutes les durées,
+qui correspond à l'ancien comportement bloquant (subprocess.run).
+
+Usage :
+    python benchmarks/bench_concurrency.py [-n 10] [--delay 0.5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=10, help="nombre de requêtes concurrentes")
+    parser.add_argument('--delay', type=float, default=0.5, help="durée de base d'un playbook (s)")
+    args = parser.parse_args()
+
+    # La configuration est lue à l'import de app.services : on la fixe avant.
+    os.environ['ANSIBLE_PLAYBOOK_PATH'] = str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py')
+    # Les lectures passent par le playbook, pas par le backend natif.
+    os.environ['API_NATIVE_READS'] = '0'
+    os.environ['METRICS_DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'metrics.db')
+    os.environ['API_MAX_CONCURRENT_PLAYBOOKS'] = str(args.n)
+    os.environ['API_MAX_CONCURRENT_USER'] = str(args.n)
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+
+    from app.database import init_db
+    from app import services
+    init_db()
+
+    # Durées étalées de delay à 1.5 * delay.
+    delays = [args.delay * (1 + 0.5 * i / max(args.n - 1, 1)) for i in range(args.n)]
+
+    async def timed(delay):
+        start = time.perf_counter()
+        result = await services.run_playbook('user', 'list_users', {'_delay': delay})
+        assert result['return_code'] == 0, result
+        return time.perf_counter() - start
+
+    async def run_all():
+        start = time.perf_counter()
+        durations = await asyncio.gather(*(timed(d) for d in delays))
+        return time.perf_counter() - start, durations
+
+    wall, durations = asyncio.run(run_all())
+    print(f"requêtes concurrentes     : {args.n}")
+    print(f"plus lente                : {max(durations):.3f}s")
+    print(f"somme (exécution en série): {sum(durations):.3f}s")
+    print(f"temps total observé       : {wall:.3f}s")
+    print(f"accélération vs série     : x{sum(durations) / wall:.1f}")
+
+
+if __name__ == '__main__':
+    main()
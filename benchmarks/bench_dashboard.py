@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Mesure le coût du dashboard en direct (app/live_dashboard.py) selon le nombre
+d'écrans ouverts, pendant que des runs sont enregistrés en continu :
+
+- rechargement : chaque écran relit les statistiques à chaque intervalle,
+                 comme une page rechargée (une série de requêtes SQLite par écran) ;
+- flux         : un seul calcul par tick, dont les changements sont diffusés à
+                 tous les écrans (/api/dashboard/live).
+
+Le temps CPU du processus est mesuré sur toute la durée ; les écrans du flux
+consomment leurs messages comme une connexion SSE.
+
+Usage :
+    python benchmarks/bench_dashboard.py [--viewers 1 10 100] [--duration 5] [--rate 50] [--history 100000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ACTIONS = [('user', 'list_users'), ('user', 'create'), ('webserver', 'status'), ('webserver', 'create')]
+
+
+async def _record_runs(database, rate, stop):
+    """Enregistre `rate` runs par seconde (via le writer de fond, comme l'API)."""
+    rng = random.Random(1)
+    while not stop.is_set():
+        for _ in range(max(1, int(rate / 10))):
+            service, action = rng.choice(ACTIONS)
+            status = 'failure' if rng.random() < 0.05 else 'success'
+            database.log_playbook_run(service, action, status, rng.lognormvariate(-1, 0.6))
+        await asyncio.sleep(0.1)
+
+
+async def _reloading(database, viewers, interval, duration):
+    """Chaque écran relit les statistiques à chaque intervalle."""
+    loop = asyncio.get_running_loop()
+    queries = 0
+
+    def read():
+        database.get_dashboard_stats()
+        database.get_window_stats(database.STATS_WINDOWS['1h'])
+        database.get_runs_after(0, 20)
+
+    deadline = loop.time() + duration
+    while loop.time() < deadline:
+        await asyncio.gather(*[loop.run_in_executor(None, read) for _ in range(viewers)])
+        queries += viewers
+        await asyncio.sleep(interval)
+    return {'requêtes': queries}
+
+
+async def _streaming(live_dashboard, viewers, interval, duration):
+    feed = live_dashboard.DashboardFeed(interval, 15, '1h', 20, 64)
+    feed.start()
+    received = [0] * viewers
+
+    async def watch(i):
+        viewer = await feed.subscribe()
+        try:
+            while True:
+                received[i] += len(await viewer.get(feed))
+        finally:
+            feed.unsubscribe(viewer)
+
+    tasks = [asyncio.ensure_future(watch(i)) for i in range(viewers)]
+    await asyncio.sleep(duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await feed.stop()
+    return {'requêtes': feed.stats_queries, 'ticks': feed.ticks, 'messages': feed.frames,
+            'octets/écran': sum(received) // viewers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--viewers', type=int, nargs='+', default=[1, 10, 100], help="nombres d'écrans ouverts")
+    parser.add_argument('--duration', type=float, default=5.0, help="durée de chaque mesure (secondes)")
+    parser.add_argument('--interval', type=float, default=1.0, help="intervalle de rafraîchissement (secondes)")
+    parser.add_argument('--rate', type=float, default=50, help="runs enregistrés par seconde")
+    parser.add_argument('--history', type=int, default=100000, help="runs déjà en base")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(workdir, 'metrics.db'))
+    os.environ.setdefault('API_RUN_LOG_DIR', os.path.join(workdir, 'run_logs'))
+    sys.path.insert(0, str(ROOT))
+    from app import database, live_dashboard
+    database.init_db()
+    # Historique réparti sur les deux dernières heures, écrit en un lot.
+    rng = random.Random(0)
+    now = time.time()
+    history = []
+    for _ in range(args.history):
+        service, action = rng.choice(ACTIONS)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.uniform(0, 7200)))
+        history.append((timestamp, service, action, 'success', rng.lognormvariate(-1, 0.6), None))
+    with sqlite3.connect(database.METRICS_DB_FILE) as conn:
+        database._write_rows(conn, {'playbook_run': history})
+    database.metrics_writer.start()
+
+    async def measure(mode, viewers):
+        stop = asyncio.Event()
+        writer = asyncio.ensure_future(_record_runs(database, args.rate, stop))
+        cpu = time.process_time()
+        if mode == 'rechargement':
+            counts = await _reloading(database, viewers, args.interval, args.duration)
+        else:
+            counts = await _streaming(live_dashboard, viewers, args.interval, args.duration)
+        cpu = time.process_time() - cpu
+        stop.set()
+        await writer
+        return cpu, counts
+
+    print(f"{'mode':<14} {'écrans':>7} {'CPU':>8}  détails")
+    for viewers in args.viewers:
+        for mode in ('rechargement', 'flux'):
+            cpu, counts = asyncio.run(measure(mode, viewers))
+            details = ', '.join(f"{k} {v}" for k, v in counts.items())
+            print(f"{mode:<14} {viewers:>7} {cpu:>7.2f}s  {details}")
+    database.stop_metrics_writer()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Mesure l'exécution d'une action sur une flotte d'hôtes avec le faux
+ansible-playbook (chaque hôte coûte --delay secondes) :
+
+- avant : un run par hôte, enchaînés (une requête par machine) ;
+- après : un seul run ciblant le groupe ('target'), avec --forks hôtes en
+  parallèle, et le résumé agrégé par hôte.
+
+L'inventaire de la flotte (N hôtes locaux) est généré dans un dossier temporaire.
+
+Usage :
+    python benchmarks/bench_fleet.py [--hosts 4 16] [--forks 1 4 20] [--delay 0.2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _write_inventory(path, hosts):
+    with open(path, 'w') as f:
+        f.write('[local_managed]\n127.0.0.1 ansible_connection=local\n[bench_fleet]\n')
+        for i in range(hosts):
+            f.write(f'bench-{i:03d} ansible_host=127.0.0.1 ansible_connection=local\n')
+
+
+async def _timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start
+
+
+async def _run(services, hosts, forks_list, delay):
+    payload = {'_delay': delay}
+    names = [f'bench-{i:03d}' for i in range(hosts)]
+
+    async def one_by_one():
+        for name in names:
+            result = await services._execute_playbook('webserver', 'status', payload, name, 1)
+            if result.get('return_code') != 0:
+                raise SystemExit(f"Échec du run sur {name} : {result}")
+
+    _, elapsed = await _timed(one_by_one())
+    print(f"{hosts:>6} {'un run par hôte':>22} {elapsed:>8.2f}s")
+    for forks in forks_list:
+        result, elapsed = await _timed(services._execute_playbook('webserver', 'status', payload, 'bench_fleet', forks))
+        statuses = [h['status'] for h in result['result']['hosts'].values()]
+        if len(statuses) != hosts or set(statuses) != {'ok'}:
+            raise SystemExit(f"Résumé par hôte inattendu : {result['result']['hosts']}")
+        print(f"{hosts:>6} {f'un run, forks={forks}':>22} {elapsed:>8.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, nargs='+', default=[4, 16], help="tailles de flotte")
+    parser.add_argument('--forks', type=int, nargs='+', default=[1, 4, 20], help="valeurs de --forks")
+    parser.add_argument('--delay', type=float, default=0.2, help="durée simulée par hôte (secondes)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(workdir, 'metrics.db'))
+    os.environ.setdefault('API_RUN_LOG_DIR', os.path.join(workdir, 'run_logs'))
+    os.environ['ANSIBLE_PLAYBOOK_PATH'] = str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py')
+    os.environ['ANSIBLE_BACKEND'] = 'subprocess'
+    # Les lectures passent par le playbook, pas par le backend natif.
+    os.environ['API_NATIVE_READS'] = '0'
+    sys.path.insert(0, str(ROOT))
+    from app import database, services
+    database.init_db()
+
+    print(f"{'hôtes':>6} {'exécution':>22} {'durée':>9}")
+    for hosts in args.hosts:
+        services.INVENTORY = os.path.join(workdir, f'fleet_{hosts}.ini')
+        _write_inventory(services.INVENTORY, hosts)
+        asyncio.run(_run(services, hosts, args.forks, args.delay))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Mesure la rétention et l'export de l'historique des runs (app/database.py)
+sur une base remplie de --rows runs répartis sur --days jours :
+
+1. Export : débit et pic de mémoire Python (tracemalloc) de export_runs en
+   CSV et en NDJSON, tout l'historique ; le pic ne doit pas dépendre de --rows.
+2. Rétention : pendant que des runs sont écrits en continu (un par
+   --write-interval, transaction par transaction comme le writer de fond),
+   compare prune_history (petits lots puis vacuum incrémental) à une
+   suppression en une requête suivie d'un VACUUM complet, sur deux copies
+   de la même base. La latence maximale d'une écriture montre combien de
+   temps le writer a été bloqué.
+
+Usage :
+    python benchmarks/bench_history.py [--rows 1000000] [--days 60] [--retention 30]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ACTIONS = [('user', 'list_users'), ('user', 'create'), ('webserver', 'status'), ('webserver', 'create')]
+
+
+def _fill(database, rows, days):
+    rng = random.Random(0)
+    now = time.time()
+    conn = sqlite3.connect(database.METRICS_DB_FILE)
+    for start in range(0, rows, 100000):
+        batch = []
+        for i in range(start, min(rows, start + 100000)):
+            service, action = rng.choice(ACTIONS)
+            # Du plus ancien au plus récent, comme des runs enregistrés au fil de l'eau.
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - days * 86400 * (1 - i / rows)))
+            batch.append((timestamp, service, action, 'success', rng.lognormvariate(-1, 0.6), None))
+        with conn:
+            database._write_rows(conn, {'playbook_run': batch})
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def _export(database, fmt):
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in database.export_runs(fmt))
+    elapsed = time.perf_counter() - start
+    # Deuxième passe pour la mémoire : tracemalloc ralentit beaucoup les allocations.
+    tracemalloc.start()
+    for _ in database.export_runs(fmt):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, elapsed, peak
+
+
+class _Writer(threading.Thread):
+    """Écrit un run par intervalle et retient la plus longue écriture."""
+
+    def __init__(self, db_file, interval):
+        super().__init__(daemon=True)
+        self.db_file = db_file
+        self.interval = interval
+        self.latencies = []
+        self.stopping = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_file, timeout=60)
+        while not self.stopping.is_set():
+            start = time.perf_counter()
+            with conn:
+                conn.execute("INSERT INTO playbook_runs (timestamp, service, action, status, duration) "
+                             "VALUES (datetime('now'), 'user', 'create', 'success', 0.1)")
+            self.latencies.append(time.perf_counter() - start)
+            time.sleep(self.interval)
+        conn.close()
+
+
+def _naive_prune(database, db_file):
+    """Mêmes suppressions que prune_history, chacune en une requête, puis un VACUUM complet."""
+    conn = sqlite3.connect(db_file, timeout=60)
+    deleted = {}
+    with conn:
+        for table, column, days, condition in database.RETENTION_TABLES:
+            cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days * 86400))
+            where = f"{column} < ?" + (f" AND {condition}" if condition else "")
+            deleted[table] = conn.execute(f"DELETE FROM {table} WHERE {where}", (cutoff,)).rowcount
+    conn.execute("VACUUM")
+    conn.close()
+    return {'deleted': deleted}
+
+
+def _measure(name, db_file, prune, interval):
+    writer = _Writer(db_file, interval)
+    writer.start()
+    time.sleep(0.2)
+    size_before = os.path.getsize(db_file)
+    start = time.perf_counter()
+    report = prune()
+    elapsed = time.perf_counter() - start
+    writer.stopping.set()
+    writer.join()
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    latencies = sorted(writer.latencies)
+    print(f"{name:<12} {elapsed:>7.2f}s {sum(report['deleted'].values()):>10} "
+          f"{size_before / 2**20:>8.1f} → {os.path.getsize(db_file) / 2**20:>6.1f} Mo "
+          f"{len(latencies):>8} {latencies[len(latencies) // 2] * 1000:>8.1f}ms {latencies[-1] * 1000:>9.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help="runs dans l'historique")
+    parser.add_argument('--days', type=float, default=60, help="période couverte par l'historique (jours)")
+    parser.add_argument('--retention', type=float, default=30, help="rétention des runs bruts (jours)")
+    parser.add_argument('--write-interval', type=float, default=0.005, help="intervalle entre deux écritures (secondes)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['METRICS_DB_FILE'] = os.path.join(workdir, 'metrics.db')
+    os.environ.setdefault('API_RUN_LOG_DIR', os.path.join(workdir, 'run_logs'))
+    os.environ['API_RUNS_RETENTION_DAYS'] = str(args.retention)
+    sys.path.insert(0, str(ROOT))
+    from app import database
+    database.init_db()
+    _fill(database, args.rows, args.days)
+    naive_db = os.path.join(workdir, 'naive.db')
+    shutil.copy(database.METRICS_DB_FILE, naive_db)
+
+    print(f"{'export':<8} {'taille':>10} {'durée':>8} {'lignes/s':>10} {'pic mémoire':>12}")
+    for fmt in database.EXPORT_FORMATS:
+        size, elapsed, peak = _export(database, fmt)
+        print(f"{fmt:<8} {size / 2**20:>8.1f}Mo {elapsed:>7.2f}s {args.rows / elapsed:>10.0f} {peak / 2**20:>10.1f}Mo")
+
+    print(f"\n{'rétention':<12} {'durée':>8} {'supprimés':>10} {'taille de la base':>20} "
+          f"{'écritures':>8} {'médiane':>10} {'max':>11}")
+    _measure('par lots', database.METRICS_DB_FILE, database.prune_history, args.write_interval)
+    _measure('en une fois', naive_db, lambda: _naive_prune(database, naive_db), args.write_interval)
+
+
+if __name__ == '__main__':
+    main()
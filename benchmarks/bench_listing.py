@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Mesure le coût d'une page de GET /api/user sur une grosse liste d'utilisateurs,
+hors exécution du playbook (résultat déjà en cache) :
+
+- avant : liste complète des noms découpée par skip/limit, à chaque requête ;
+- après : index de app/listing.py (construit une fois par résultat), page par
+  curseur, avec et sans filtres.
+
+Usage :
+    python benchmarks/bench_listing.py [--size 50000] [--limit 50] [-n 200]
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _timed(fn, n):
+    timings = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=50000, help="nombre d'utilisateurs")
+    parser.add_argument('--limit', type=int, default=50, help="taille de page")
+    parser.add_argument('-n', type=int, default=200, help="nombre de mesures par scénario")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    from app.listing import build_user_index, listing_cache
+
+    raw = {f'user{i:06d}': ['x', str(1000 + i), '100', f'User {i},,,', f'/home/user{i}',
+                            '/bin/bash' if i % 4 else '/usr/sbin/nologin'] for i in range(args.size)}
+    middle = args.size // 2
+
+    def before():
+        # Ancien comportement : conversion en liste de noms puis découpage.
+        names = list(raw)
+        return names[middle:middle + args.limit]
+
+    start = time.perf_counter()
+    index = listing_cache.get(('user', 'list_users'), raw, build_user_index)
+    build = time.perf_counter() - start
+    cursor = index.page(skip=middle - 1, limit=1)['next_cursor']
+
+    scenarios = [
+        ('skip/limit (avant)', before),
+        ('index, curseur', lambda: listing_cache.get(('user', 'list_users'), raw, build_user_index)
+            .page(cursor=cursor, limit=args.limit)),
+        ('index, préfixe', lambda: index.page(prefix=f'user{middle:06d}'[:-2], limit=args.limit)),
+        ('index, plage d\'uid', lambda: index.page(sort='uid', id_min=1000 + middle, limit=args.limit)),
+        ('index, shell', lambda: index.page(cursor=cursor, match=lambda e: e['shell'] == '/bin/bash',
+                                            limit=args.limit)),
+    ]
+
+    print(f"{args.size} utilisateurs, pages de {args.limit} ; construction de l'index : {build * 1000:.1f}ms")
+    for label, fn in scenarios:
+        print(f"{label:>22} {_timed(fn, args.n) * 1e6:>10.1f}µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Test de charge de l'API : débit et latences (p50/p95/p99) de chaque route,
+de /ws/run, /ws/runs et du dashboard, avec le faux ansible-playbook.
+
+L'API est démarrée avec uvicorn sur un port libre (ou `--url` pour viser une
+instance déjà lancée), avec le faux ansible-playbook qui rejoue les sorties
+enregistrées des rôles (benchmarks/recordings/) : la durée d'un playbook est
+fixée par --delay et la taille des listes par --size. Ce qui est mesuré au-delà
+de --delay est le coût de l'API (résumé, journalisation, cache, sérialisation).
+Le cache des lectures est désactivé, sauf avec --cache.
+
+Le client HTTP/1.1 et WebSocket est écrit avec asyncio seul : aucune dépendance
+en plus de celles de l'API, aucun accès réseau hors de la machine.
+
+Chaque scénario envoie --requests requêtes avec --concurrency clients. Les
+résultats peuvent être enregistrés (--save) dans benchmarks/baselines/, puis
+comparés à une exécution ultérieure (--compare) : les écarts apparaissent dans
+le diff du fichier, et le script sort en erreur si une latence p95 ou le débit
+se dégrade de plus de --tolerance.
+
+Usage :
+    python benchmarks/bench_load.py [--delay 0.05] [--size 200] [--concurrency 8] [--requests 50]
+                                    [--only user. ws.] [--save benchmarks/baselines/default.json]
+                                    [--compare benchmarks/baselines/default.json] [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+SITE = 'bench.local'
+
+
+class HttpClient:
+    """Connexion HTTP/1.1 persistante (keep-alive), une requête à la fois."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode() if body is not None else b''
+        head = (f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+                f'Content-Length: {len(data)}\r\n')
+        if body is not None:
+            head += 'Content-Type: application/json\r\n'
+        self.writer.write(head.encode() + b'\r\n' + data)
+        await self.writer.drain()
+        status, headers = await _read_head(self.reader)
+        if headers.get('transfer-encoding') == 'chunked':
+            payload = b''
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                payload += await self.reader.readexactly(size)
+                await self.reader.readexactly(2)
+                if size == 0:
+                    break
+        else:
+            payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection') == 'close':
+            await self.close()
+        return status, payload
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def _read_head(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connexion fermée par le serveur.")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        key, _, value = line.decode().partition(':')
+        headers[key.strip().lower()] = value.strip().lower()
+    return int(status_line.split()[1]), headers
+
+
+class WebSocketClient:
+    """Client WebSocket minimal (RFC 6455) : trames texte, masquées côté client."""
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+
+    @classmethod
+    async def connect(cls, host, port, path):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n'
+                      f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+        await writer.drain()
+        status, _ = await _read_head(reader)
+        if status != 101:
+            writer.close()
+            raise ConnectionError(f"Poignée de main WebSocket refusée ({status}).")
+        return cls(reader, writer)
+
+    async def send(self, text):
+        data = text.encode()
+        mask = os.urandom(4)
+        if len(data) < 126:
+            head = bytes([0x81, 0x80 | len(data)])
+        elif len(data) < 65536:
+            head = bytes([0x81, 0x80 | 126]) + len(data).to_bytes(2, 'big')
+        else:
+            head = bytes([0x81, 0x80 | 127]) + len(data).to_bytes(8, 'big')
+        self.writer.write(head + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(data)))
+        await self.writer.drain()
+
+    async def recv(self):
+        """Message texte suivant, ou None quand le serveur ferme la connexion."""
+        while True:
+            b0, b1 = await self.reader.readexactly(2)
+            size = b1 & 0x7F
+            if size == 126:
+                size = int.from_bytes(await self.reader.readexactly(2), 'big')
+            elif size == 127:
+                size = int.from_bytes(await self.reader.readexactly(8), 'big')
+            data = await self.reader.readexactly(size)
+            opcode = b0 & 0x0F
+            if opcode == 0x8:
+                return None
+            if opcode in (0x1, 0x0):
+                return data.decode()
+
+    async def close(self):
+        try:
+            self.writer.write(bytes([0x88, 0x80]) + os.urandom(4))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+def _user(action, **fields):
+    return {'action': action, 'username': 'bench', 'password': 'bench', 'group': 'bench', **fields}
+
+
+def _site(action, **fields):
+    return {'action': action, 'server_name': SITE, 'root_dir': f'/var/www/{SITE}', 'port': 8080, **fields}
+
+
+BATCH = {'operations': [{'action': 'create', 'username': f'bench{i}', 'password': 'bench'} for i in range(5)]
+         + [{'action': 'add_group', 'username': f'bench{i}', 'group': 'bench'} for i in range(5)]}
+GROUP_BATCH = {'operations': [{'action': 'create_group', 'group': f'bench{i}'} for i in range(5)]}
+JOB = {'service': 'webserver', 'action': 'status', 'payload': {'server_name': SITE}}
+
+# (nom, méthode, chemin, corps). '{run_id}' et '{job_id}' sont remplacés par un
+# run et un job créés avant les mesures.
+HTTP_SCENARIOS = [
+    ('root', 'GET', '/', None),
+    ('actions', 'GET', '/api/actions', None),
+    ('dashboard.html', 'GET', '/api/dashboard', None),
+    ('dashboard.runtime', 'GET', '/api/dashboard/runtime', None),
+    ('dashboard.stats', 'GET', '/api/dashboard/stats', None),
+    ('dashboard.snapshot', 'GET', '/api/dashboard/snapshot', None),
+    ('dashboard.refresh', 'POST', '/api/dashboard/refresh', None),
+    ('user.list', 'GET', '/api/user?limit=50', None),
+    ('user.groups', 'GET', '/api/user/groups?limit=50', None),
+    ('user.create', 'POST', '/api/user', _user('create')),
+    ('user.password', 'PUT', '/api/user', _user('password')),
+    ('user.delete', 'DELETE', '/api/user', _user('delete')),
+    ('user.group_create', 'POST', '/api/user/group/create', _user('create_group')),
+    ('user.group_add', 'POST', '/api/user/group', _user('add_group')),
+    ('user.group_del', 'DELETE', '/api/user/group', _user('del_group')),
+    ('user.batch', 'POST', '/api/user/batch', BATCH),
+    ('user.group_batch', 'POST', '/api/user/group/batch', GROUP_BATCH),
+    ('webserver.list', 'GET', '/api/webserver', None),
+    ('webserver.create', 'POST', '/api/webserver', _site('create')),
+    ('webserver.status', 'GET', f'/api/webserver/{SITE}/status', None),
+    ('webserver.enable', 'PUT', f'/api/webserver/{SITE}/status', _site('enable')),
+    ('webserver.config', 'GET', f'/api/webserver/{SITE}/config', None),
+    ('webserver.update', 'PUT', f'/api/webserver/{SITE}/config', _site('update')),
+    ('webserver.logs', 'GET', f'/api/webserver/{SITE}/logs', None),
+    ('webserver.logs_stream', 'GET', f'/api/webserver/{SITE}/logs/stream?follow=false', None),
+    ('webserver.stats', 'GET', f'/api/webserver/{SITE}/stats', None),
+    ('webserver.delete', 'DELETE', f'/api/webserver/{SITE}', None),
+    ('jobs.submit', 'POST', '/api/jobs', JOB),
+    ('jobs.list', 'GET', '/api/jobs', None),
+    ('jobs.get', 'GET', '/api/jobs/{job_id}', None),
+    ('runs.list', 'GET', '/api/runs', None),
+    ('runs.get', 'GET', '/api/runs/{run_id}', None),
+    ('runs.log', 'GET', '/api/runs/{run_id}/log', None),
+]
+WS_PARAMS = {'service': 'webserver', 'user_action': 'status', 'payload': {'server_name': SITE}}
+
+
+async def _ws_run(host, port):
+    # Un run complet sur /ws/run : paramètres, puis sortie jusqu'au message de fin.
+    ws = await WebSocketClient.connect(host, port, '/ws/run')
+    try:
+        await ws.send(json.dumps(WS_PARAMS))
+        while True:
+            message = await ws.recv()
+            if message is None or message.startswith('ERREUR'):
+                return False
+            if 'terminée' in message:
+                return True
+    finally:
+        await ws.close()
+
+
+async def _ws_runs(host, port):
+    # Un run lancé et suivi sur /ws/runs jusqu'à son message 'end'.
+    ws = await WebSocketClient.connect(host, port, '/ws/runs')
+    try:
+        await ws.send(json.dumps({'type': 'start', 'ref': 'bench', **WS_PARAMS}))
+        while True:
+            message = await ws.recv()
+            if message is None:
+                return False
+            message = json.loads(message)
+            if message['type'] == 'error':
+                return False
+            if message['type'] == 'end':
+                return message.get('return_code') == 0
+    finally:
+        await ws.close()
+
+
+async def _job_cancel(host, port):
+    # Un job soumis puis annulé aussitôt ; 409 si le job a fini avant l'annulation.
+    client = HttpClient(host, port)
+    try:
+        status, body = await client.request('POST', '/api/jobs', JOB)
+        if status != 202:
+            return False
+        status, _ = await client.request('DELETE', f"/api/jobs/{json.loads(body)['data']['job_id']}")
+        return status in (200, 409)
+    finally:
+        await client.close()
+
+
+# Scénarios de plusieurs échanges, mesurés de bout en bout.
+CALL_SCENARIOS = [('jobs.cancel', _job_cancel), ('ws.run', _ws_run), ('ws.runs', _ws_runs)]
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _report(latencies, errors, elapsed):
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput': round((len(latencies) + errors) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(_percentile(latencies, 0.50)),
+        'p95_ms': ms(_percentile(latencies, 0.95)),
+        'p99_ms': ms(_percentile(latencies, 0.99)),
+    }
+
+
+async def _measure(call, requests, concurrency):
+    # `concurrency` clients se partagent `requests` appels ; chacun garde sa connexion.
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        state = {}
+        try:
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    ok = await call(state)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    ok = False
+                    await _reset(state)
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+        finally:
+            await _reset(state)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _report(latencies, errors, time.perf_counter() - start)
+
+
+async def _reset(state):
+    client = state.pop('client', None)
+    if client is not None:
+        await client.close()
+
+
+async def _setup(host, port):
+    # Un run et un job existants pour les routes /api/runs/{run_id} et /api/jobs/{job_id}.
+    client = HttpClient(host, port)
+    try:
+        await client.request('GET', f'/api/webserver/{SITE}/status')
+        status, body = await client.request('POST', '/api/jobs', JOB)
+        if status != 202:
+            raise SystemExit(f"Soumission du job de préparation refusée ({status}) : {body[:200]!r}")
+        job_id = json.loads(body)['data']['job_id']
+        # Les runs sont enregistrés par lots (METRICS_FLUSH_INTERVAL) : on attend le premier.
+        deadline = time.time() + 10
+        while True:
+            status, body = await client.request('GET', '/api/runs?limit=1')
+            runs = json.loads(body)['data']['runs'] if status == 200 else []
+            if runs:
+                return {'run_id': runs[0]['run_id'], 'job_id': job_id}
+            if time.time() > deadline:
+                raise SystemExit("Aucun run conservé après la requête de préparation.")
+            await asyncio.sleep(0.1)
+    finally:
+        await client.close()
+
+
+async def _run_scenarios(host, port, args):
+    ids = await _setup(host, port)
+    results = {}
+    scenarios = [(name, 'http', (method, path.format(**ids), body)) for name, method, path, body in HTTP_SCENARIOS]
+    scenarios += [(name, 'call', fn) for name, fn in CALL_SCENARIOS]
+    if args.only:
+        scenarios = [s for s in scenarios if any(s[0].startswith(prefix) for prefix in args.only)]
+
+    print(f"{'scénario':<24} {'requêtes':>8} {'erreurs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, kind, spec in scenarios:
+        if kind == 'http':
+            method, path, body = spec
+
+            async def call(state, method=method, path=path, body=body):
+                client = state.setdefault('client', HttpClient(host, port))
+                status, _ = await client.request(method, path, body)
+                return 200 <= status < 300
+        else:
+            async def call(state, fn=spec):
+                return await fn(host, port)
+
+        report = await _measure(call, args.requests, args.concurrency)
+        results[name] = report
+        print(f"{name:<24} {report['requests']:>8} {report['errors']:>7} {report['throughput'] or 0:>8.1f} "
+              f"{report['p50_ms'] or 0:>8.1f} {report['p95_ms'] or 0:>8.1f} {report['p99_ms'] or 0:>8.1f}")
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _write_access_log(workdir, lines=1000):
+    # Log d'accès du site de test, au format 'api_vhost', pour /logs/stream et /stats.
+    start = int(time.time()) - 3600
+    with open(os.path.join(workdir, f'{SITE}.access.log'), 'w') as f:
+        for i in range(lines):
+            ts = time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(start + i * 3600 // lines))
+            f.write(f'10.0.0.{i % 256} - - [{ts}] "GET /page{i % 20} HTTP/1.1" {404 if i % 10 == 0 else 200} '
+                    f'{512 + i} "-" "Mozilla/5.0 (X11; Linux x86_64)" 0.{i % 100:03d} -\n')
+
+
+def _start_server(args, workdir):
+    port = _free_port()
+    _write_access_log(workdir)
+    env = dict(
+        os.environ,
+        ANSIBLE_PLAYBOOK_PATH=str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py'),
+        ANSIBLE_BACKEND='subprocess',
+        # Les lectures passent par le playbook, pas par le backend natif.
+        API_NATIVE_READS='0',
+        FAKE_ANSIBLE_RECORDINGS=str(ROOT / 'benchmarks' / 'recordings'),
+        FAKE_ANSIBLE_DELAY=str(args.delay),
+        FAKE_ANSIBLE_SIZE=str(args.size),
+        METRICS_DB_FILE=os.path.join(workdir, 'metrics.db'),
+        API_RUN_LOG_DIR=os.path.join(workdir, 'run_logs'),
+        API_NGINX_LOG_DIR=workdir,
+        API_CACHE_ENABLED='1' if args.cache else '0',
+        API_ACCESS_LOG_INTERVAL='0',
+        # Les requêtes en trop attendent un créneau au lieu d'être refusées.
+        API_PLAYBOOK_MAX_QUEUE=str(max(32, args.concurrency * 4)),
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--no-access-log'],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("uvicorn s'est arrêté au démarrage (l'API et uvicorn sont-ils installés ?).")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return server, port
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise SystemExit("L'API n'a pas répondu dans les 30 secondes.")
+
+
+def _compare(baseline, results, tolerance):
+    """Affiche les écarts avec la référence ; retourne les scénarios dégradés."""
+    regressions = []
+    print(f"\n{'scénario':<24} {'p95 réf.':>9} {'p95':>9} {'écart':>8} {'req/s réf.':>11} {'req/s':>8}")
+    for name, report in results.items():
+        ref = baseline.get('scenarios', {}).get(name)
+        if not ref or not ref.get('p95_ms') or not report.get('p95_ms'):
+            continue
+        delta = report['p95_ms'] / ref['p95_ms'] - 1
+        slower = delta > tolerance or (report['throughput'] or 0) < ref['throughput'] * (1 - tolerance)
+        if slower or report['errors'] > ref['errors']:
+            regressions.append(name)
+        print(f"{name:<24} {ref['p95_ms']:>9.1f} {report['p95_ms']:>9.1f} {delta:>+7.0%} "
+              f"{ref['throughput']:>11.1f} {report['throughput']:>8.1f}{'  <-' if name in regressions else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="API déjà démarrée (ex: http://127.0.0.1:8000) au lieu d'une instance locale")
+    parser.add_argument('--delay', type=float, default=0.05, help="durée simulée d'un playbook (s)")
+    parser.add_argument('--size', type=int, default=200, help="éléments des listes retournées par le faux playbook")
+    parser.add_argument('--concurrency', type=int, default=8, help="clients simultanés")
+    parser.add_argument('--requests', type=int, default=50, help="requêtes par scénario")
+    parser.add_argument('--only', nargs='+', help="préfixes des scénarios à lancer (ex: user. ws.)")
+    parser.add_argument('--cache', action='store_true', help="garder le cache des lectures")
+    parser.add_argument('--save', help="fichier où enregistrer les résultats (référence)")
+    parser.add_argument('--compare', help="fichier de référence à comparer")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="dégradation tolérée (p95 et débit)")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        server, port = _start_server(args, tempfile.mkdtemp())
+        host = '127.0.0.1'
+    try:
+        results = asyncio.run(_run_scenarios(host, port, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        document = {
+            'parameters': {k: getattr(args, k) for k in ('delay', 'size', 'concurrency', 'requests', 'cache')},
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpus': os.cpu_count()},
+            'scenarios': results,
+        }
+        # Une clé par ligne, triées : une régression se lit dans le diff du fichier.
+        Path(args.save).write_text(json.dumps(document, indent=2, sort_keys=True, ensure_ascii=False) + '\n')
+        print(f"\nRésultats enregistrés dans {args.save}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline.get('parameters') != {k: getattr(args, k) for k in baseline.get('parameters', {})}:
+            print("ATTENTION : paramètres différents de ceux de la référence.")
+        regressions = _compare(baseline, results, args.tolerance)
+        if regressions:
+            raise SystemExit(f"\nDégradation au-delà de {args.tolerance:.0%} : {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Mesure le coût de l'instrumentation de /metrics (app/metrics.py) sur les
+chemins chauds, hors réseau et sans FastAPI :
+
+- une observation d'histogramme et un incrément de compteur ;
+- une requête ASGI minimale avec et sans MetricsMiddleware ;
+- l'analyse d'une sortie ndjson avec et sans chronométrage de chaque ligne ;
+- l'export complet (render) avec une série par route.
+
+Usage :
+    python benchmarks/bench_metrics.py [-n 200000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+# Chaque mesure est répétée : on garde la plus rapide, la moins perturbée.
+REPEAT = 5
+
+
+def _per_op(fn, n):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(n)
+        best = min(best, time.perf_counter() - start)
+    return best / n * 1e9
+
+
+class _Route:
+    path = '/api/webserver/{server_name}/status'
+
+
+async def _app(scope, receive, send):
+    # Application ASGI minimale : la route est connue après le routage, comme avec FastAPI.
+    scope['route'] = _Route
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'{}'})
+
+
+async def _requests(app, n):
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/webserver/site.conf/status'}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        pass
+
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for _ in range(n):
+            await app(dict(scope), receive, send)
+        best = min(best, time.perf_counter() - start)
+    return best / n * 1e9
+
+
+def _ndjson_lines(hosts):
+    lines = []
+    for i in range(hosts):
+        lines.append(json.dumps({'event': 'result', 'status': 'ok', 'task': 'Afficher le statut du site',
+                                 'host': f'host-{i}', 'start': 1.0, 'end': 2.0,
+                                 'result': {'changed': False, 'msg': json.dumps({'status': 'enabled'})}}))
+    lines.append(json.dumps({'event': 'stats', 'stats': {f'host-{i}': {'ok': 1} for i in range(hosts)}}))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=200000, help="nombre d'opérations par mesure")
+    args = parser.parse_args()
+
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(tempfile.mkdtemp(), 'metrics.db'))
+    sys.path.insert(0, str(ROOT))
+    from app import metrics
+    from app.services import SummaryBuilder
+
+    histogram = metrics.Histogram('bench_histogram_seconds', 'bench', ('route',))
+    counter = metrics.Counter('bench_total', 'bench', ('route', 'status'))
+
+    def observe(n):
+        for i in range(n):
+            histogram.observe(0.012, '/api/user')
+
+    def inc(n):
+        for i in range(n):
+            counter.inc('/api/user', '200')
+
+    def baseline(n):
+        for i in range(n):
+            pass
+
+    loop_cost = _per_op(baseline, args.n)
+    print(f"{'histogramme : observe':<40} {_per_op(observe, args.n) - loop_cost:>8.0f} ns")
+    print(f"{'compteur : inc':<40} {_per_op(inc, args.n) - loop_cost:>8.0f} ns")
+
+    bare = asyncio.run(_requests(_app, args.n // 4))
+    wrapped = asyncio.run(_requests(metrics.MetricsMiddleware(_app), args.n // 4))
+    print(f"{'requête ASGI sans middleware':<40} {bare:>8.0f} ns")
+    print(f"{'requête ASGI avec MetricsMiddleware':<40} {wrapped:>8.0f} ns  (+{wrapped - bare:.0f} ns par requête)")
+
+    lines = _ndjson_lines(50)
+    runs = max(args.n // 500, 10)
+
+    def parse_once(timed):
+        start = time.perf_counter()
+        for _ in range(runs):
+            builder = SummaryBuilder()
+            parse_time = 0.0
+            for line in lines:
+                if timed:
+                    t = time.perf_counter()
+                    builder.feed(line)
+                    parse_time += time.perf_counter() - t
+                else:
+                    builder.feed(line)
+            if timed:
+                metrics.SUMMARY_PARSE.observe(parse_time, 'ndjson')
+        return (time.perf_counter() - start) / runs * 1e6
+
+    # Mesures alternées, pour que les deux variantes subissent les mêmes perturbations.
+    plain, timed = float('inf'), float('inf')
+    for _ in range(REPEAT):
+        plain, timed = min(plain, parse_once(False)), min(timed, parse_once(True))
+    print(f"{'analyse ndjson (51 lignes), sans mesure':<40} {plain:>8.1f} µs")
+    print(f"{'analyse ndjson (51 lignes), mesurée':<40} {timed:>8.1f} µs  ({(timed / plain - 1) * 100:+.1f} %)")
+
+    for i in range(40):
+        for status in ('200', '404', '500'):
+            metrics.HTTP_REQUEST_DURATION.observe(0.01 * i, 'GET', f'/api/route/{i}', status)
+    start = time.perf_counter()
+    text = metrics.render()
+    print(f"{'export (40 routes)':<40} {(time.perf_counter() - start) * 1000:>8.2f} ms  ({len(text)} octets)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Vérifie et mesure le backend natif des lectures sur l'hôte local
+(app/native_backend.py) face au playbook.
+
+1. Parité : chaque lecture est exécutée par les deux backends sur un dossier
+   Nginx de test (sites configurés, site activé par lien symbolique, fichier
+   caché, site absent) et sur les utilisateurs et groupes de la machine ; les
+   réponses doivent être identiques, horodatages et identifiants de run exclus.
+   Nécessite un vrai Ansible (ANSIBLE_PLAYBOOK_PATH) et le groupe
+   [local_managed] de l'inventaire en connexion locale.
+2. Latence : médiane de chaque lecture avec les deux backends.
+
+Avec --fake, le playbook est le faux ansible-playbook (benchmarks/recordings) :
+seule la latence est mesurée, les résultats rejoués ne viennent pas du dossier
+de test.
+
+Avec --offline, la parité est vérifiée sans Ansible, face aux enregistrements :
+le dossier Nginx de test contient les sites que rejoue le faux playbook, et
+les bases passwd/group lues par le backend natif sont remplacées par ses
+utilisateurs et groupes. Pour chaque lecture, la sortie du backend natif et
+celle rejouée depuis l'enregistrement du rôle doivent avoir les mêmes tâches
+(nom, module, statut) et donner le même summarize(), champ par champ.
+
+Usage :
+    python benchmarks/bench_native.py [--runs 20] [--no-vault]
+    python benchmarks/bench_native.py --fake [--delay 0.05]
+    python benchmarks/bench_native.py --offline [--size 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SITE_CONFIG = "server {\n    listen 80;\n    server_name parity.fr;\n    root /var/www/parity;\n}\n"
+# (service, action, payload) comparés et mesurés.
+READS = [
+    ('webserver', 'list', {}),
+    ('webserver', 'inventory', {}),
+    ('webserver', 'status', {'server_name': 'parity.fr'}),
+    ('webserver', 'status', {'server_name': 'disabled.fr'}),
+    ('webserver', 'config', {'server_name': 'parity.fr'}),
+    ('webserver', 'config', {'server_name': 'missing.fr'}),
+    ('user', 'list_users', {}),
+    ('user', 'list_groups', {}),
+    ('user', 'list_groups', {'username': 'root'}),
+    ('user', 'list_groups', {'username': 'no-such-user-parity'}),
+]
+# Champs qui diffèrent d'un run à l'autre.
+VOLATILE = {'start', 'end', 'duration', 'run_id', 'stderr'}
+# Lectures comparées aux enregistrements (--offline) : celles que le faux playbook
+# rejoue, sur les sites qu'il génère (site0.conf activé, site1.conf désactivé...).
+OFFLINE_READS = [
+    ('webserver', 'list', {}),
+    ('webserver', 'inventory', {}),
+    ('webserver', 'status', {'server_name': 'site0'}),
+    ('webserver', 'config', {'server_name': 'site1'}),
+    ('user', 'list_users', {}),
+    ('user', 'list_groups', {}),
+    ('user', 'list_groups', {'username': 'user1'}),
+]
+# Lectures de dossiers (module find) : l'ordre des noms est celui du système de fichiers.
+UNORDERED = {('webserver', 'list'), ('webserver', 'inventory')}
+
+
+def _fixture(root):
+    """Dossier Nginx de test : deux sites configurés, un seul activé."""
+    available, enabled = os.path.join(root, 'sites-available'), os.path.join(root, 'sites-enabled')
+    os.makedirs(available)
+    os.makedirs(enabled)
+    for name in ('parity.fr', 'disabled.fr'):
+        with open(os.path.join(available, f'{name}.conf'), 'w') as f:
+            f.write(SITE_CONFIG.replace('parity.fr', name))
+    with open(os.path.join(available, '.parity.fr.conf.swp'), 'w') as f:
+        f.write('')
+    os.mkdir(os.path.join(available, 'archives'))
+    os.symlink(os.path.join(available, 'parity.fr.conf'), os.path.join(enabled, 'parity.fr.conf'))
+
+
+def _recorded_fixture(root, size):
+    """Dossier Nginx des sites rejoués par le faux playbook : site<i>.conf, un sur deux activé."""
+    available, enabled = os.path.join(root, 'sites-available'), os.path.join(root, 'sites-enabled')
+    os.makedirs(available)
+    os.makedirs(enabled)
+    for i in range(size):
+        with open(os.path.join(available, f'site{i}.conf'), 'w') as f:
+            f.write(f"server {{ server_name site{i}; }}")
+        if i % 2 == 0:
+            os.symlink(os.path.join(available, f'site{i}.conf'), os.path.join(enabled, f'site{i}.conf'))
+
+
+def _normalize(value, unordered=False):
+    if isinstance(value, dict):
+        return {k: _normalize(v, unordered) for k, v in value.items() if k not in VOLATILE}
+    if isinstance(value, list):
+        values = [_normalize(v, unordered) for v in value]
+        return sorted(values) if unordered and all(isinstance(v, str) for v in values) else values
+    return value
+
+
+def _tasks(output):
+    """Tâches d'une sortie du callback 'json' : nom, module et statut sur chaque hôte."""
+    return [(task['task']['name'], host, res.get('action'),
+             {k: res[k] for k in ('changed', 'skipped', 'failed', 'unreachable') if k in res})
+            for play in output['plays'] for task in play['tasks'] for host, res in task['hosts'].items()]
+
+
+def _diff(expected, actual, path='$'):
+    """Premier écart entre deux réponses, ou None."""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual), key=str):
+            if key not in expected or key not in actual:
+                return f"{path}.{key} : présent d'un seul côté"
+            found = _diff(expected[key], actual[key], f'{path}.{key}')
+            if found:
+                return found
+        return None
+    if isinstance(expected, list) and isinstance(actual, list) and len(expected) == len(actual):
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            found = _diff(a, b, f'{path}[{i}]')
+            if found:
+                return found
+        return None
+    return None if expected == actual else f"{path} : {expected!r} (playbook) != {actual!r} (natif)"
+
+
+async def _run(services, native, service, action, payload):
+    services.native_backend.enabled = native
+    start = time.perf_counter()
+    result = await services._execute_playbook(service, action, payload)
+    return time.perf_counter() - start, result
+
+
+async def _parity(services):
+    failures = 0
+    for service, action, payload in READS:
+        _, expected = await _run(services, False, service, action, payload)
+        _, actual = await _run(services, True, service, action, payload)
+        found = _diff(_normalize(expected), _normalize(actual))
+        failures += found is not None
+        print(f"{'ÉCART' if found else 'ok':<6} {service} {action} {payload}" + (f"\n       {found}" if found else ''))
+    return failures
+
+
+def _offline_parity(services, native_backend, size):
+    """Backend natif face aux enregistrements des rôles, sans Ansible."""
+    sys.path.insert(0, str(ROOT / 'benchmarks'))
+    import fake_ansible_playbook as fake
+    native_backend._passwd = lambda: fake._display('list_users', {}, size)[2]
+    native_backend._group = lambda: fake._display('list_groups', {}, size)[2]
+    native_backend._id_groups = lambda username: ' '.join(
+        fake._display('list_groups', {'username': username}, size)[2])
+    failures = 0
+    for service, action, payload in OFFLINE_READS:
+        with open(ROOT / 'benchmarks' / 'recordings' / f'{fake.ROLES[service]}.json') as f:
+            recording = json.load(f)
+        tasks, stats, _ = fake._replay(recording, action, payload, size, [fake.HOST], set(), set())
+        expected = {'plays': [{'play': {'name': native_backend.DEFAULT_TARGET}, 'tasks': tasks}], 'stats': stats}
+        _, actual = services.native_backend.run(service, action, payload, fake.HOST)
+        found = _diff(_tasks(expected), _tasks(actual), '$.tasks')
+        if not found:
+            unordered = (service, action) in UNORDERED
+            found = _diff(_normalize(services.summarize(expected), unordered),
+                          _normalize(services.summarize(actual), unordered))
+        failures += found is not None
+        print(f"{'ÉCART' if found else 'ok':<6} {service} {action} {payload}" + (f"\n       {found}" if found else ''))
+    return failures
+
+
+async def _latency(services, runs):
+    print(f"\n{'lecture':<40} {'playbook':>10} {'natif':>10} {'rapport':>8}")
+    for service, action, payload in READS:
+        timings = {}
+        for native in (False, True):
+            timings[native] = statistics.median(
+                [(await _run(services, native, service, action, payload))[0] for _ in range(runs)]
+            )
+        label = f"{service} {action} {payload or ''}".strip()
+        print(f"{label[:40]:<40} {timings[False] * 1000:>8.1f}ms {timings[True] * 1000:>8.2f}ms "
+              f"{timings[False] / timings[True]:>7.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help="runs par lecture et par backend (médiane)")
+    parser.add_argument('--fake', action='store_true', help="faux ansible-playbook : latence seulement")
+    parser.add_argument('--delay', type=float, default=0.05, help="délai d'un run du faux playbook (secondes)")
+    parser.add_argument('--offline', action='store_true', help="parité seulement, face aux enregistrements des rôles")
+    parser.add_argument('--size', type=int, default=20, help="sites, utilisateurs et groupes rejoués avec --offline")
+    parser.add_argument('--no-vault', action='store_true', help="lance ansible-playbook sans fichier de mot de passe du coffre")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    if args.offline:
+        _recorded_fixture(os.path.join(workdir, 'nginx'), args.size)
+    else:
+        _fixture(os.path.join(workdir, 'nginx'))
+    os.environ['API_NGINX_CONF_DIR'] = os.path.join(workdir, 'nginx')
+    os.environ['API_NATIVE_READS'] = '1'
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(workdir, 'metrics.db'))
+    os.environ.setdefault('API_RUN_LOG_DIR', os.path.join(workdir, 'run_logs'))
+    os.environ['ANSIBLE_BACKEND'] = 'subprocess'
+    if args.fake:
+        os.environ['ANSIBLE_PLAYBOOK_PATH'] = str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py')
+        os.environ['FAKE_ANSIBLE_RECORDINGS'] = str(ROOT / 'benchmarks' / 'recordings')
+        os.environ['FAKE_ANSIBLE_DELAY'] = str(args.delay)
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+    if args.offline:
+        from app import native_backend, services
+        failures = _offline_parity(services, native_backend, args.size)
+        if failures:
+            raise SystemExit(f"\n{failures} lecture(s) différente(s) des enregistrements.")
+        return
+    from app import database, services
+    database.init_db()
+    # Comme dans l'API : les métriques sont écrites par le thread de fond.
+    database.metrics_writer.start()
+    if args.no_vault:
+        services.VAULT_OPTS = []
+    if services.native_backend.local_host('user', 'list_users') is None:
+        raise SystemExit(f"La cible par défaut de {services.INVENTORY} n'est pas l'hôte local : rien à comparer.")
+
+    failures = 0
+    if not args.fake:
+        failures = asyncio.run(_parity(services))
+    asyncio.run(_latency(services, args.runs))
+    database.stop_metrics_writer()
+    if failures:
+        raise SystemExit(f"\n{failures} lecture(s) différente(s) entre les deux backends.")
+
+
+if __name__ == '__main__':
+    main()
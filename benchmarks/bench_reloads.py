@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compte les rechargements de Nginx d'une rafale de modifications de sites, avec
+le faux ansible-playbook qui rejoue le rôle nginx_vhost :
+
+- unitaire : chaque appel dans son propre run (API_VHOST_RELOAD_WINDOW=0),
+             un rechargement par run ;
+- regroupé : les appels reçus pendant la fenêtre --window forment un lot
+             (app/vhost_changes.py), un rechargement par lot ;
+- lot      : toute la rafale envoyée en une requête /api/webserver/changeset.
+
+Les appels sont lancés en même temps, comme une rafale de requêtes HTTP, et
+passent par app.services (cache compris). Un rechargement est une exécution
+du handler 'Reload Nginx' ou de la tâche 'Lot de sites : recharger Nginx'
+(table run_task_timings).
+
+Usage :
+    python benchmarks/bench_reloads.py [-n 50] [--window 0.2] [--delay 0.05] [--task-delay 0.01]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+RELOAD_TASKS = ('Reload Nginx', 'Lot de sites : recharger Nginx')
+
+
+def _operations(n):
+    # Une activation ou désactivation par site, sur des sites tous différents.
+    return [('enable' if i % 2 else 'disable', {'server_name': f'site{i}.fr', 'action': 'enable' if i % 2 else 'disable'})
+            for i in range(n)]
+
+
+def _counts(database):
+    """Runs webserver et rechargements enregistrés jusqu'ici."""
+    with sqlite3.connect(database.METRICS_DB_FILE) as conn:
+        runs = conn.execute("SELECT COUNT(*) FROM playbook_runs WHERE service = 'webserver'").fetchone()[0]
+        reloads = conn.execute(
+            f"SELECT COUNT(*) FROM run_task_timings WHERE task IN ({', '.join('?' * len(RELOAD_TASKS))}) "
+            "AND status != 'skipped'", RELOAD_TASKS
+        ).fetchone()[0]
+    return runs, reloads
+
+
+async def _burst(batcher, operations):
+    results = await asyncio.gather(*[batcher.submit(action, payload) for action, payload in operations])
+    return sum(1 for r in results if r.get('return_code') != 0)
+
+
+async def _changeset(services, operations):
+    ops = [{'id': i, **payload} for i, (_, payload) in enumerate(operations)]
+    result = await services.run_playbook('webserver', 'changeset', {'operations': ops})
+    return int(result.get('return_code') != 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=50, help="nombre de modifications de la rafale")
+    parser.add_argument('--window', type=float, default=0.2, help="fenêtre de regroupement (secondes)")
+    parser.add_argument('--delay', type=float, default=0.05, help="délai fixe d'un run (secondes)")
+    parser.add_argument('--task-delay', type=float, default=0.01, help="durée d'une tâche (secondes)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(workdir, 'metrics.db'))
+    os.environ.setdefault('API_RUN_LOG_DIR', os.path.join(workdir, 'run_logs'))
+    os.environ['ANSIBLE_PLAYBOOK_PATH'] = str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py')
+    os.environ['ANSIBLE_BACKEND'] = 'subprocess'
+    os.environ['FAKE_ANSIBLE_RECORDINGS'] = str(ROOT / 'benchmarks' / 'recordings')
+    os.environ['FAKE_ANSIBLE_DELAY'] = str(args.delay)
+    os.environ['FAKE_ANSIBLE_TASK_DELAY'] = str(args.task_delay)
+    # Toute la rafale attend son créneau au lieu d'être refusée.
+    os.environ['API_PLAYBOOK_MAX_QUEUE'] = str(args.n * 2)
+    sys.path.insert(0, str(ROOT))
+    from app import database, services
+    from app.vhost_changes import MAX_CHANGESET_SIZE, ReloadBatcher
+    database.init_db()
+
+    modes = [
+        ('unitaire', lambda ops: _burst(ReloadBatcher(0, MAX_CHANGESET_SIZE), ops)),
+        ('regroupé', lambda ops: _burst(ReloadBatcher(args.window, MAX_CHANGESET_SIZE), ops)),
+        ('lot', lambda ops: _changeset(services, ops)),
+    ]
+    print(f"{'mode':<10} {'runs':>6} {'rechargements':>14} {'échecs':>7} {'durée':>9}")
+    for name, run in modes:
+        runs_before, reloads_before = _counts(database)
+        start = time.perf_counter()
+        failed = asyncio.run(run(_operations(args.n)))
+        elapsed = time.perf_counter() - start
+        runs, reloads = _counts(database)
+        print(f"{name:<10} {runs - runs_before:>6} {reloads - reloads_before:>14} {failed:>7} {elapsed:>8.2f}s")
+
+
+if __name__ == '__main__':
+    main()
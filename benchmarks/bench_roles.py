@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Mesure le gain des fichiers de tâches par action (include_tasks sur
+`user_action`) sur la latence de l'API, avec le faux ansible-playbook qui
+rejoue les rôles enregistrés :
+
+- legacy   : toutes les tâches dans main.yml, gardées par 'when' ; chaque run
+             évalue et ignore les tâches des autres actions, et les sites
+             installent Nginx (apt update_cache) à chaque appel ;
+- dispatch : seul le fichier de l'action est chargé, et la préparation de
+             l'hôte n'est faite qu'une fois (hôte déjà préparé ici).
+
+Chaque tâche exécutée sur l'hôte coûte --task-delay secondes (fois son 'cost'
+enregistré), une tâche ignorée SKIP_COST fois moins. Les runs passent par
+app.services, hors cache, comme un appel HTTP.
+
+Usage :
+    python benchmarks/bench_roles.py [--runs 10] [--delay 0.02] [--task-delay 0.02]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SITE = {'server_name': 'bench.fr', 'port': 80, 'root_dir': '/var/www/bench'}
+# (service, action, payload) mesurés ; les lectures d'abord.
+ACTIONS = [
+    ('webserver', 'status', {'server_name': 'bench.fr'}),
+    ('webserver', 'config', {'server_name': 'bench.fr'}),
+    ('webserver', 'logs', {'server_name': 'bench.fr'}),
+    ('webserver', 'list', {}),
+    ('webserver', 'inventory', {}),
+    ('user', 'list_users', {}),
+    ('user', 'list_groups', {}),
+    ('webserver', 'update', SITE),
+    ('user', 'create', {'username': 'bench', 'password': 'x'}),
+]
+
+
+async def _measure(services, service, action, payload, runs):
+    latencies, skipped = [], 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = await services._execute_playbook(service, action, payload)
+        latencies.append(time.perf_counter() - start)
+        if result.get('return_code') != 0:
+            raise SystemExit(f"Échec de {service} {action} : {result}")
+        skipped = sum(s.get('skipped', 0) for s in result['result']['stats'].values())
+    return statistics.median(latencies), skipped
+
+
+async def _run(services, layout, runs):
+    services.ENV['FAKE_ANSIBLE_LAYOUT'] = layout
+    return {(service, action): await _measure(services, service, action, payload, runs)
+            for service, action, payload in ACTIONS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help="runs par action (médiane)")
+    parser.add_argument('--delay', type=float, default=0.02, help="délai fixe d'un run (secondes)")
+    parser.add_argument('--task-delay', type=float, default=0.02, help="durée d'une tâche (secondes)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(workdir, 'metrics.db'))
+    os.environ.setdefault('API_RUN_LOG_DIR', os.path.join(workdir, 'run_logs'))
+    os.environ['ANSIBLE_PLAYBOOK_PATH'] = str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py')
+    os.environ['ANSIBLE_BACKEND'] = 'subprocess'
+    # Les lectures passent par le playbook, pas par le backend natif.
+    os.environ['API_NATIVE_READS'] = '0'
+    os.environ['FAKE_ANSIBLE_RECORDINGS'] = str(ROOT / 'benchmarks' / 'recordings')
+    os.environ['FAKE_ANSIBLE_DELAY'] = str(args.delay)
+    os.environ['FAKE_ANSIBLE_TASK_DELAY'] = str(args.task_delay)
+    sys.path.insert(0, str(ROOT))
+    from app import database, services
+    database.init_db()
+
+    before = asyncio.run(_run(services, 'legacy', args.runs))
+    after = asyncio.run(_run(services, 'dispatch', args.runs))
+
+    print(f"{'action':<24} {'legacy':>10} {'ignorées':>9} {'dispatch':>10} {'ignorées':>9} {'gain':>7}")
+    for service, action, _ in ACTIONS:
+        (old, old_skipped), (new, new_skipped) = before[(service, action)], after[(service, action)]
+        print(f"{service + ' ' + action:<24} {old * 1000:>8.0f}ms {old_skipped:>9} "
+              f"{new * 1000:>8.0f}ms {new_skipped:>9} {(1 - new / old) * 100:>6.0f}%")
+
+
+if __name__ == '__main__':
+    main()
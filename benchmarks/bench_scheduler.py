@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Test de charge de l'ordonnanceur des runs (app/scheduler.py) avec le faux
+ansible-playbook, sous une charge mélangée lancée en même temps :
+
+- écritures unitaires sur --users utilisateurs et --sites sites, tirés au
+  hasard (plusieurs écritures visent donc la même ressource) ;
+- lots d'utilisateurs ('batch') qui recouvrent ces mêmes utilisateurs ;
+- lectures interactives (list_users, sans cache).
+
+Deux modes, sur la même charge :
+
+- ordonnanceur : verrous par ressource et créneaux accordés par priorité ;
+- sans verrous : limiteur seul, créneaux accordés dans l'ordre d'arrivée
+                 (comportement précédent).
+
+Pour chaque run, l'intervalle pendant lequel il tient son créneau est relevé.
+Vérifications : deux runs qui modifient une même ressource ne se chevauchent
+jamais, et ils s'exécutent dans leur ordre d'arrivée. Le débit et l'attente
+des lectures et des lots sont affichés pour les deux modes.
+
+Usage :
+    python benchmarks/bench_scheduler.py [-n 300] [--users 10] [--sites 5] [--delay 0.05]
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _workload(n, users, sites, seed=0):
+    """(service, action, payload) dans l'ordre d'arrivée."""
+    rng = random.Random(seed)
+    ops = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.4:
+            action = rng.choice(['create', 'password', 'add_group'])
+            payload = {'username': f'user{rng.randrange(users)}'}
+            if action == 'add_group':
+                payload['group'] = f'group{rng.randrange(3)}'
+            ops.append(('user', action, payload))
+        elif kind < 0.6:
+            ops.append(('webserver', rng.choice(['enable', 'disable']), {'server_name': f'site{rng.randrange(sites)}.fr'}))
+        elif kind < 0.7:
+            members = rng.sample(range(users), min(users, 4))
+            ops.append(('user', 'batch', {'operations': [
+                {'id': j, 'action': 'create', 'username': f'user{u}'} for j, u in enumerate(members)
+            ]}))
+        else:
+            ops.append(('user', 'list_users', {}))
+    return ops
+
+
+def _check(records):
+    """Chevauchements et inversions d'ordre entre runs qui partagent une ressource."""
+    by_resource = collections.defaultdict(list)
+    for seq, resources, start, end in records:
+        for resource in resources:
+            by_resource[resource].append((seq, start, end))
+    overlaps = inversions = 0
+    for runs in by_resource.values():
+        runs.sort(key=lambda r: r[1])
+        for (seq_a, _, end_a), (seq_b, start_b, _) in zip(runs, runs[1:]):
+            overlaps += start_b < end_a
+            inversions += seq_b < seq_a
+    return overlaps, inversions
+
+
+async def _run(services, scheduler, ops, locks, stagger):
+    records = []
+    original = services.scheduled_slot
+    if not locks:
+        # Limiteur seul : aucune ressource à attendre.
+        services.action_resources = lambda *_: []
+
+    @contextlib.asynccontextmanager
+    async def recorded(service, action, payload, priority):
+        async with original(service, action, payload, priority if locks else 'write'):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                records.append((payload.get('_seq'), scheduler.action_resources(service, action, payload),
+                                start, time.perf_counter()))
+
+    services.scheduled_slot = recorded
+    waits = collections.defaultdict(list)
+
+    async def one(seq, service, action, payload):
+        await asyncio.sleep(seq * stagger)
+        start = time.perf_counter()
+        result = await services.run_playbook(service, action, {**payload, '_seq': seq}, use_cache=False)
+        assert result['return_code'] == 0, result
+        is_read = (service, action) in services.READ_ACTIONS
+        waits[scheduler.action_priority((service, action), is_read)].append(time.perf_counter() - start)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[one(seq, *op) for seq, op in enumerate(ops)])
+        elapsed = time.perf_counter() - start
+    finally:
+        services.scheduled_slot = original
+        services.action_resources = scheduler.action_resources
+    return records, waits, elapsed
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=300, help="nombre de requêtes")
+    parser.add_argument('--users', type=int, default=10, help="utilisateurs visés par les écritures")
+    parser.add_argument('--sites', type=int, default=5, help="sites visés par les écritures")
+    parser.add_argument('--delay', type=float, default=0.05, help="durée d'un run du faux playbook (secondes)")
+    parser.add_argument('--stagger', type=float, default=0.002, help="écart entre deux arrivées (secondes)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(workdir, 'metrics.db'))
+    os.environ.setdefault('API_RUN_LOG_DIR', os.path.join(workdir, 'run_logs'))
+    os.environ['ANSIBLE_PLAYBOOK_PATH'] = str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py')
+    os.environ['ANSIBLE_BACKEND'] = 'subprocess'
+    os.environ['FAKE_ANSIBLE_DELAY'] = str(args.delay)
+    # Les lectures passent par le playbook, pas par le backend natif.
+    os.environ['API_NATIVE_READS'] = '0'
+    # Toute la charge attend son créneau au lieu d'être refusée.
+    os.environ['API_PLAYBOOK_MAX_QUEUE'] = str(args.n * 2)
+    os.environ['API_PLAYBOOK_QUEUE_TIMEOUT'] = '600'
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+    from app import database, scheduler, services
+    database.init_db()
+
+    ops = _workload(args.n, args.users, args.sites)
+    print(f"{'mode':<14} {'durée':>7} {'runs/s':>7} {'chevauchements':>15} {'inversions':>11} "
+          f"{'lecture p50':>12} {'p95':>7} {'lot p50':>8} {'p95':>7}")
+    for name, locks in (('ordonnanceur', True), ('sans verrous', False)):
+        records, waits, elapsed = asyncio.run(_run(services, scheduler, ops, locks, args.stagger))
+        overlaps, inversions = _check(records)
+        print(f"{name:<14} {elapsed:>6.2f}s {len(records) / elapsed:>7.1f} {overlaps:>15} {inversions:>11} "
+              f"{_percentile(waits['read'], 0.5):>11.3f}s {_percentile(waits['read'], 0.95):>6.3f}s "
+              f"{_percentile(waits['bulk'], 0.5):>7.3f}s {_percentile(waits['bulk'], 0.95):>6.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Compare l'analyse de la sortie d'Ansible pour une grosse action 'list_users' :
+
+- avant : callback `json` (un document lu en entier) + json.loads + summarize() ;
+- après : callback `ndjson_events` (un événement par ligne) lu ligne par ligne
+  par SummaryBuilder.
+
+Les sorties sont générées dans des fichiers temporaires avec la même forme que
+celle des vrais callbacks : le document `json` contient les faits getent de la
+tâche de collecte, que `ndjson_events` n'émet pas. Pour chaque taille, le script
+affiche le volume de la sortie, le temps d'analyse (médiane) et le pic mémoire
+mesuré par tracemalloc.
+
+Usage :
+    python benchmarks/bench_summarize.py [--sizes 1000 10000 100000] [-n 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HOST = '127.0.0.1'
+# Tâches du rôle linux_user ignorées pour 'list_users' (comme dans un vrai run).
+SKIPPED_TASKS = 12
+
+
+def _tasks(size):
+    """(nom de la tâche, résultat complet) d'un run 'list_users'."""
+    passwd = {f'user{i}': ['x', str(1000 + i), str(1000 + i), f'User {i},,,', f'/home/user{i}', '/bin/bash']
+              for i in range(size)}
+    yield 'Gathering Facts', {'changed': False, 'ansible_facts': {'ansible_hostname': 'managed'}}
+    for i in range(SKIPPED_TASKS):
+        yield f'Tâche {i}', {'changed': False, 'skipped': True, 'skip_reason': 'Conditional result was False'}
+    yield 'Lister les utilisateurs', {'changed': False, 'ansible_facts': {'getent_passwd': passwd},
+                                      'invocation': {'module_args': {'database': 'passwd'}}}
+    yield 'Afficher la liste des utilisateurs', {'changed': False, 'msg': json.dumps({'users': passwd})}
+
+
+def _write_json(path, size):
+    tasks = [{'task': {'name': name}, 'hosts': {HOST: res}} for name, res in _tasks(size)]
+    stats = {HOST: {'ok': 3, 'changed': 0, 'failures': 0, 'unreachable': 0,
+                    'skipped': SKIPPED_TASKS, 'rescued': 0, 'ignored': 0}}
+    with open(path, 'w') as f:
+        json.dump({'plays': [{'play': {'name': 'local_managed'}, 'tasks': tasks}], 'stats': stats}, f)
+
+
+def _write_ndjson(path, size):
+    with open(path, 'w') as f:
+        def emit(event):
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+        emit({'event': 'play_start', 'play': 'local_managed', 'time': 0.0})
+        for name, res in _tasks(size):
+            # Comme le callback : ni faits collectés ni paramètres d'appel.
+            res = {k: v for k, v in res.items() if k not in ('ansible_facts', 'invocation')}
+            status = 'skipped' if res.get('skipped') else 'ok'
+            emit({'event': 'result', 'status': status, 'play': 'local_managed', 'task': name,
+                  'action': 'debug', 'host': HOST, 'ignore_errors': False,
+                  'start': 0.0, 'end': 0.0, 'duration': 0.0, 'result': res})
+        emit({'event': 'stats', 'stats': {HOST: {'ok': 3, 'changed': 0, 'failures': 0, 'unreachable': 0,
+                                                 'skipped': SKIPPED_TASKS, 'rescued': 0, 'ignored': 0}},
+              'time': 0.0})
+
+
+def _parse_json(services, path):
+    # Comme proc.communicate() : toute la sortie est lue avant l'analyse.
+    with open(path, 'rb') as f:
+        stdout = f.read().decode(errors='replace')
+    return services.summarize(json.loads(stdout))
+
+
+def _parse_ndjson(services, path):
+    builder = services.SummaryBuilder()
+    with open(path, 'rb') as f:
+        for line in f:
+            builder.feed(line.decode(errors='replace'))
+    return builder.summary()
+
+
+def _measure(fn, services, path, n):
+    timings = []
+    for _ in range(n):
+        start = time.perf_counter()
+        summary = fn(services, path)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(services, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summary, statistics.median(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="nombres d'utilisateurs")
+    parser.add_argument('-n', type=int, default=5, help="nombre de mesures par format")
+    args = parser.parse_args()
+
+    os.environ.setdefault('METRICS_DB_FILE', os.path.join(tempfile.mkdtemp(), 'metrics.db'))
+    sys.path.insert(0, str(ROOT))
+    from app import services
+
+    workdir = tempfile.mkdtemp()
+    print(f"{'utilisateurs':>12} {'format':>7} {'sortie':>10} {'analyse':>10} {'pic mémoire':>12}")
+    for size in args.sizes:
+        json_path = os.path.join(workdir, f'{size}.json')
+        ndjson_path = os.path.join(workdir, f'{size}.ndjson')
+        _write_json(json_path, size)
+        _write_ndjson(ndjson_path, size)
+
+        before, before_time, before_peak = _measure(_parse_json, services, json_path, args.n)
+        after, after_time, after_peak = _measure(_parse_ndjson, services, ndjson_path, args.n)
+        if before['results'] != after['results']:
+            raise SystemExit(f"Résumés différents pour {size} utilisateurs.")
+
+        for label, path, elapsed, peak in (('json', json_path, before_time, before_peak),
+                                           ('ndjson', ndjson_path, after_time, after_peak)):
+            print(f"{size:>12} {label:>7} {os.path.getsize(path) / 1e6:>8.2f}MB "
+                  f"{elapsed * 1000:>8.1f}ms {peak / 1e6:>10.2f}MB")
+        print(f"{'':>12} gain : analyse x{before_time / after_time:.1f}, mémoire x{before_peak / after_peak:.1f}")
+
+
+if __name__ == '__main__':
+    main()
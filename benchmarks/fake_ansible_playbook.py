@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Faux `ansible-playbook` déterministe pour les benchmarks.
+
+Il accepte la même ligne de commande que le vrai binaire (seuls `-i`,
+`--forks` et `--extra-vars` sont lus), attend un délai configurable puis écrit
+sur stdout une sortie au format du callback choisi par ANSIBLE_STDOUT_CALLBACK,
+comme le ferait un vrai run : `ndjson_events` (un événement par ligne, voir
+callback_plugins/) ou `json`.
+
+Les hôtes sont ceux de la variable `target` (groupe 'local_managed' par
+défaut), résolus dans les fichiers .ini de l'inventaire (`-i`, fichier ou
+dossier). Ils sont traités par vagues de `--forks` hôtes : chaque vague dure
+le délai d'un hôte.
+
+Variables d'environnement :
+    FAKE_ANSIBLE_DELAY       délai en secondes avant de répondre (défaut 0.2)
+    FAKE_ANSIBLE_SIZE        nombre d'éléments dans les listes retournées (défaut 50)
+    FAKE_ANSIBLE_RECORDINGS  dossier d'enregistrements (ex: benchmarks/recordings) :
+                             rejoue toutes les tâches du rôle, comme un vrai run
+    FAKE_ANSIBLE_LAYOUT      organisation des rôles rejouée : 'dispatch' (défaut, un
+                             fichier de tâches par action) ou 'legacy' (toutes les
+                             tâches dans main.yml, gardées par 'when')
+    FAKE_ANSIBLE_TASK_DELAY  durée en secondes d'une tâche exécutée sur un hôte,
+                             ajoutée au délai (défaut 0) ; une tâche ignorée en
+                             coûte SKIP_COST fois moins
+    FAKE_ANSIBLE_STATE       dossier où sont mémorisés les hôtes préparés ; sans
+                             lui, tous les hôtes sont considérés préparés
+
+Sans enregistrement, la sortie se limite à la tâche qui affiche le résultat.
+Avec FAKE_ANSIBLE_RECORDINGS, les résultats enregistrés d'un vrai run du rôle
+(<rôle>.json) sont rejoués : tâches ignorées ('skipped') par les conditions
+'when', paramètres d'appel des modules, faits getent, boucles des opérations
+groupées, handlers, préparation de l'hôte... Les données (utilisateurs, sites,
+logs) y sont générées à la taille FAKE_ANSIBLE_SIZE. Le champ 'cost' d'une
+tâche enregistrée est sa durée relative (ex: 'apt' avec update_cache).
+
+Un champ `_delay` dans le payload remplace FAKE_ANSIBLE_DELAY pour ce run ;
+un champ `_fail` fait échouer la tâche de l'action avec ce message sur tous
+les hôtes ; `_fail_hosts` et `_unreachable_hosts` (listes de noms) ne font
+échouer, ou rendent injoignables, que ces hôtes. Dans un lot ('operations'),
+`_fail` sur une opération ne fait échouer que son élément de boucle ; avec
+l'action 'changeset', `_reject` simule le refus de la configuration par
+'nginx -t' : le bloc est alors annulé par sa section 'rescue'.
+"""
+import base64
+import datetime
+import glob
+import json
+import math
+import os
+import re
+import sys
+import time
+
+HOST = '127.0.0.1'
+ROLES = {'user': 'linux_user', 'webserver': 'nginx_vhost'}
+# Part de la durée d'une tâche payée quand elle est ignorée (évaluation du 'when').
+SKIP_COST = 0.2
+# Clés retirées des résultats par le callback ndjson_events (voir callback_plugins/).
+NDJSON_DROPPED_KEYS = ('ansible_facts', 'invocation', 'diff')
+
+
+def _option(argv, *names, default=None):
+    for i, arg in enumerate(argv):
+        if arg in names and i + 1 < len(argv):
+            return argv[i + 1]
+    return default
+
+
+def _extra_vars(argv):
+    value = _option(argv, '-e', '--extra-vars')
+    return json.loads(value) if value else {}
+
+
+def _inventory_groups(source):
+    """Groupes -> hôtes des fichiers .ini de l'inventaire (fichier ou dossier)."""
+    paths = sorted(glob.glob(os.path.join(source, '*.ini'))) if os.path.isdir(source) else [source]
+    groups = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        group = 'ungrouped'
+        with open(path) as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line.startswith('[') and line.endswith(']'):
+                    group = line[1:-1]
+                elif line and not group.endswith((':vars', ':children')):
+                    groups.setdefault(group, []).append(line.split()[0])
+    return groups
+
+
+def _resolve_hosts(groups, target):
+    """Hôtes d'un motif simple : noms d'hôtes ou de groupes séparés par ',' ou ':'."""
+    known = {h for hosts in groups.values() for h in hosts}
+    hosts = []
+    for name in target.replace(':', ',').split(','):
+        name = name.strip()
+        matched = sorted(known) if name == 'all' else groups.get(name) or ([name] if name in known else [])
+        hosts.extend(h for h in matched if h not in hosts)
+    return hosts
+
+
+def _display(action, payload, size):
+    """Reproduit les tâches 'Afficher ...' des rôles : (nom de la tâche, clé, valeur affichée)."""
+    if action == 'list_users':
+        users = {f'user{i}': ['x', str(1000 + i), str(1000 + i), f'User {i},,,', f'/home/user{i}',
+                              '/bin/bash' if i % 4 else '/usr/sbin/nologin'] for i in range(size)}
+        return 'Afficher la liste des utilisateurs', 'users', users
+    if action == 'list_groups':
+        if payload.get('username'):
+            return 'Afficher la liste des groupes', 'groups', [payload['username'], 'users']
+        groups = {f'group{i}': ['x', str(1000 + i), ','.join(f'user{j}' for j in range(i, min(i + 3, size)))]
+                  for i in range(size)}
+        return 'Afficher la liste des groupes', 'groups', groups
+    if action == 'list':
+        return 'Afficher la liste des sites', 'websites', [f'site{i}.conf' for i in range(size)]
+    if action == 'inventory':
+        sites = [f'site{i}.conf' for i in range(size)]
+        return "Afficher l'inventaire des sites", 'sites', {'available': sites, 'enabled': sites[::2]}
+    if action == 'status':
+        return 'Afficher le statut du site', 'status', 'enabled'
+    if action == 'config':
+        return 'Afficher la configuration', 'config', f"server {{ server_name {payload.get('server_name')}; }}"
+    if action == 'logs':
+        return 'Afficher les logs', 'logs', {'access': ['GET / 200'] * size, 'error': []}
+    return None, None, None
+
+
+def _debug_msg(action, payload, size):
+    name, key, value = _display(action, payload, size)
+    return (name, json.dumps({key: value})) if name else (None, None)
+
+
+def _recorded_values(action, payload, size):
+    """Valeurs des marqueurs '@...' d'un enregistrement, générées à la taille demandée."""
+    name, key, value = _display(action, payload, size)
+    now = time.strftime('%Y-%m-%d %H:%M:%S.000000')
+    values = {'@display': json.dumps({key: value}) if name else '', '@now': now, '@data': value,
+              '@include': f'{action}.yml'}
+    if action in ('list', 'inventory'):
+        sites = value if action == 'list' else value['available']
+        values['@files'] = [{'path': f'/etc/nginx/sites-available/{site}', 'mode': '0644', 'isdir': False,
+                             'isreg': True, 'islnk': False, 'uid': 0, 'gid': 0, 'size': 412, 'inode': 1048600 + i,
+                             'dev': 64769, 'nlink': 1, 'atime': 1718000000.0, 'mtime': 1718000000.0,
+                             'ctime': 1718000000.0, 'pw_name': 'root', 'gr_name': 'root', 'wusr': True,
+                             'rusr': True, 'xusr': False, 'wgrp': False, 'rgrp': True, 'xgrp': False,
+                             'woth': False, 'roth': True, 'xoth': False, 'isuid': False, 'isgid': False}
+                            for i, site in enumerate(sites)]
+        values['@count'] = len(sites)
+    elif action == 'config':
+        values['@content_b64'] = base64.b64encode(value.encode()).decode()
+    elif action == 'logs':
+        values['@data'] = value['access']
+        values['@lines'] = '\n'.join(value['access'])
+    return values
+
+
+_FIELD = re.compile(r'@(payload|item)\.(\w+)')
+
+
+def _fill(value, values, payload, item=None):
+    """Remplace les marqueurs d'un résultat enregistré ('@display', '@payload.username'...)."""
+    if isinstance(value, dict):
+        return {k: _fill(v, values, payload, item) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, values, payload, item) for v in value]
+    if not isinstance(value, str) or '@' not in value:
+        return value
+    if value == '@item':
+        return item
+    if value in values:
+        return values[value]
+    if '@failed_task' in value:
+        value = value.replace('@failed_task', values.get('@failed_task', ''))
+    fields = {'payload': payload, 'item': item or {}}
+    return _FIELD.sub(lambda m: str(fields[m.group(1)].get(m.group(2), '')), value)
+
+
+def _skipped(action):
+    return {'changed': False, 'skipped': True, 'skip_reason': 'Conditional result was False',
+            'false_condition': f"user_action == '{action}'"}
+
+
+def _runs(task, action, payload, layout='dispatch'):
+    # Conditions 'when' de la tâche : action(s) visée(s) et présence d'un champ du payload.
+    actions = task.get('legacy_actions', task['actions']) if layout == 'legacy' else task['actions']
+    if actions != '*' and action not in actions:
+        return False
+    if task.get('if_payload') and not payload.get(task['if_payload']):
+        return False
+    return not (task.get('unless_payload') and payload.get(task['unless_payload']))
+
+
+def _loaded(task, action, layout):
+    """La tâche fait-elle partie du run ? Avec 'dispatch', seul le fichier de l'action est chargé."""
+    if layout == 'legacy':
+        return task.get('legacy_actions') != []
+    return task.get('include') or task['actions'] == '*' or action in task['actions']
+
+
+def _task_name(task, action):
+    # Ansible rend le nom des tâches qui utilisent une variable ('Action {{ user_action }}').
+    return task['name'].replace('{{ user_action }}', action)
+
+
+def _replay(recording, action, payload, size, hosts, fail_hosts, unreachable_hosts,
+            layout='dispatch', provisioned=None):
+    """
+    Rejoue les tâches enregistrées d'un rôle pour chaque hôte. Un hôte en échec
+    échoue sur la première tâche propre à l'action, un hôte injoignable dès sa
+    première tâche ; ni l'un ni l'autre n'exécute les tâches suivantes.
+
+    Avec 'dispatch', les tâches de préparation ('provision') ne tournent que sur
+    les hôtes absents de `provisioned` (None : tous préparés) ; l'inclusion qui
+    les charge ('include') est ignorée ailleurs. Retourne aussi la durée
+    relative des tâches de chaque hôte (voir 'cost').
+
+    Les tâches d'un bloc ont une 'phase' : un échec en phase 'block' (élément
+    de boucle avec un champ `_fail`, ou résultat enregistré en échec) passe
+    l'hôte aux tâches 'rescue', puis toutes les tâches 'always' sont exécutées.
+    """
+    values = _recorded_values(action, payload, size)
+    stopped = set()
+    # Hôtes passés en 'rescue' (-> tâche en échec), et hôtes en échec qui n'exécutent plus que les tâches 'always'.
+    rescuing, doomed = {}, set()
+    stats = {h: {'ok': 0, 'changed': 0, 'failures': 0, 'unreachable': 0, 'skipped': 0, 'rescued': 0, 'ignored': 0}
+             for h in hosts}
+    work = {h: 0.0 for h in hosts}
+    # Actions qui préparent l'hôte (celles des tâches 'provision').
+    writes = any(t.get('provision') and action in t['actions'] for t in recording['tasks'])
+    tasks = []
+    for task in recording['tasks']:
+        if not _loaded(task, action, layout):
+            continue
+        runs = _runs(task, action, payload, layout)
+        if task.get('handler') and not runs:
+            continue
+        results = {}
+        phase = task.get('phase')
+        for host in hosts:
+            if host in stopped or (host in doomed and phase != 'always'):
+                continue
+            if (phase == 'rescue') != (host in rescuing) and phase in ('block', 'rescue'):
+                continue
+            provisions = (layout == 'dispatch' and writes and provisioned is not None
+                          and host not in provisioned)
+            if task.get('include') and provisions:
+                # L'inclusion est remplacée par les tâches qu'elle charge.
+                continue
+            if task.get('provision') and layout == 'dispatch' and not provisions:
+                continue
+            host_runs = runs and not task.get('include')
+            if host in unreachable_hosts:
+                res = {'changed': False, 'unreachable': True, 'msg': f"Failed to connect to the host via ssh: {host}"}
+                stats[host]['unreachable'] = 1
+                stopped.add(host)
+            elif not host_runs:
+                res = _skipped(action)
+                stats[host]['skipped'] += 1
+                work[host] += SKIP_COST
+            elif host in fail_hosts and task['actions'] != '*' and not task.get('provision'):
+                res = {'changed': False, 'failed': True, 'msg': payload.get('_fail') or 'Échec simulé.'}
+                stats[host]['failures'] = 1
+                stopped.add(host)
+            elif task.get('loop'):
+                loops = task['loop'] if isinstance(task['loop'], list) else [task['loop']]
+                ops = [op for op in payload.get('operations') or () if op.get('action') in loops]
+                if ops:
+                    items = [_fill(task['result'], values, payload, op) for op in ops]
+                    for op, item in zip(ops, items):
+                        if op.get('_fail'):
+                            item.update(changed=False, failed=True, msg=op['_fail'])
+                    failed = any(item.get('failed') for item in items)
+                    res = {'changed': any(item.get('changed') for item in items), 'results': items,
+                           'msg': 'One or more items failed' if failed else 'All items completed'}
+                    if failed:
+                        res['failed'] = True
+                    work[host] += task.get('cost', 1) * len(ops)
+                else:
+                    res = {'changed': False, 'skipped': True, 'skipped_reason': 'No items in the list', 'results': []}
+                    stats[host]['skipped'] += 1
+                    work[host] += SKIP_COST
+            else:
+                res = _fill(task['result'], {**values, '@failed_task': rescuing.get(host, '')}, payload)
+                work[host] += task.get('cost', 1)
+            if res.get('failed') and phase == 'block':
+                # Échec rattrapé par la section 'rescue' du bloc.
+                rescuing[host] = _task_name(task, action)
+                stats[host]['rescued'] = 1
+            elif res.get('failed'):
+                stats[host]['failures'] = 1
+                doomed.add(host)
+            elif not (res.get('skipped') or res.get('unreachable')):
+                stats[host]['ok'] += 1
+                stats[host]['changed'] += 1 if res.get('changed') else 0
+            results[host] = {**res, 'action': task['action']}
+        if results:
+            tasks.append({'task': {'name': _task_name(task, action), 'id': task['id']}, 'hosts': results})
+    return tasks, stats, work
+
+
+def _remember_provisioned(recording, tasks, state):
+    """Mémorise les hôtes qui ont terminé leur préparation (dernière tâche 'provision' réussie)."""
+    steps = [t['id'] for t in recording['tasks'] if t.get('provision')]
+    if not state or not steps:
+        return
+    os.makedirs(state, exist_ok=True)
+    for task in tasks:
+        if task['task'].get('id') != steps[-1]:
+            continue
+        for host, res in task['hosts'].items():
+            if not (res.get('failed') or res.get('unreachable') or res.get('skipped')):
+                open(os.path.join(state, f'{host}.provisioned'), 'w').close()
+
+
+def _minimal(action, payload, size, hosts, fail_hosts, unreachable_hosts):
+    """Sortie minimale : la tâche qui affiche le résultat, et la tâche en échec des hôtes en panne."""
+    name, msg = _debug_msg(action, payload, size)
+    results, stats = {}, {}
+    for host in hosts:
+        if host in unreachable_hosts:
+            results[host] = {'changed': False, 'unreachable': True,
+                             'msg': f"Failed to connect to the host via ssh: {host}"}
+        elif host in fail_hosts:
+            results[host] = {'changed': False, 'failed': True, 'msg': payload.get('_fail') or 'Échec simulé.'}
+        elif name:
+            results[host] = {'changed': False, 'msg': msg}
+        else:
+            results[host] = {'changed': True}
+        is_down = host in unreachable_hosts or host in fail_hosts
+        stats[host] = {'ok': 0 if is_down else 1, 'changed': 0 if name or is_down else 1,
+                       'failures': int(host in fail_hosts and host not in unreachable_hosts),
+                       'unreachable': int(host in unreachable_hosts),
+                       'skipped': 0, 'rescued': 0, 'ignored': 0}
+    # Les échecs viennent de la tâche de l'action ; les hôtes en succès affichent leur message.
+    down = fail_hosts | unreachable_hosts
+    tasks = []
+    if down & set(hosts):
+        tasks.append({'task': {'name': f'Action {action}'}, 'hosts': {h: results[h] for h in hosts if h in down}})
+    if set(hosts) - down:
+        tasks.append({'task': {'name': name or f'Action {action}'},
+                      'hosts': {h: results[h] for h in hosts if h not in down}})
+    return tasks, stats
+
+
+def _task_times(tasks, timing):
+    """(début, fin) de chaque tâche sur chaque hôte : les tâches d'un hôte se partagent le temps de sa vague."""
+    times, done = [], {host: 0 for host in timing}
+    for task in tasks:
+        bounds = {}
+        for host in task['hosts']:
+            wave_start, wave_end = timing[host]
+            step = (wave_end - wave_start) / sum(1 for t in tasks if host in t['hosts'])
+            bounds[host] = (wave_start + done[host] * step, wave_start + (done[host] + 1) * step)
+            done[host] += 1
+        times.append(bounds)
+    return times
+
+
+def _iso(timestamp):
+    # Format d'horodatage du callback `json` (UTC).
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+def _write_json(tasks, stats, timing):
+    """Sortie du callback `json` : chaque tâche est datée du premier début à la dernière fin parmi ses hôtes."""
+    for task, bounds in zip(tasks, _task_times(tasks, timing)):
+        if bounds:
+            task['task']['duration'] = {'start': _iso(min(b[0] for b in bounds.values())),
+                                        'end': _iso(max(b[1] for b in bounds.values()))}
+    output = {'plays': [{'play': {'name': 'local_managed'}, 'tasks': tasks}], 'stats': stats,
+              'custom_stats': {}, 'global_custom_stats': {}}
+    sys.stdout.write(json.dumps(output))
+
+
+def _write_ndjson(tasks, stats, timing):
+    """Même contenu que la sortie `json`, au format du callback `ndjson_events`."""
+    def emit(event):
+        sys.stdout.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    emit({'event': 'play_start', 'play': 'local_managed', 'time': time.time()})
+    for task, bounds in zip(tasks, _task_times(tasks, timing)):
+        for host, res in task['hosts'].items():
+            status = ('unreachable' if res.get('unreachable') else 'failed' if res.get('failed')
+                      else 'skipped' if res.get('skipped') else 'changed' if res.get('changed') else 'ok')
+            start, end = bounds[host]
+            res = {k: v for k, v in res.items()
+                   if k != 'action' and not k.startswith('_ansible') and k not in NDJSON_DROPPED_KEYS}
+            emit({'event': 'result', 'status': status, 'play': 'local_managed',
+                  'task': task['task']['name'], 'action': task['hosts'][host].get('action', 'debug'),
+                  'host': host, 'ignore_errors': False,
+                  'start': start, 'end': end, 'duration': round(end - start, 6), 'result': res})
+    emit({'event': 'stats', 'stats': stats, 'time': time.time()})
+
+
+def main():
+    argv = sys.argv[1:]
+    extra = _extra_vars(argv)
+    action = extra.get('user_action', '')
+    payload = extra.get('payload') or {}
+    delay = float(payload.get('_delay', os.environ.get('FAKE_ANSIBLE_DELAY', '0.2')))
+    size = int(os.environ.get('FAKE_ANSIBLE_SIZE', '50'))
+    forks = max(int(_option(argv, '-f', '--forks', default='5')), 1)
+
+    groups = _inventory_groups(_option(argv, '-i', '--inventory', default='inventory/hosts.ini'))
+    # Sans inventaire lisible, le groupe par défaut est l'hôte local.
+    groups.setdefault('local_managed', [HOST])
+    hosts = _resolve_hosts(groups, extra.get('target') or 'local_managed')
+
+    fail_hosts = set(hosts) if payload.get('_fail') else set(payload.get('_fail_hosts') or ())
+    unreachable_hosts = set(payload.get('_unreachable_hosts') or ())
+    layout = os.environ.get('FAKE_ANSIBLE_LAYOUT', 'dispatch')
+    task_delay = float(os.environ.get('FAKE_ANSIBLE_TASK_DELAY', '0'))
+    state = os.environ.get('FAKE_ANSIBLE_STATE')
+    provisioned = None
+    if state:
+        provisioned = {h for h in hosts if os.path.exists(os.path.join(state, f'{h}.provisioned'))}
+    recordings = os.environ.get('FAKE_ANSIBLE_RECORDINGS')
+    role = ROLES.get(extra.get('service'))
+    if recordings and role and os.path.exists(os.path.join(recordings, f'{role}.json')):
+        with open(os.path.join(recordings, f'{role}.json')) as f:
+            recording = json.load(f)
+        tasks, stats, work = _replay(recording, action, payload, size, hosts, fail_hosts, unreachable_hosts,
+                                     layout, provisioned)
+        _remember_provisioned(recording, tasks, state)
+    else:
+        tasks, stats = _minimal(action, payload, size, hosts, fail_hosts, unreachable_hosts)
+        work = {}
+
+    # Les hôtes sont traités par vagues de `forks` : une attente par vague,
+    # celle de l'hôte le plus long de la vague.
+    start = time.time()
+    timing = {}
+    for wave in range(math.ceil(len(hosts) / forks)):
+        wave_hosts = hosts[wave * forks:(wave + 1) * forks]
+        wave_start = time.time()
+        time.sleep(delay + task_delay * max(work.get(h, 0.0) for h in wave_hosts))
+        for host in wave_hosts:
+            timing[host] = (wave_start, time.time())
+
+    timing = {h: timing.get(h, (start, start)) for h in hosts}
+    if os.environ.get('ANSIBLE_STDOUT_CALLBACK') == 'ndjson_events':
+        _write_ndjson(tasks, stats, timing)
+    else:
+        _write_json(tasks, stats, timing)
+    if unreachable_hosts & set(hosts):
+        return 4
+    return 2 if any(s['failures'] for s in stats.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# Fichier: callback_plugins/ndjson_events.py
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = '''
+    name: ndjson_events
+    type: stdout
+    short_description: Émet un événement JSON compact par ligne, au fil de l'exécution.
+    description:
+        - Une ligne par résultat de tâche et par hôte, puis une ligne pour les statistiques finales.
+        - Utilisé par l'API (app/services.py) pour construire le résumé d'un run sans attendre la fin de la sortie.
+        - Les faits collectés (ansible_facts) et les paramètres d'appel des modules ne sont pas émis.
+    version_added: "2.0"
+'''
+
+# Clés retirées des résultats : volumineuses et inutiles au résumé.
+_DROPPED_KEYS = ('ansible_facts', 'invocation', 'diff')
+
+
+def _clean(result):
+    """Copie allégée d'un résultat de tâche (récursive pour les résultats de boucle)."""
+    cleaned = {}
+    for key, value in result.items():
+        if key.startswith('_ansible') or key in _DROPPED_KEYS:
+            continue
+        if key == 'results' and isinstance(value, list):
+            value = [_clean(item) if isinstance(item, dict) else item for item in value]
+        cleaned[key] = value
+    return cleaned
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'stdout'
+    CALLBACK_NAME = 'ndjson_events'
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self._play = None
+        # Début de chaque tâche, par hôte : (hôte, uuid de la tâche) -> horodatage.
+        self._starts = {}
+
+    def _emit(self, event):
+        self._display.display(json.dumps(event, separators=(',', ':'), default=str))
+
+    def v2_playbook_on_play_start(self, play):
+        self._play = play.get_name()
+        self._emit({'event': 'play_start', 'play': self._play, 'time': time.time()})
+
+    def v2_runner_on_start(self, host, task):
+        self._starts[(host.get_name(), task._uuid)] = time.time()
+
+    def _result(self, result, status, ignore_errors=False):
+        host = result._host.get_name()
+        end = time.time()
+        start = self._starts.pop((host, result._task._uuid), end)
+        self._emit({
+            'event': 'result',
+            'status': status,
+            'play': self._play,
+            'task': result.task_name or result._task.get_name(),
+            'action': result._task.action,
+            'host': host,
+            'ignore_errors': ignore_errors,
+            'start': start,
+            'end': end,
+            'duration': round(end - start, 6),
+            'result': _clean(result._result),
+        })
+
+    def v2_runner_on_ok(self, result):
+        self._result(result, 'changed' if result.is_changed() else 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._result(result, 'failed', ignore_errors=ignore_errors)
+
+    def v2_runner_on_skipped(self, result):
+        self._result(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._result(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        self._emit({
+            'event': 'stats',
+            'stats': {h: stats.summarize(h) for h in sorted(stats.processed.keys())},
+            'time': time.time(),
+        })
@@ -0,0 +1,36 @@
+"""
+Configuration commune des tests.
+
+Les tests tournent sans Ansible : le playbook est le faux ansible-playbook des
+benchmarks, qui rejoue les enregistrements des rôles (benchmarks/recordings)
+sans délai. La base des métriques et les sorties des runs sont écrites dans un
+dossier temporaire. Ces variables sont lues à l'import de l'application : elles
+sont fixées ici, avant tout import de app.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# Éléments des listes rejouées par le faux playbook (utilisateurs, groupes, sites).
+FAKE_SIZE = 6
+
+_workdir = tempfile.mkdtemp(prefix='api-tests-')
+os.environ['METRICS_DB_FILE'] = os.path.join(_workdir, 'metrics.db')
+os.environ['API_RUN_LOG_DIR'] = os.path.join(_workdir, 'run_logs')
+os.environ['API_INVENTORY'] = str(ROOT / 'inventory' / 'hosts.ini')
+os.environ['ANSIBLE_BACKEND'] = 'subprocess'
+os.environ['ANSIBLE_PLAYBOOK_PATH'] = str(ROOT / 'benchmarks' / 'fake_ansible_playbook.py')
+os.environ['FAKE_ANSIBLE_RECORDINGS'] = str(ROOT / 'benchmarks' / 'recordings')
+os.environ['FAKE_ANSIBLE_DELAY'] = '0'
+os.environ['FAKE_ANSIBLE_SIZE'] = str(FAKE_SIZE)
+os.environ.pop('API_NATIVE_READS', None)
+os.environ.pop('FAKE_ANSIBLE_STATE', None)
+
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from app import database  # noqa: E402
+
+database.init_db()
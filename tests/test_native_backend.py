@@ -0,0 +1,145 @@
+"""
+Backend natif des lectures (app/native_backend.py) face au chemin du playbook.
+
+Le backend natif lit une racine de test (passwd, group, sites-available,
+sites-enabled) remplie avec les données que rejoue le faux playbook : les deux
+chemins doivent donner la même réponse. Le cache et le regroupement des
+lectures identiques s'appliquent de la même façon, backend natif activé ou non.
+"""
+import asyncio
+import json
+import os
+
+import pytest
+
+import fake_ansible_playbook as fake
+from app import native_backend, services
+from conftest import FAKE_SIZE
+
+# Lectures comparées : sites générés par le faux playbook (site0.conf activé, site1.conf désactivé...).
+READS = [
+    ('user', 'list_users', {}),
+    ('user', 'list_groups', {}),
+    ('webserver', 'list', {}),
+    ('webserver', 'status', {'server_name': 'site0'}),
+    ('webserver', 'config', {'server_name': 'site1'}),
+]
+# Champs qui diffèrent d'un run à l'autre.
+VOLATILE = {'start', 'end', 'duration', 'run_id', 'stderr'}
+
+
+def _write_getent(path, entries):
+    with open(path, 'w') as f:
+        for name, fields in entries.items():
+            f.write(':'.join([name, *fields]) + '\n')
+
+
+def _read_getent(path):
+    """Comme le module getent : nom -> champs suivants de la ligne."""
+    with open(path) as f:
+        return {name: fields for name, *fields in (line.rstrip('\n').split(':') for line in f)}
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k not in VOLATILE}
+    if isinstance(value, list):
+        values = [_normalize(v) for v in value]
+        # Le module find rend les noms dans l'ordre du système de fichiers.
+        return sorted(values) if all(isinstance(v, str) for v in values) else values
+    return value
+
+
+@pytest.fixture
+def fixture_root(tmp_path, monkeypatch):
+    """Racine de test lue par le backend natif, identique aux données rejouées."""
+    etc = tmp_path / 'etc'
+    etc.mkdir()
+    _write_getent(etc / 'passwd', fake._display('list_users', {}, FAKE_SIZE)[2])
+    _write_getent(etc / 'group', fake._display('list_groups', {}, FAKE_SIZE)[2])
+    nginx = tmp_path / 'nginx'
+    (nginx / 'sites-available').mkdir(parents=True)
+    (nginx / 'sites-enabled').mkdir()
+    for i in range(FAKE_SIZE):
+        site = nginx / 'sites-available' / f'site{i}.conf'
+        site.write_text(f"server {{ server_name site{i}; }}")
+        if i % 2 == 0:
+            os.symlink(site, nginx / 'sites-enabled' / f'site{i}.conf')
+
+    monkeypatch.setattr(native_backend, '_passwd', lambda: _read_getent(etc / 'passwd'))
+    monkeypatch.setattr(native_backend, '_group', lambda: _read_getent(etc / 'group'))
+    monkeypatch.setattr(native_backend, 'NGINX_CONF_DIR', str(nginx))
+    return tmp_path
+
+
+@pytest.fixture
+def native(monkeypatch):
+    """Active ou non le backend natif le temps d'un test ; le cache est vidé."""
+    services.result_cache.clear()
+
+    def use(enabled):
+        monkeypatch.setattr(services.native_backend, 'enabled', enabled)
+    yield use
+    services.result_cache.clear()
+
+
+def test_native_reads_are_opt_in():
+    assert native_backend.NATIVE_READS_ENABLED is False
+    assert services.native_backend.local_host('user', 'list_users') is None
+
+
+@pytest.mark.parametrize('service, action, payload', READS)
+def test_native_response_matches_playbook(fixture_root, native, service, action, payload):
+    host = services.native_backend.inventory.local_host()
+    assert host == fake.HOST
+
+    native(False)
+    expected = asyncio.run(services._execute_playbook(service, action, payload))
+    native(True)
+    actual = asyncio.run(services._execute_native(service, action, payload, host))
+
+    assert expected['return_code'] == actual['return_code'] == 0
+    assert set(actual) == set(expected)
+    assert _normalize(actual['result']) == _normalize(expected['result'])
+
+
+@pytest.mark.parametrize('service, action, payload', READS)
+def test_native_summary_matches_recording(fixture_root, service, action, payload):
+    with open(os.path.join(os.environ['FAKE_ANSIBLE_RECORDINGS'], f'{fake.ROLES[service]}.json')) as f:
+        recording = json.load(f)
+    tasks, stats, _ = fake._replay(recording, action, payload, FAKE_SIZE, [fake.HOST], set(), set())
+    expected = {'plays': [{'play': {'name': native_backend.DEFAULT_TARGET}, 'tasks': tasks}], 'stats': stats}
+    _, actual = services.native_backend.run(service, action, payload, fake.HOST)
+
+    assert _normalize(services.summarize(actual)) == _normalize(services.summarize(expected))
+
+
+@pytest.mark.parametrize('enabled', [False, True], ids=['playbook', 'native'])
+def test_cache_and_single_flight_apply_to_both_backends(fixture_root, native, monkeypatch, enabled):
+    native(enabled)
+    runs = []
+    native_runs = []
+    execute, run_native = services._execute_playbook, services.native_backend.run
+
+    async def counted(*args, **kwargs):
+        runs.append(args)
+        await asyncio.sleep(0.05)
+        return await execute(*args, **kwargs)
+
+    def counted_native(*args, **kwargs):
+        native_runs.append(args)
+        return run_native(*args, **kwargs)
+
+    monkeypatch.setattr(services, '_execute_playbook', counted)
+    monkeypatch.setattr(services.native_backend, 'run', counted_native)
+
+    async def scenario():
+        concurrent = await asyncio.gather(*(services.run_playbook('user', 'list_users', {}) for _ in range(3)))
+        cached = await services.run_playbook('user', 'list_users', {})
+        return concurrent, cached
+
+    concurrent, cached = asyncio.run(scenario())
+    assert len(runs) == 1
+    assert len(native_runs) == (1 if enabled else 0)
+    assert all(result is concurrent[0] for result in concurrent)
+    assert cached['result'] == concurrent[0]['result']